@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -84,6 +86,121 @@ DATABASES = {
 }
 
 
+# Logging
+# Operational events of the app (pool rebuilds, fetch planning) go to the
+# console at INFO and above; set REMOTE_SENSING_LOG_LEVEL to change that
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'remote_sensing_app': {
+            'handlers': ['console'],
+            'level': os.environ.get('REMOTE_SENSING_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+
+# Raster cache
+# Decoded Sentinel Hub responses shared by all index views
+
+RASTER_CACHE_DIR = BASE_DIR / 'raster_cache'
+
+RASTER_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Requests reaching today may still receive new acquisitions
+RASTER_CACHE_VOLATILE_TTL = 15 * 60
+
+# Past dates are immutable, None keeps them until evicted
+RASTER_CACHE_IMMUTABLE_TTL = None
+
+# Hot tier of the cache: decoded rasters of past dates, and their class
+# rasters, as .npy files on tmpfs that every worker maps without a copy
+RASTER_HOT_TIER_DIR = Path('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()) / 'agrisense_rasters'
+
+RASTER_HOT_TIER_MAX_BYTES = 512 * 1024 ** 2
+
+
+# Request budget
+# Seconds an index or forecast request may take from start to answer, kept
+# under gunicorn's 30 s worker timeout so a slow request gets its 504
+# before the worker is killed. The catalog pre-flight, the downloads, the
+# CPU stages and the field forecasts draw on it in turn; the limits below
+# only cap each stage within it.
+REQUEST_BUDGET = 27
+
+
+# Sentinel Hub fetching
+# Per-date downloads of a forecast request run concurrently on a pool
+# shared by all requests of the worker
+
+SENTINEL_FETCH_WORKERS = 8
+
+# Seconds fetch_all waits for downloads when not given a deadline
+SENTINEL_FETCH_DEADLINE = 25
+
+
+# Scene index
+# Local SQLite copy of the Sentinel Hub catalog, answering availability
+# queries without a catalog search
+
+SCENE_INDEX_PATH = BASE_DIR / 'scene_index' / 'scenes.sqlite3'
+
+# Scenes keep being ingested for a few days after acquisition, so the index
+# searches the catalog again for the most recent days
+SCENE_INDEX_SETTLE_DAYS = 3
+
+# Seconds of a forecast request's budget its catalog pre-flight may take;
+# the dates of fields not checked by then are downloaded unchecked
+SCENE_INDEX_PREFLIGHT_TIMEOUT = 5
+
+# Forecast dates whose least cloudy scene has at least this much cloud cover
+# (percent, over the whole scene) are skipped without downloading
+FORECAST_MAX_CLOUD_COVER = 80
+
+
+# CPU pool
+# Reclassification, polygonization and forecasting run on a process pool,
+# so a large field never holds the request thread. gunicorn runs 3 workers,
+# each with its own pool.
+
+CPU_POOL_WORKERS = max(2, (os.cpu_count() or 1) // 3)
+
+# Seconds the CPU stages of one request may take, when not given a timeout
+CPU_POOL_TASK_TIMEOUT = 20
+
+# Tasks queued or running on a worker's pool at once. Tasks past their
+# timeout keep running and keep their slot, so a few runaway requests make
+# new ones fail fast rather than queue behind them.
+CPU_POOL_MAX_PENDING = CPU_POOL_WORKERS * 8
+
+
+# Field forecasts
+# Prophet models of the mean index of each field, fitted on a process pool
+# and cached on disk per field and index
+
+FIELD_FORECAST_CACHE_DIR = BASE_DIR / 'field_forecast_cache'
+
+FIELD_FORECAST_CACHE_MAX_ENTRIES = 10000
+
+FIELD_FORECAST_WORKERS = 2
+
+# Fits queued or running at once; fits past the deadline keep their slot
+# until they finish, and series beyond it are answered with their mean
+FIELD_FORECAST_MAX_PENDING = FIELD_FORECAST_WORKERS * 4
+
+# Seconds a request waits for its fits before answering with the mean of
+# the observations; fits still running are cached for the next request
+FIELD_FORECAST_DEADLINE = 3
+
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
     'http://127.0.0.1:3000'
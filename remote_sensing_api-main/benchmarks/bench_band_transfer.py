@@ -0,0 +1,123 @@
+"""Compare the UINT16 band transfer with the FLOAT32 one it replaced.
+
+Encodes the same 5-band composite of a large field both ways, as the
+GeoTIFF Sentinel Hub returns (uncompressed and deflated), and reports the
+payload size and the measured local processing time per response: reading
+the TIFF, decoding the bands and computing all nine indices. Network time
+is not simulated; it scales with the payload on a given link. Also reports
+the index differences the quantization causes; the largest come from
+pixels whose bands are near zero, where a ratio index amplifies them.
+
+Run from remote_sensing_api-main:  python benchmarks/bench_band_transfer.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from rasterio.io import MemoryFile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GIS.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from remote_sensing_app.band_stack import (BANDS, INDICES, NODATA, REFLECTANCE_NODATA, REFLECTANCE_SCALE,  # noqa: E402
+                                           BandStack, compute_index)
+
+# About 4 x 3 km at 10 m, like bench_features
+SHAPE = (1400, 2048)
+REPEATS = 3
+
+
+class FloatStack(BandStack):
+    # The FLOAT32 stack the views used before: bands as fetched, NODATA marked
+    def __init__(self, data):
+        self.data = data
+        self.key = None
+        self.valid = np.all(data != NODATA, axis=-1)
+
+    def __getitem__(self, band):
+        return self.data[..., BANDS.index(band)]
+
+
+def sample_reflectances(rng):
+    # Smooth reflectance fields with sensor-like noise, cloud-masked in places
+    frequencies = np.fft.fftfreq(SHAPE[0])[:, None] ** 2 + np.fft.fftfreq(SHAPE[1])[None] ** 2
+    bands = []
+    for mean in (0.04, 0.07, 0.05, 0.3, 0.18):
+        smooth = np.real(np.fft.ifft2(np.fft.fft2(rng.normal(size=SHAPE)) * np.exp(-frequencies * 2000)))
+        values = mean * (1 + 0.5 * smooth / smooth.std()) + rng.normal(0, 0.002, SHAPE)
+        bands.append(np.clip(values, 0.0001, 1))
+    reflectances = np.stack(bands, axis=-1).astype(np.float32)
+    clouds = rng.random(SHAPE) < 0.1
+    return reflectances, clouds
+
+
+def encode_float(reflectances, clouds):
+    data = reflectances.copy()
+    data[clouds] = NODATA
+    return data
+
+
+def encode_uint16(reflectances, clouds):
+    data = np.clip(np.round(reflectances / REFLECTANCE_SCALE), 1, 65535).astype(np.uint16)
+    data[clouds] = REFLECTANCE_NODATA
+    return data
+
+
+def to_tiff(data, compress=None):
+    profile = {'driver': 'GTiff', 'height': data.shape[0], 'width': data.shape[1], 'count': data.shape[2],
+               'dtype': data.dtype.name}
+    if compress:
+        profile['compress'] = compress
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dataset:
+            dataset.write(np.moveaxis(data, -1, 0))
+        return memfile.read()
+
+
+def process(tiff, stack_class):
+    with MemoryFile(tiff) as memfile, memfile.open() as dataset:
+        data = np.moveaxis(dataset.read(), 0, -1)
+    stack = stack_class(data)
+    return {name: compute_index(stack, name) for name in INDICES}
+
+
+def measure(tiff, stack_class):
+    seconds = min(timed(process, tiff, stack_class) for _ in range(REPEATS))
+    return seconds, process(tiff, stack_class)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(0)
+    reflectances, clouds = sample_reflectances(rng)
+    paths = [('float32', encode_float(reflectances, clouds), FloatStack),
+             ('uint16', encode_uint16(reflectances, clouds), BandStack)]
+
+    print(f"{'path':>8} {'tiff':>8} {'MiB':>7} {'process s':>9}")
+    indices = {}
+    for name, data, stack_class in paths:
+        for compress in (None, 'deflate'):
+            tiff = to_tiff(data, compress)
+            seconds, indices[name] = measure(tiff, stack_class)
+            print(f"{name:>8} {compress or 'raw':>8} {len(tiff) / 2 ** 20:>7.1f} {seconds:>9.2f}")
+
+    valid = ~clouds
+    for index in INDICES:
+        reference, quantized = indices['float32'][index][valid], indices['uint16'][index][valid]
+        finite = np.isfinite(reference) & np.isfinite(quantized)
+        difference = np.abs(reference[finite] - quantized[finite])
+        print(f"{index:>6} abs difference p99.9 {np.percentile(difference, 99.9):.2e} max {difference.max():.2e}")
+
+
+if __name__ == '__main__':
+    main()
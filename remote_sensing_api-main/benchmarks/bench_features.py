@@ -0,0 +1,126 @@
+"""Measure latency and peak allocation of the feature path on a large field.
+
+Compares three ways of turning the class rasters of several forecast dates
+into one dated FeatureCollection:
+
+- overlay: GeoJSON dicts from shapes(), GeoDataFrame.from_features,
+  gpd.overlay, to_json and json.loads, then a walk adding the date
+  (what the views did originally);
+- dicts: one GeoJSON collection per date from class_feature_collection,
+  then a walk renumbering and dating every feature;
+- batch: one FeatureBatch per date, concatenated and serialized once.
+
+Run from remote_sensing_api-main:  python benchmarks/bench_features.py
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.features import shapes
+from shapely.geometry import Polygon
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GIS.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from remote_sensing_app.classification import CLASS_BREAKS  # noqa: E402
+from remote_sensing_app.polygonize import FeatureBatch, class_feature_batch, class_feature_collection  # noqa: E402
+
+# A large estate: about 4 x 3 km at Sentinel-2's 10 m resolution, padded
+BOUNDS = (36.0, 8.0, 36.04, 8.028)
+SHAPE = (1400, 2048)
+DATES = ['2024-07-01', '2024-07-11', '2024-07-21']
+REPEATS = 3
+
+
+def sample_classes(rng):
+    # Spatially correlated NDVI-like values, so classes form field-sized patches
+    noise = rng.normal(size=SHAPE)
+    frequencies = np.fft.fftfreq(SHAPE[0])[:, None] ** 2 + np.fft.fftfreq(SHAPE[1])[None] ** 2
+    values = np.real(np.fft.ifft2(np.fft.fft2(noise) * np.exp(-frequencies * 4000)))
+    return CLASS_BREAKS['ndvi']((values - values.mean()) / values.std() * 0.25 + 0.4)
+
+
+def sample_field():
+    west, south, east, north = BOUNDS
+    angles = np.linspace(0, 2 * np.pi, 400, endpoint=False)
+    radii = 0.4 + 0.08 * np.sin(5 * angles)
+    return Polygon(zip(west + (0.5 + radii * np.cos(angles)) * (east - west),
+                       south + (0.5 + radii * np.sin(angles)) * (north - south)))
+
+
+def overlay_path(rasters, transform, field):
+    features = []
+    for date, classified in zip(DATES, rasters):
+        geometries = list(shapes(classified, mask=None, transform=transform))
+        geojson_data = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': geom, 'properties': {'class_no': value}} for geom, value in geometries if value != 0
+        ]}
+        geojson_polygon_df = gpd.GeoDataFrame(geometry=[field], crs='epsg:4326')
+        geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
+        for feature in json.loads(intersection_df.to_json())['features']:
+            feature['id'] = str(len(features))
+            feature['properties']['date'] = date
+            features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def dicts_path(rasters, transform, field):
+    features = []
+    for date, classified in zip(DATES, rasters):
+        for feature in class_feature_collection(classified, transform, field)['features']:
+            feature['id'] = str(len(features))
+            feature['properties']['date'] = date
+            features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def batch_path(rasters, transform, field):
+    return FeatureBatch.concat(
+        class_feature_batch(classified, transform, field).with_column('date', date)
+        for date, classified in zip(DATES, rasters)
+    ).to_geojson()
+
+
+def measure(path, *args):
+    seconds = min(timed(path, *args) for _ in range(REPEATS))
+
+    tracemalloc.start()
+    result = path(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, len(result['features'])
+
+
+def timed(path, *args):
+    start = time.perf_counter()
+    path(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rasters = [sample_classes(rng) for _ in DATES]
+    transform = rasterio.transform.from_bounds(*BOUNDS, SHAPE[1], SHAPE[0])
+    field = sample_field()
+
+    print(f"{'path':>8} {'features':>8} {'seconds':>8} {'peak MiB':>9}")
+    for name, path in [('overlay', overlay_path), ('dicts', dicts_path), ('batch', batch_path)]:
+        seconds, peak, features = measure(path, rasters, transform, field)
+        print(f"{name:>8} {features:>8} {seconds:>8.2f} {peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Compare the per-pixel trend forecast with the old per-polygon LinearRegression.
+
+The old path polygonized every feature date and fitted class numbers
+against the first vertex of every polygon (predict_ndvi and its siblings);
+the new one fits every pixel of a field's (date, y, x) cube and polygonizes
+the forecast once. Input features are field-date pairs, 10 dates per
+field. Run from remote_sensing_api-main:  python benchmarks/bench_forecast.py
+"""
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from shapely.geometry import Polygon
+from sklearn.linear_model import LinearRegression
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GIS.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from remote_sensing_app.classification import FORECAST_CLASS_BREAKS  # noqa: E402
+from remote_sensing_app.forecast import forecast_cube  # noqa: E402
+from remote_sensing_app.polygonize import index_feature_collection  # noqa: E402
+
+SHAPE = (354, 512)
+DATES_PER_FIELD = 10
+FEATURES = [10, 100, 1000]
+
+
+def sample_cube(rng):
+    # Spatially correlated NDVI that drifts over the dates, so the classes
+    # form field-sized patches that change from date to date
+    frequencies = np.fft.fftfreq(SHAPE[0])[:, None] ** 2 + np.fft.fftfreq(SHAPE[1])[None] ** 2
+
+    def smooth():
+        values = np.real(np.fft.ifft2(np.fft.fft2(rng.normal(size=SHAPE)) * np.exp(-frequencies * 1000)))
+        return (values - values.mean()) / values.std()
+
+    base, trend = smooth() * 0.2 + 0.4, smooth() * 0.1
+    days = np.arange(-10 * (DATES_PER_FIELD - 1), 1, 10)
+    cube = base + trend * days[:, None, None] / 30 + rng.normal(0, 0.02, size=(len(days), *SHAPE))
+    return days, cube.astype(np.float32)
+
+
+def sample_field(index):
+    west, south = 36 + index * 0.02, 8.0
+    bbox = (west, south, west + 0.01, south + 0.007)
+    angles = np.linspace(0, 2 * np.pi, 100, endpoint=False)
+    radii = 0.4 + 0.08 * np.sin(5 * angles)
+    return bbox, Polygon(zip(west + (0.5 + radii * np.cos(angles)) * 0.01, south + (0.5 + radii * np.sin(angles)) * 0.007))
+
+
+def linear_regression_predict(results):
+    # What predict_ndvi did with the per-date feature collections
+    valid_coordinates, valid_class_numbers, valid_results = [], [], []
+    for feature in results:
+        for item in feature['features']:
+            coords = item['geometry']['coordinates']
+            if coords and isinstance(coords[0], list) and coords[0] and len(coords[0][0]) == 2:
+                valid_coordinates.append(coords[0][0])
+                valid_results.append(item)
+                valid_class_numbers.append(item['properties']['class_no'])
+    coordinates_array = np.array(valid_coordinates)
+    model = LinearRegression()
+    model.fit(coordinates_array, np.array(valid_class_numbers))
+    sampled_indices = random.sample(range(len(coordinates_array)), min(1000, len(coordinates_array)))
+    predicted = model.predict(coordinates_array[sampled_indices]).astype(int)
+    return {'type': 'FeatureCollection', 'features': [
+        {'id': str(i), 'type': 'Feature', 'properties': {'class_no': class_no},
+         'geometry': {'type': 'Polygon', 'coordinates': valid_results[idx]['geometry']['coordinates']}}
+        for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted))
+    ]}
+
+
+def old_path(fields, breaks):
+    results = []
+    for (bbox, polygon), (days, cube) in fields:
+        for values in cube:
+            results.append(index_feature_collection(values, breaks, bbox, polygon))
+    return linear_regression_predict(results)
+
+
+def new_path(fields, breaks):
+    features = []
+    for (bbox, polygon), (days, cube) in fields:
+        prediction = forecast_cube(days, cube, [10])[0]
+        features.extend(index_feature_collection(prediction, breaks, bbox, polygon)['features'])
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    breaks = FORECAST_CLASS_BREAKS['ndvi']
+    cubes = [sample_cube(rng) for _ in range(4)]
+
+    print(f"{'features':>8} {'fields':>6} {'old s':>8} {'new s':>8} {'speedup':>8} {'old out':>8} {'new out':>8}")
+    for count in FEATURES:
+        field_count = count // DATES_PER_FIELD
+        # Fields reuse a few cubes; every field still gets its own fit and polygons
+        fields = [(sample_field(i), cubes[i % len(cubes)]) for i in range(field_count)]
+        old_seconds, old = timed(old_path, fields, breaks)
+        new_seconds, new = timed(new_path, fields, breaks)
+        print(f"{count:>8} {field_count:>6} {old_seconds:>8.2f} {new_seconds:>8.2f} {old_seconds / new_seconds:>7.1f}x "
+              f"{len(old['features']):>8} {len(new['features']):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Compare masked polygonization with the old shapes() + gpd.overlay clip.
+
+Run from remote_sensing_api-main:  python benchmarks/bench_polygonize.py
+"""
+import json
+import os
+import sys
+import timeit
+import warnings
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.features import shapes
+from shapely.geometry import Polygon, shape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GIS.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from remote_sensing_app.classification import CLASS_BREAKS  # noqa: E402
+from remote_sensing_app.polygonize import class_feature_collection  # noqa: E402
+
+BOUNDS = (10.0, 10.0, 10.01, 10.007)
+SHAPE = (354, 512)
+VERTICES = [10, 100, 1000]
+
+
+def overlay_feature_collection(classified_image, transform, polygon, class_property='class_no'):
+    # What index_feature_collection did before the field mask
+    geometries = list(shapes(classified_image, mask=None, transform=transform))
+    features = [{"type": "Feature", "geometry": geom, "properties": {class_property: value}} for geom, value in geometries if value != 0]
+    geojson_data = {"type": "FeatureCollection", "features": features}
+
+    geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
+    geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
+    return json.loads(intersection_df.to_json())
+
+
+def sample_index(rng):
+    # Spatially correlated NDVI-like values, so classes form field-sized patches
+    noise = rng.normal(size=SHAPE)
+    frequencies = np.fft.fftfreq(SHAPE[0])[:, None] ** 2 + np.fft.fftfreq(SHAPE[1])[None] ** 2
+    values = np.real(np.fft.ifft2(np.fft.fft2(noise) * np.exp(-frequencies * 1000)))
+    return ((values - values.mean()) / values.std() * 0.25 + 0.4).astype(np.float32)
+
+
+def sample_field(vertices, rng):
+    # A lobed, slightly jagged outline covering most of the bbox
+    west, south, east, north = BOUNDS
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = 0.4 + 0.08 * np.sin(5 * angles) + 0.01 * rng.standard_normal(vertices)
+    x = west + (0.5 + radii * np.cos(angles)) * (east - west)
+    y = south + (0.5 + radii * np.sin(angles)) * (north - south)
+    return Polygon(zip(x, y))
+
+
+def same_features(expected, actual):
+    if len(expected['features']) != len(actual['features']):
+        return False
+    remaining = [(f['properties'], shape(f['geometry'])) for f in actual['features']]
+    for feature in expected['features']:
+        geom = shape(feature['geometry'])
+        matches = [i for i, (properties, other) in enumerate(remaining) if properties == feature['properties'] and other.equals(geom)]
+        if len(matches) != 1:
+            return False
+        remaining.pop(matches[0])
+    return True
+
+
+def main():
+    rng = np.random.default_rng(0)
+    classified = CLASS_BREAKS['ndvi'](sample_index(rng))
+    transform = rasterio.transform.from_bounds(*BOUNDS, SHAPE[1], SHAPE[0])
+
+    print(f"{'vertices':>8} {'features':>8} {'overlay ms':>11} {'masked ms':>10} {'speedup':>8}")
+    for vertices in VERTICES:
+        field = sample_field(vertices, rng)
+        expected = overlay_feature_collection(classified, transform, field)
+        if not same_features(expected, class_feature_collection(classified, transform, field)):
+            raise SystemExit(f'Masked polygonization differs from the overlay for a {vertices}-vertex field')
+
+        overlay = min(timeit.repeat(lambda: overlay_feature_collection(classified, transform, field), number=3, repeat=3)) / 3
+        masked = min(timeit.repeat(lambda: class_feature_collection(classified, transform, field), number=3, repeat=3)) / 3
+        print(f"{vertices:>8} {len(expected['features']):>8} {overlay * 1e3:>11.1f} {masked * 1e3:>10.1f} {overlay / masked:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Compare the class-break reclassification with the old boolean-mask cascade.
+
+Run from remote_sensing_api-main:  python benchmarks/bench_reclassify.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GIS.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from remote_sensing_app.classification import CLASS_BREAKS  # noqa: E402
+
+SIZES = [(354, 512), (4096, 4096)]
+
+
+def cascade_ndvi(ndvi_array):
+    # The reclassify_ndvi the views used before the class-break tables
+    classified_array = np.zeros_like(ndvi_array, dtype=np.uint8)
+    classified_array[(ndvi_array <= 0) & (ndvi_array != -9999)] = 1
+    classified_array[(ndvi_array > 0) & (ndvi_array <= 0.1)] = 2
+    classified_array[(ndvi_array > 0.1) & (ndvi_array <= 0.2)] = 3
+    classified_array[(ndvi_array > 0.2) & (ndvi_array <= 0.4)] = 4
+    classified_array[(ndvi_array > 0.4) & (ndvi_array <= 0.5)] = 5
+    classified_array[(ndvi_array > 0.5) & (ndvi_array <= 0.6)] = 6
+    classified_array[(ndvi_array > 0.6) & (ndvi_array <= 0.7)] = 7
+    classified_array[(ndvi_array > 0.7) & (ndvi_array <= 1)] = 8
+    classified_array[(ndvi_array == -9999)] = 0
+    return classified_array
+
+
+def sample_raster(shape, rng):
+    values = rng.uniform(-1.2, 1.2, shape).astype(np.float32)
+    # Cloud-masked pixels, NaN from zero denominators and exact class edges
+    values[rng.random(shape) < 0.1] = -9999
+    values[rng.random(shape) < 0.01] = np.nan
+    edges = np.array([0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1], dtype=np.float32)
+    edge_mask = rng.random(shape) < 0.01
+    values[edge_mask] = rng.choice(edges, edge_mask.sum())
+    return values
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    rng = np.random.default_rng(0)
+    breaks = CLASS_BREAKS['ndvi']
+    print(f"{'raster':>12} {'cascade ms':>11} {'class breaks ms':>16} {'uint8 LUT ms':>13} {'speedup':>8}")
+    for shape in SIZES:
+        values = sample_raster(shape, rng)
+        if not np.array_equal(cascade_ndvi(values), breaks(values)):
+            raise SystemExit(f'Classification differs from the cascade for {shape}')
+
+        # Quantized input: NDVI scaled to 0..250, 255 reserved for nodata
+        codes = np.clip(np.nan_to_num((values + 1) * 125, nan=255), 0, 250).astype(np.uint8)
+        codes[values == -9999] = 255
+
+        number = 20 if shape[0] < 1000 else 2
+        cascade = best_of(lambda: cascade_ndvi(values), number)
+        table = best_of(lambda: breaks(values), number)
+        lut = best_of(lambda: breaks.classify_quantized(codes, scale=1 / 125, offset=-1, nodata=255), number)
+        label = f'{shape[1]}x{shape[0]}'
+        print(f'{label:>12} {cascade * 1e3:>11.2f} {table * 1e3:>16.2f} {lut * 1e3:>13.2f} {cascade / table:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+import json
+
+import numpy as np
+import rasterio
+import shapely
+from sentinelhub import SentinelHubRequest, DataCollection, MimeType, BBox, CRS, bbox_to_dimensions
+
+from .raster_cache import raster_cache
+
+BANDS = ('B02', 'B03', 'B04', 'B08', 'B11')
+
+# Nodata of the float index rasters computed from the bands
+NODATA = -9999
+
+# Bands travel as UINT16 codes of reflectance / REFLECTANCE_SCALE, half the
+# bytes of FLOAT32. Code 0 marks pixels without a valid sample; valid
+# reflectances are coded 1 or more.
+REFLECTANCE_SCALE = 1e-4
+REFLECTANCE_NODATA = 0
+
+# Metres per pixel of the fetched rasters, Sentinel-2's native 10 m bands
+RESOLUTION = 10
+
+# Sentinel Hub's limit on the pixels along either side of one request
+MAX_TILE_PIXELS = 2500
+
+# Dates fetched by one multi-temporal request at most; more are split over several
+MAX_DATES_PER_REQUEST = 8
+
+# Band values (pixels x bands x dates) of one multi-temporal response, 64 MiB
+# of UINT16 codes: small tiles still get MAX_DATES_PER_REQUEST dates a
+# request, a full MAX_TILE_PIXELS tile gets one
+MAX_REQUEST_VALUES = 32 * 2 ** 20
+
+# One ORBIT-mosaicked request returning the cloud-filtered first quartile of
+# every band the Sentinel-2 indices need, so all of them share one download.
+EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {
+        input: ["B02", "B03", "B04", "B08", "B11", "SCL"],
+        output: { bands: 5, sampleType: "UINT16" },
+        mosaicking: "ORBIT"
+    };
+}
+
+function preProcessScenes(collections) {
+    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
+        var orbitDateFrom = new Date(orbit.dateFrom);
+        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
+    });
+    return collections;
+}
+
+function getFirstQuartile(values) {
+    values.sort(function (a, b) { return a - b; });
+    return values[Math.floor(values.length / 4)];
+}
+
+// UINT16 code of a reflectance, 0 being reserved for no data
+function encode(reflectance) {
+    return Math.min(65535, Math.max(1, Math.round(reflectance * 10000)));
+}
+
+function validate(sample) {
+    var scl = sample.SCL;
+    // Exclude clouds, cloud shadows, and water, keep tree canopy (SCL = 4)
+    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
+        return false;
+    }
+    return true;
+}
+
+function evaluatePixel(samples) {
+    var b02 = [], b03 = [], b04 = [], b08 = [], b11 = [];
+
+    for (var i = 0; i < samples.length; i++) {
+        var sample = samples[i];
+        if (sample.B02 > 0 && sample.B03 > 0 && sample.B04 > 0 && sample.B08 > 0 && sample.B11 > 0 && validate(sample)) {
+            b02.push(sample.B02);
+            b03.push(sample.B03);
+            b04.push(sample.B04);
+            b08.push(sample.B08);
+            b11.push(sample.B11);
+        }
+    }
+
+    if (b02.length === 0) {
+        return [0, 0, 0, 0, 0]; // No valid data
+    }
+    return [encode(getFirstQuartile(b02)), encode(getFirstQuartile(b03)), encode(getFirstQuartile(b04)),
+            encode(getFirstQuartile(b08)), encode(getFirstQuartile(b11))];
+}
+"""
+
+
+# The same composite for several dates in one request: the orbits of every
+# requested date are composited separately, giving len(DATES) * 5 bands.
+# __DATES__ is replaced by the dates as a JSON list.
+MULTI_DATE_EVALSCRIPT = """
+//VERSION=3
+var DATES = __DATES__;
+
+function setup() {
+    return {
+        input: ["B02", "B03", "B04", "B08", "B11", "SCL"],
+        output: { bands: 5 * DATES.length, sampleType: "UINT16" },
+        mosaicking: "ORBIT"
+    };
+}
+
+function preProcessScenes(collections) {
+    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
+        return DATES.indexOf(orbit.dateFrom.substring(0, 10)) !== -1;
+    });
+    return collections;
+}
+
+function getFirstQuartile(values) {
+    values.sort(function (a, b) { return a - b; });
+    return values[Math.floor(values.length / 4)];
+}
+
+// UINT16 code of a reflectance, 0 being reserved for no data
+function encode(reflectance) {
+    return Math.min(65535, Math.max(1, Math.round(reflectance * 10000)));
+}
+
+function validate(sample) {
+    var scl = sample.SCL;
+    // Exclude clouds, cloud shadows, and water, keep tree canopy (SCL = 4)
+    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
+        return false;
+    }
+    return true;
+}
+
+function evaluatePixel(samples, scenes) {
+    var bands = [];
+    for (var d = 0; d < DATES.length; d++) {
+        bands.push([[], [], [], [], []]);
+    }
+
+    for (var i = 0; i < samples.length; i++) {
+        var sample = samples[i];
+        var d = DATES.indexOf(scenes.orbits[i].dateFrom.substring(0, 10));
+        if (d !== -1 && sample.B02 > 0 && sample.B03 > 0 && sample.B04 > 0 && sample.B08 > 0 && sample.B11 > 0 && validate(sample)) {
+            bands[d][0].push(sample.B02);
+            bands[d][1].push(sample.B03);
+            bands[d][2].push(sample.B04);
+            bands[d][3].push(sample.B08);
+            bands[d][4].push(sample.B11);
+        }
+    }
+
+    var result = [];
+    for (var d = 0; d < DATES.length; d++) {
+        if (bands[d][0].length === 0) {
+            result.push(0, 0, 0, 0, 0); // No valid data
+        } else {
+            for (var b = 0; b < 5; b++) {
+                result.push(encode(getFirstQuartile(bands[d][b])));
+            }
+        }
+    }
+    return result;
+}
+"""
+
+
+# The EVALSCRIPT composite, classified on Sentinel Hub: one UINT8 band of
+# class numbers per index, 0 where a pixel has no valid sample or no class.
+# __CLASSIFIERS__ is replaced by the classify functions of the indices and
+# __CLASSES__ by their calls on the index values.
+CLASS_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {
+        input: ["B02", "B03", "B04", "B08", "B11", "SCL"],
+        output: { bands: __BANDS__, sampleType: "UINT8" },
+        mosaicking: "ORBIT"
+    };
+}
+
+function preProcessScenes(collections) {
+    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
+        var orbitDateFrom = new Date(orbit.dateFrom);
+        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
+    });
+    return collections;
+}
+
+function getFirstQuartile(values) {
+    values.sort(function (a, b) { return a - b; });
+    return values[Math.floor(values.length / 4)];
+}
+
+// The float32 reflectance of its UINT16 code, as decode_reflectance gives
+// the bands fetched with EVALSCRIPT, so both classify the same values
+var SCALE = Math.fround(0.0001);
+function quantize(reflectance) {
+    return Math.fround(Math.min(65535, Math.max(1, Math.round(reflectance * 10000))) * SCALE);
+}
+
+function validate(sample) {
+    var scl = sample.SCL;
+    // Exclude clouds, cloud shadows, and water, keep tree canopy (SCL = 4)
+    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
+        return false;
+    }
+    return true;
+}
+__CLASSIFIERS__
+function evaluatePixel(samples) {
+    var v02 = [], v03 = [], v04 = [], v08 = [], v11 = [];
+
+    for (var i = 0; i < samples.length; i++) {
+        var sample = samples[i];
+        if (sample.B02 > 0 && sample.B03 > 0 && sample.B04 > 0 && sample.B08 > 0 && sample.B11 > 0 && validate(sample)) {
+            v02.push(sample.B02);
+            v03.push(sample.B03);
+            v04.push(sample.B04);
+            v08.push(sample.B08);
+            v11.push(sample.B11);
+        }
+    }
+
+    if (v02.length === 0) {
+        return __NO_DATA__; // No valid data
+    }
+    var b02 = quantize(getFirstQuartile(v02)), b03 = quantize(getFirstQuartile(v03)), b04 = quantize(getFirstQuartile(v04));
+    var b08 = quantize(getFirstQuartile(v08)), b11 = quantize(getFirstQuartile(v11));
+    return [__CLASSES__];
+}
+"""
+
+
+class BandStack:
+    """Per-pixel band composite of one bbox and date, shape (height, width, band).
+
+    ``data`` holds the UINT16 reflectance codes as fetched; indexing the
+    stack by band name decodes that band to float32 reflectance on first
+    use, so only the bands an index needs are ever decoded.
+
+    ``key`` identifies the stacks of past dates, which never change, so
+    rasters derived from them can be cached; it is None for recent dates.
+    """
+
+    def __init__(self, data, key=None):
+        self.data = data
+        self.key = key
+        self.valid = np.all(data != REFLECTANCE_NODATA, axis=-1)
+        self._bands = {}
+
+    def __getitem__(self, band):
+        if band not in self._bands:
+            self._bands[band] = decode_reflectance(self.data[..., BANDS.index(band)])
+        return self._bands[band]
+
+    @property
+    def shape(self):
+        return self.data.shape[:2]
+
+
+def decode_reflectance(codes):
+    """Float32 reflectance of UINT16 codes; no-data codes decode to 0."""
+    return np.multiply(codes, REFLECTANCE_SCALE, dtype=np.float32)
+
+
+def request_size(bbox, resolution=RESOLUTION, max_pixels=MAX_TILE_PIXELS):
+    """Pixel (width, height) of ``bbox`` at ``resolution``, coarsened to fit one request."""
+    width, height = bbox_to_dimensions(bbox, resolution)
+    scale = min(1, max_pixels / max(width, height, 1))
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def dates_per_request(size, max_values=MAX_REQUEST_VALUES):
+    """Dates of one multi-temporal request of a (width, height) tile, within ``max_values`` band values."""
+    width, height = size
+    return int(np.clip(max_values // (width * height * len(BANDS)), 1, MAX_DATES_PER_REQUEST))
+
+
+def tile_grid(bbox, resolution=RESOLUTION, max_pixels=MAX_TILE_PIXELS):
+    """Split ``bbox`` into tiles of at most ``max_pixels`` a side at ``resolution``.
+
+    The tiles share one pixel grid, so their rasters line up exactly at the
+    seams. Returns (tile bbox, (width, height)) pairs row by row from the
+    north; a bbox within the limit is a single tile.
+    """
+    width, height = (max(side, 1) for side in bbox_to_dimensions(bbox, resolution))
+    col_edges = np.linspace(0, width, -(-width // max_pixels) + 1).round().astype(int)
+    row_edges = np.linspace(0, height, -(-height // max_pixels) + 1).round().astype(int)
+    x_edges = bbox.min_x + (bbox.max_x - bbox.min_x) * col_edges / width
+    y_edges = bbox.max_y - (bbox.max_y - bbox.min_y) * row_edges / height
+
+    tiles = []
+    for r in range(len(row_edges) - 1):
+        for c in range(len(col_edges) - 1):
+            tile = BBox((x_edges[c], y_edges[r + 1], x_edges[c + 1], y_edges[r]), crs=bbox.crs)
+            tiles.append((tile, (int(col_edges[c + 1] - col_edges[c]), int(row_edges[r + 1] - row_edges[r]))))
+    return tiles
+
+
+def pixel_area(bounds, resolution=RESOLUTION):
+    width, height = bbox_to_dimensions(BBox(bounds, crs=CRS.WGS84), resolution)
+    return width * height
+
+
+def cluster_bboxes(polygon, resolution=RESOLUTION):
+    """Group the parts of a (Multi)Polygon into bboxes fetched separately.
+
+    Starting from one bbox per part, two bboxes are merged while they
+    overlap or their union has no more pixels at ``resolution`` than the
+    two of them, so parcels far apart are not fetched with the empty
+    ground between them. The bboxes returned never overlap.
+    """
+    clusters = [part.bounds for part in shapely.get_parts(polygon)]
+    areas = [pixel_area(bounds, resolution) for bounds in clusters]
+    # Only the cluster that just grew can have become mergeable, so each
+    # cluster is checked against the others until it stops growing, and
+    # every union's area is computed once: O(n^2) pixel_area calls
+    i = 0
+    while i < len(clusters):
+        a = clusters[i]
+        for j, b in enumerate(clusters):
+            if j == i:
+                continue
+            union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+            overlap = a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+            union_area = None if overlap else pixel_area(union, resolution)
+            if overlap or union_area <= areas[i] + areas[j]:
+                clusters[i], areas[i] = union, pixel_area(union, resolution) if overlap else union_area
+                del clusters[j], areas[j]
+                i -= j < i
+                break
+        else:
+            i += 1
+    return [BBox(bounds, crs=CRS.WGS84) for bounds in clusters]
+
+
+def tile_grid_size(tiles):
+    """A hundredth of a pixel of a tile_grid, in degrees: the snapping tolerance for stitching its tiles."""
+    tile, (width, _) = tiles[0]
+    return (tile.max_x - tile.min_x) / width / 100
+
+
+def fetch_band_stack(bbox, date, config, size=None):
+    sentinel_request = SentinelHubRequest(
+        evalscript=EVALSCRIPT,
+        input_data=[
+            SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
+        ],
+        responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
+        bbox=bbox,
+        size=size or request_size(bbox),
+        config=config,
+    )
+    return BandStack(raster_cache.get_data(sentinel_request)[0], immutable_key(sentinel_request))
+
+
+def fetch_band_stacks(bbox, dates, config, size=None):
+    """Band stacks of several ISO dates of one bbox from a single request.
+
+    The stacks are views of one (height, width, date, band) time cube, so
+    they share a pixel grid; a date without valid samples is all
+    REFLECTANCE_NODATA.
+    """
+    dates = list(dates)
+    sentinel_request = SentinelHubRequest(
+        evalscript=MULTI_DATE_EVALSCRIPT.replace('__DATES__', json.dumps(dates)),
+        input_data=[
+            SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(min(dates), max(dates))),
+        ],
+        responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
+        bbox=bbox,
+        size=size or request_size(bbox),
+        config=config,
+    )
+    data = raster_cache.get_data(sentinel_request)[0]
+    cube = data.reshape(*data.shape[:2], len(dates), len(BANDS))
+    key = immutable_key(sentinel_request)
+    return [BandStack(cube[:, :, i], key and f'{key}-{i}') for i in range(len(dates))]
+
+
+def class_evalscript(indices):
+    """CLASS_EVALSCRIPT classifying a list of (index, class_breaks), one band each."""
+    classifiers = ''.join(class_breaks.evalscript_function(f'classify{i}') for i, (_, class_breaks) in enumerate(indices))
+    classes = ', '.join(f'classify{i}({INDEX_EXPRESSIONS[index]})' for i, (index, _) in enumerate(indices))
+    return (CLASS_EVALSCRIPT.replace('__BANDS__', str(len(indices)))
+            .replace('__CLASSIFIERS__', classifiers)
+            .replace('__NO_DATA__', json.dumps([0] * len(indices)))
+            .replace('__CLASSES__', classes))
+
+
+def fetch_class_stack(bbox, date, indices, config, size=None):
+    """Class rasters of several indices of one bbox and date, classified by Sentinel Hub.
+
+    ``indices`` is a list of (index, class_breaks). Returns a UINT8
+    (height, width, index) array, a quarter of the bytes of one FLOAT32
+    index raster per index, that needs no reclassification here.
+    """
+    sentinel_request = SentinelHubRequest(
+        evalscript=class_evalscript(indices),
+        input_data=[
+            SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
+        ],
+        responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
+        bbox=bbox,
+        size=size or request_size(bbox),
+        config=config,
+    )
+    data = raster_cache.get_data(sentinel_request)[0]
+    return data.reshape(*data.shape[:2], len(indices))
+
+
+def immutable_key(sentinel_request):
+    if raster_cache.ttl_for(sentinel_request) is not None:
+        return None
+    return raster_cache.request_key(sentinel_request)
+
+
+# Index formulas, ported from the per-index evalscripts. B11 (SWIR) above 0.3
+# marks tree canopies, under which the denominators are adjusted.
+
+def ndvi(stack):
+    b04, b08, b11 = stack['B04'], stack['B08'], stack['B11']
+    return np.where(b11 > 0.3, (b08 - b04) / (b08 + b04 + b11), (b08 - b04) / (b08 + b04))
+
+
+def ndwi(stack):
+    b03, b08, b11 = stack['B03'], stack['B08'], stack['B11']
+    return np.where(b11 > 0.3, (b03 - b08) / (b03 + b08 + b11), (b03 - b08) / (b03 + b08))
+
+
+def ndmi(stack):
+    b04, b08, b11 = stack['B04'], stack['B08'], stack['B11']
+    # NDMI uses red rather than SWIR to detect vegetation under canopies
+    return np.where(b04 > 0.3, (b08 - b11) / (b08 + b11 + b04), (b08 - b11) / (b08 + b11))
+
+
+def cri(stack):
+    return stack['B04']
+
+
+def wst(stack):
+    b04, b08, b11 = stack['B04'], stack['B08'], stack['B11']
+    return (b04 - b08) / (b04 + b08 + b11)
+
+
+def arvi(stack):
+    b02, b04, b08, b11 = stack['B02'], stack['B04'], stack['B08'], stack['B11']
+    rb = 2 * b04 - b02
+    return np.where(b11 > 0.3, (b08 - rb) / (b08 + rb + b11), (b08 - rb) / (b08 + rb))
+
+
+def cari(stack):
+    b03, b04, b08, b11 = stack['B03'], stack['B04'], stack['B08'], stack['B11']
+    values = np.sqrt(((b08 - b03) / 150) ** 2 + (b04 - b03) ** 2)
+    return np.where(b11 > 0.3, values * 1.1, values)
+
+
+def mcari(stack):
+    b02, b03, b04, b08 = stack['B02'], stack['B03'], stack['B04'], stack['B08']
+    return (b04 - b03) - 0.2 * (b04 - b02) * (b04 / b08)
+
+
+# The same formulas as JavaScript expressions of the composite's bands, for
+# CLASS_EVALSCRIPT
+INDEX_EXPRESSIONS = {
+    'ndvi': '(b11 > 0.3 ? (b08 - b04) / (b08 + b04 + b11) : (b08 - b04) / (b08 + b04))',
+    'ndwi': '(b11 > 0.3 ? (b03 - b08) / (b03 + b08 + b11) : (b03 - b08) / (b03 + b08))',
+    'ndmi': '(b04 > 0.3 ? (b08 - b11) / (b08 + b11 + b04) : (b08 - b11) / (b08 + b11))',
+    'cri': 'b04',
+    'wst': '(b04 - b08) / (b04 + b08 + b11)',
+    'cyi': '(b11 > 0.3 ? (b08 - (2 * b04 - b02)) / (b08 + (2 * b04 - b02) + b11) : (b08 - (2 * b04 - b02)) / (b08 + (2 * b04 - b02)))',
+    'arvi': '(b11 > 0.3 ? (b08 - (2 * b04 - b02)) / (b08 + (2 * b04 - b02) + b11) : (b08 - (2 * b04 - b02)) / (b08 + (2 * b04 - b02)))',
+    'cari': 'Math.sqrt(Math.pow((b08 - b03) / 150, 2) + Math.pow(b04 - b03, 2)) * (b11 > 0.3 ? 1.1 : 1)',
+    'mcari': '(b04 - b03) - 0.2 * (b04 - b02) * (b04 / b08)',
+}
+
+INDICES = {
+    'ndvi': ndvi,
+    'ndwi': ndwi,
+    'ndmi': ndmi,
+    'cri': cri,
+    'wst': wst,
+    'cyi': arvi,  # The crop yield evalscript used the canopy-adjusted ARVI
+    'arvi': arvi,
+    'cari': cari,
+    'mcari': mcari,
+}
+
+
+def stack_feature_batches(data, indices, bbox, polygon, key=None):
+    """Class polygons of several indices of one band stack, one FeatureBatch each.
+
+    ``data`` is the stack's (height, width, band) array and ``indices`` a
+    list of (index, class_breaks, class_property). Given the stack's
+    ``key``, the class rasters are kept in the hot tier. Runs on the CPU
+    pool.
+    """
+    from .hot_tier import hot_tier
+    from .polygonize import class_feature_batch
+
+    stack = BandStack(data, key)
+    transform = rasterio.transform.from_bounds(*bbox, data.shape[1], data.shape[0])
+    batches = []
+    for index, class_breaks, class_property in indices:
+        def classify():
+            return class_breaks(compute_index(stack, index))
+        if key is None:
+            classified = classify()
+        else:
+            classified = hot_tier.cached(f'{key}-{index}-{class_breaks.key}', classify)
+        batches.append(class_feature_batch(classified, transform, polygon, class_property))
+    return batches
+
+
+def class_stack_feature_batches(classes, class_properties, bbox, polygon):
+    """Class polygons of a fetch_class_stack array, one FeatureBatch per index. Runs on the CPU pool."""
+    from .polygonize import class_feature_batch
+
+    transform = rasterio.transform.from_bounds(*bbox, classes.shape[1], classes.shape[0])
+    return [class_feature_batch(classes[..., i], transform, polygon, class_property)
+            for i, class_property in enumerate(class_properties)]
+
+
+def compute_index(stack, name):
+    """Compute one index from a band stack, NODATA where no valid sample exists."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.asarray(INDICES[name](stack), dtype=np.float32)
+    values = np.where(stack.valid, values, NODATA).astype(np.float32)
+    return values
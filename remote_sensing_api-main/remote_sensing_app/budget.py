@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+
+
+class RequestBudget:
+    """The time left to one request, shared by its stages one after another.
+
+    Each stage waits for ``remaining()`` seconds at most, optionally capped
+    by its own limit, so whatever a stage spends is gone for the next ones
+    and the request as a whole answers within ``seconds``
+    (REQUEST_BUDGET by default).
+    """
+
+    def __init__(self, seconds=None):
+        if seconds is None:
+            seconds = settings.REQUEST_BUDGET
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self, cap=None):
+        left = max(self.expires - time.monotonic(), 0)
+        return left if cap is None else min(left, cap)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+
+import numpy as np
+
+from .band_stack import NODATA
+
+
+class ClassBreaks:
+    """Upper class edges of an index, applied to a whole raster at once.
+
+    Class 1 holds values ``<= edges[0]`` and class ``k`` values in
+    ``(edges[k - 2], edges[k - 1]]``. Values above the last edge are left
+    unclassified (0) unless ``open_top`` adds one more class for them.
+    NODATA and NaN pixels are always 0.
+    """
+
+    def __init__(self, edges, open_top=False, nodata=NODATA):
+        if open_top:
+            edges = (*edges, np.inf)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        if np.any(np.diff(self.edges) <= 0):
+            raise ValueError('Class edges must be strictly increasing')
+        self.nodata = nodata
+        # Identifies the table in the keys of cached class rasters
+        self.key = hashlib.sha256(self.edges.tobytes() + repr(nodata).encode('utf-8')).hexdigest()[:16]
+        self._quantized_luts = {}
+
+    def __call__(self, values):
+        return self.classify(values)
+
+    def classify(self, values):
+        values = np.asarray(values)
+        if values.dtype.kind in 'ui' and values.dtype.itemsize <= 2:
+            return self.classify_quantized(values)
+
+        # Compare in the raster's precision, like the scalar comparisons did,
+        # so a float32 0.1 still lands in the class whose edge is 0.1
+        edges = self.edges.astype(values.dtype) if values.dtype.kind == 'f' else self.edges
+
+        # Counting the edges below each value is the searchsorted index, but
+        # a few in-place comparisons beat a per-pixel binary search on tables
+        # this short
+        classes = np.ones(values.shape, dtype=np.uint8)
+        above = np.empty(values.shape, dtype=bool)
+        for edge in edges:
+            np.greater(values, edge, out=above)
+            classes += above.view(np.uint8)
+        # After the loop 'above' marks values past the last edge
+        classes[above] = 0
+
+        if values.dtype.kind == 'f':
+            classes[np.isnan(values)] = 0
+        if self.nodata is not None:
+            classes[values == self.nodata] = 0
+        return classes
+
+    def classify_quantized(self, codes, scale=1, offset=0, nodata=None):
+        """Classify 8/16-bit codes through a lookup table of every code value.
+
+        Codes decode to float32 ``code * scale + offset``, like
+        decode_reflectance, so a code on an edge lands where its decoded
+        raster would; ``nodata`` is the code reserved for missing samples
+        (defaults to this table's NODATA).
+        """
+        codes = np.asarray(codes)
+        if nodata is None:
+            nodata = self.nodata
+        key = (codes.dtype.str, scale, offset, nodata)
+        lut = self._quantized_luts.get(key)
+        if lut is None:
+            info = np.iinfo(codes.dtype)
+            all_codes = np.arange(info.min, info.max + 1, dtype=np.int64)
+            decoded = np.multiply(all_codes, scale, dtype=np.float32)
+            decoded += np.float32(offset)
+            lut = self.classify(decoded)
+            if nodata is not None and info.min <= nodata <= info.max:
+                lut[nodata - info.min] = 0
+            self._quantized_luts[key] = lut
+        if codes.dtype.kind == 'i':
+            return lut[codes.astype(np.int64) - np.iinfo(codes.dtype).min]
+        return lut[codes]
+
+    def evalscript_function(self, name='classify'):
+        """This table as a JavaScript function for evalscripts, to classify on Sentinel Hub.
+
+        The function returns the class of one value like classify does,
+        comparing in float32 precision through Math.fround. CLASS_EVALSCRIPT
+        quantizes the reflectances like the UINT16 bands, but computes the
+        index in double precision where compute_index uses float32, so a
+        value within float32 rounding of an edge can land in the
+        neighbouring class.
+        """
+        nodata_check = '' if self.nodata is None else f' || value === {json.dumps(self.nodata)}'
+        return f"""
+function {name}(value) {{
+    var edges = {json.dumps(self.edges.tolist())};
+    if (isNaN(value){nodata_check}) {{
+        return 0;
+    }}
+    value = Math.fround(value);
+    var classNo = 1;
+    for (var i = 0; i < edges.length; i++) {{
+        if (value > Math.fround(edges[i])) {{
+            classNo++;
+        }}
+    }}
+    return classNo > edges.length ? 0 : classNo;
+}}
+"""
+
+
+# Class edges of every index, as used by the current views
+CLASS_BREAKS = {
+    'ndvi': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1)),
+    'ndwi': ClassBreaks((-1, 0, 0.1, 0.2, 0.3, 0.4, 0.5, 1)),
+    'ndmi': ClassBreaks((-1, 0, 0.1, 0.2, 0.3, 0.4, 0.5, 1)),
+    'cri': ClassBreaks((10, 20, 30, 40, 50, 60, 70, 100)),
+    'wst': ClassBreaks((-1, 0, 0.1, 0.2, 0.3, 0.4, 0.5, 1)),
+    'cyi': ClassBreaks((0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 1)),
+    'arvi': ClassBreaks((0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 1)),
+    'cari': ClassBreaks((0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 1)),
+    'mcari': ClassBreaks((0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 1)),
+    'nir': ClassBreaks((0.1, 0.3, 0.5, 0.7, 1)),
+}
+
+# The forecast views were written against different edges for some indices
+FORECAST_CLASS_BREAKS = {
+    'ndvi': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1)),
+    'ndwi': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1)),
+    'ndmi': ClassBreaks((-1, 0, 0.1, 0.2, 0.3, 0.4, 0.5, 1)),
+    'ripeness': ClassBreaks((0, 0.3), open_top=True),
+    'npci': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1)),
+    'arvi': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1)),
+    'cari': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7), open_top=True),
+    'mcari': ClassBreaks((0, 0.1, 0.2, 0.4, 0.5, 0.6, 0.7, 1)),
+}
@@ -0,0 +1,379 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.conf import settings
+
+from .budget import RequestBudget
+
+logger = logging.getLogger(__name__)
+
+
+class CpuTimeout(Exception):
+    """The CPU stages of one request did not finish before their timeout."""
+
+
+class PoolFuture(Future):
+    """The future of a ProcessPool task, cancelled only while its task still can be.
+
+    A task the executor has handed to a process, or queued for one, runs
+    to the end; its future stays pending until then, so whatever the task
+    reads must be kept until the future is done.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.task = None
+
+    def cancel(self):
+        task = self.task
+        if task is not None and not task.cancel():
+            return False
+        if self.done():
+            # Cancelling the task already cancelled this future, see _task_done
+            return self.cancelled()
+        if not super().cancel():
+            return False
+        # No executor runs this future to notify its waiters, so wait() and
+        # as_completed would not see it done until they time out
+        self.set_running_or_notify_cancel()
+        return True
+
+
+class ProcessPool:
+    """A spawned process pool that replaces itself when one of its processes dies.
+
+    A ProcessPoolExecutor whose process was killed (e.g. by the OOM killer)
+    is broken for good, so a task that hits a broken pool is retried once
+    on a fresh one. At most ``max_pending`` tasks are queued or running; a
+    task keeps its slot until it really ends, even after its caller gave
+    up waiting, so tasks that overrun their timeout make new ones fail
+    fast instead of queuing behind them.
+    """
+
+    def __init__(self, max_workers, max_pending, initializer=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.initializer = initializer
+        self.replaced = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned rather than forked, so the pool never inherits the
+                # locks of the worker's fetch threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=self.initializer,
+                )
+            return self._executor
+
+    def replace(self, broken):
+        """Drop ``broken`` so the next task starts a new pool, unless another thread already did."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.replaced += 1
+        logger.warning('Replacing a broken process pool of %d processes', self.max_workers)
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args, timeout=None):
+        """Start ``func(*args)`` and return its future.
+
+        Waits up to ``timeout`` seconds (None: forever) for a free slot and
+        raises TimeoutError without one. Cancelling the future cancels the
+        task if it has not been queued for a process yet, see PoolFuture.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f'{self.max_pending} tasks are already pending')
+        future = PoolFuture()
+        self._attempt(future, func, args, retries=1)
+        return future
+
+    def _attempt(self, future, func, args, retries):
+        executor = self.executor()
+        try:
+            task = executor.submit(func, *args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            # RuntimeError: another thread shut the pool down as broken
+            self._retry(future, func, args, retries, executor, e)
+            return
+        future.task = task
+        task.add_done_callback(lambda _: self._task_done(future, task, func, args, retries, executor))
+
+    def _task_done(self, future, task, func, args, retries, executor):
+        if task.cancelled():
+            future.cancel()
+            self._slots.release()
+            return
+        error = task.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._retry(future, func, args, retries, executor, error)
+            return
+        self._slots.release()
+        self._resolve(future, task.result if error is None else None, error)
+
+    def _retry(self, future, func, args, retries, executor, error):
+        self.replace(executor)
+        if retries and not future.cancelled():
+            self._attempt(future, func, args, retries - 1)
+            return
+        self._slots.release()
+        self._resolve(future, None, error)
+
+    @staticmethod
+    def _resolve(future, result, error):
+        # The caller may have cancelled the future while the task ran
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result())
+        except InvalidStateError:
+            pass
+
+
+class SharedArray:
+    """A NumPy array copied once into shared memory.
+
+    Pickling sends only the segment's name, shape and dtype, so a raster
+    reaches a pool process without being serialized, and several tasks can
+    read the same segment. ``SharedArray.empty`` makes one to fill in
+    place, so a raster built for the pool is never copied at all.
+    """
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self._allocate(array.shape, array.dtype)
+        self.array()[...] = array
+
+    @classmethod
+    def empty(cls, shape, dtype):
+        shared = cls.__new__(cls)
+        shared._allocate(shape, dtype)
+        return shared
+
+    def _allocate(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        self.shape, self.dtype = tuple(shape), dtype.str
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+
+    def array(self):
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # A view is still alive; the segment is unmapped once it is collected
+            pass
+
+    def unlink(self):
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class MappedArray:
+    """A read-only view of a hot-tier file that a pool process maps itself.
+
+    Arrays served by the hot tier are already in shared memory, so rather
+    than copying one into a SharedArray only its file, offset, shape and
+    strides are sent. The file is pinned until the task ends, so an
+    eviction meanwhile leaves the task's data in place.
+    """
+
+    def __init__(self, array, path, offset):
+        from .hot_tier import hot_tier
+
+        self.shape, self.dtype, self.strides, self.offset = array.shape, array.dtype.str, array.strides, offset
+        self.path = hot_tier.pin(path)
+
+    @classmethod
+    def of(cls, array):
+        """The MappedArray of ``array``, or None when it is not a read-only view of a hot-tier file."""
+        from .hot_tier import hot_tier
+
+        root = array
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        if array.flags.writeable or not isinstance(root, np.memmap) or not root.filename:
+            return None
+        if not hot_tier.owns(root.filename):
+            return None
+        offset = root.offset + array.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+        try:
+            return cls(array, root.filename, offset)
+        except OSError:
+            # Evicted since it was loaded
+            return None
+
+    def array(self):
+        mapped = np.memmap(self.path, mode='r')
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=mapped, offset=self.offset, strides=self.strides)
+
+    def close(self):
+        pass
+
+    def unlink(self):
+        from .hot_tier import hot_tier
+
+        hot_tier.unpin(self.path)
+
+
+# The arguments run_task hands to its function as arrays
+SHARED_TYPES = (SharedArray, MappedArray)
+
+
+def warm_up():
+    """Load the raster and geometry libraries once per pool process, not per task."""
+    import shapely
+
+    from .classification import CLASS_BREAKS
+    from .forecast import forecast_feature_batches
+
+    forecast_feature_batches([0, 1], np.ones((2, 2, 2), dtype=np.float32), [2], False, CLASS_BREAKS['ndvi'],
+                             (0, 0, 1, 1), shapely.box(0, 0, 1, 1))
+
+
+cpu_pool = ProcessPool(
+    max_workers=settings.CPU_POOL_WORKERS,
+    max_pending=settings.CPU_POOL_MAX_PENDING,
+    initializer=warm_up,
+)
+
+
+def run_task(func, args):
+    shared = [arg for arg in args if isinstance(arg, SHARED_TYPES)]
+    try:
+        return func(*[arg.array() if isinstance(arg, SHARED_TYPES) else arg for arg in args])
+    finally:
+        for arg in shared:
+            arg.close()
+
+
+def share_arrays(args, shared):
+    """Replace the NumPy arrays in ``args`` by SharedArrays, reusing those in ``shared``.
+
+    Read-only views of hot-tier files become MappedArrays instead, which
+    copy nothing. SharedArrays already in ``args`` are added to ``shared``
+    as they are, so they are released with the task like the copies.
+    """
+    shared_args = []
+    for arg in args:
+        if isinstance(arg, SharedArray):
+            shared[id(arg)] = arg
+        elif isinstance(arg, np.ndarray):
+            if id(arg) not in shared:
+                shared[id(arg)] = MappedArray.of(arg) or SharedArray(arg)
+            arg = shared[id(arg)]
+        shared_args.append(arg)
+    return shared_args
+
+
+def submit_shared(func, args, shared, timeout=None):
+    """cpu_pool.submit of run_task, raising CpuTimeout when the pool has no free slot."""
+    if timeout is None:
+        timeout = settings.CPU_POOL_TASK_TIMEOUT
+    try:
+        return cpu_pool.submit(run_task, func, share_arrays(args, shared), timeout=timeout)
+    except TimeoutError:
+        raise CpuTimeout(f'The CPU pool stayed full for {timeout:.1f} s')
+
+
+def submit(func, *args, timeout=None):
+    """Start ``func(*args)`` on the shared CPU pool and return its future.
+
+    Its arrays travel through shared memory, released when the task ends,
+    so a caller producing inputs one by one (the tiles of a large field)
+    can drop each as soon as it is submitted. Waits up to ``timeout``
+    seconds for a free slot, see submit_shared. Collect with results.
+    """
+    shared = {}
+    try:
+        future = submit_shared(func, args, shared, timeout)
+    except CpuTimeout:
+        release_when_done([], shared)
+        raise
+    release_when_done([future], shared)
+    return future
+
+
+def release_when_done(futures, shared):
+    """Unlink the arrays in ``shared`` once every one of ``futures`` is done.
+
+    A cancelled future is done at once, but a task the executor already
+    queued for a process cannot be cancelled and attaches to its arrays
+    whenever it starts, so they must outlive it.
+    """
+    pending = [len(futures)]
+    lock = threading.Lock()
+
+    def task_done(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        for array in shared.values():
+            array.unlink()
+
+    if not futures:
+        for array in shared.values():
+            array.unlink()
+    for future in futures:
+        future.add_done_callback(task_done)
+
+
+def results(futures, timeout=None):
+    """Results of submitted futures in order, raising CpuTimeout like run_all."""
+    if timeout is None:
+        timeout = settings.CPU_POOL_TASK_TIMEOUT
+
+    done, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        raise CpuTimeout(f'CPU stages did not finish within {timeout:.1f} s')
+    return [future.result() for future in futures]
+
+
+def run_all(func, jobs, timeout=None):
+    """Run ``func(*job)`` for every job on the shared CPU pool, results in job order.
+
+    NumPy arrays in a job travel through shared memory; an array passed to
+    several jobs is copied once. Raises CpuTimeout once ``timeout`` seconds
+    (CPU_POOL_TASK_TIMEOUT by default) have passed, and cancels whatever has
+    not started yet. A task already running keeps its pool process, and its
+    slot of CPU_POOL_MAX_PENDING, until it finishes; while every slot is
+    taken, new jobs wait for one, within the same ``timeout``, and raise
+    CpuTimeout the same way.
+    """
+    budget = RequestBudget(settings.CPU_POOL_TASK_TIMEOUT if timeout is None else timeout)
+    shared = {}
+    futures = []
+    try:
+        for job in jobs:
+            futures.append(submit_shared(func, job, shared, budget.remaining()))
+        return results(futures, budget.remaining())
+    except CpuTimeout:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        release_when_done(futures, shared)
+
+
+def run(func, *args, timeout=None):
+    """Run one ``func(*args)`` on the shared CPU pool, see run_all."""
+    return run_all(func, [args], timeout)[0]
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+
+from django.conf import settings
+
+fetch_executor = ThreadPoolExecutor(max_workers=settings.SENTINEL_FETCH_WORKERS, thread_name_prefix='sentinel-fetch')
+
+
+class FetchTimeout(Exception):
+    """The downloads of one request did not finish before its deadline."""
+
+
+def fetch_all(fetch, jobs, deadline=None):
+    """Run ``fetch(*job)`` for every job on the shared fetch pool.
+
+    Yields ``(index, result)`` in completion order, so the caller can process
+    each download while the others are still in flight. Raises FetchTimeout
+    once ``deadline`` seconds (SENTINEL_FETCH_DEADLINE by default) have passed,
+    and cancels whatever has not started yet.
+    """
+    if deadline is None:
+        deadline = settings.SENTINEL_FETCH_DEADLINE
+
+    futures = {fetch_executor.submit(fetch, *job): index for index, job in enumerate(jobs)}
+    try:
+        # as_completed measures the deadline from here, so the caller's
+        # processing between results counts against it as well
+        for future in as_completed(futures, timeout=deadline):
+            yield futures[future], future.result()
+    except TimeoutError:
+        raise FetchTimeout(f'Downloads did not finish within {deadline:.1f} s')
+    finally:
+        for future in futures:
+            future.cancel()
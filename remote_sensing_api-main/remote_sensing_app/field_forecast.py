@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import wait
+
+import numpy as np
+from django.conf import settings
+
+from .cpu_pool import ProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Prophet needs at least two dated values; shorter series forecast their mean
+MIN_OBSERVATIONS = 2
+
+forecast_pool = ProcessPool(
+    max_workers=settings.FIELD_FORECAST_WORKERS,
+    max_pending=settings.FIELD_FORECAST_MAX_PENDING,
+)
+
+
+def field_key(polygon, index):
+    """Cache key of the ``index`` series of one field geometry."""
+    return hashlib.sha256(index.encode('utf-8') + b':' + polygon.wkb).hexdigest()
+
+
+def run_model(observations, forecast_dates, model_json=None, refit=True):
+    """Fit Prophet to ``observations`` and predict ``forecast_dates``, in a pool process.
+
+    ``observations`` is a list of (ISO date, value). Given the ``model_json``
+    of an earlier fit of the same field, a refit starts from its parameters,
+    so a few new dates converge in a few iterations; without ``refit`` the
+    earlier model only predicts. Returns the model as JSON and one
+    prediction per forecast date.
+    """
+    import pandas as pd
+    from prophet.serialize import model_from_json, model_to_json
+
+    previous = model_from_json(model_json) if model_json is not None else None
+    if refit:
+        history = pd.DataFrame({'ds': pd.to_datetime([date for date, _ in observations]),
+                                'y': [value for _, value in observations]})
+        try:
+            model = new_model().fit(history, init=warm_start_params(previous) if previous is not None else None)
+        except Exception:
+            # More dates can add changepoints or a yearly term, which the
+            # earlier parameters do not fit, so start over
+            model = new_model().fit(history)
+    else:
+        model = previous
+
+    predicted = model.predict(pd.DataFrame({'ds': pd.to_datetime(forecast_dates)}))
+    return model_to_json(model), [float(value) for value in predicted['yhat']]
+
+
+def new_model():
+    from prophet import Prophet
+
+    # Sentinel revisits are days apart, so there is no weekly or daily cycle
+    # to fit, and the point forecast is all the views return
+    return Prophet(weekly_seasonality=False, daily_seasonality=False, uncertainty_samples=0)
+
+
+def warm_start_params(model):
+    return {
+        'k': model.params['k'][0][0],
+        'm': model.params['m'][0][0],
+        'sigma_obs': model.params['sigma_obs'][0][0],
+        'delta': model.params['delta'][0],
+        'beta': model.params['beta'][0],
+    }
+
+
+class FieldForecastCache:
+    """On-disk cache of the Prophet models fitted to the scalar series of fields.
+
+    Each (field, index) entry holds every observation seen so far, the model
+    fitted to them and the forecasts already made with it. Entries are JSON
+    files shared by all workers, evicted least recently written first past
+    ``max_entries``.
+    """
+
+    def __init__(self, directory, max_entries):
+        self.directory = str(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.fits = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def load(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as entry_file:
+                return json.load(entry_file)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+    def store(self, key, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+                json.dump(entry, tmp_file)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def forecast(self, series, deadline=None):
+        """Forecast the scalar series of several fields on the shared process pool.
+
+        ``series`` is a list of (key, {ISO date: value}, forecast dates).
+        New observations are merged into those cached for the key; a series
+        with nothing new is answered from the cached forecasts, or predicted
+        by the cached model, and one with new dates is refitted from the
+        cached model's parameters. Returns one (model, {date: value}) per
+        series, where model is 'prophet', or 'mean' for series too short to
+        fit, fits that failed and fits still running after ``deadline``
+        seconds (FIELD_FORECAST_DEADLINE by default). Fits left running are
+        cached when they finish; while FIELD_FORECAST_MAX_PENDING fits are
+        pending, further series get the mean without queuing a fit.
+        """
+        if deadline is None:
+            deadline = settings.FIELD_FORECAST_DEADLINE
+
+        results = [None] * len(series)
+        futures = {}
+        for i, (key, observations, forecast_dates) in enumerate(series):
+            forecast_dates = list(dict.fromkeys(str(date) for date in forecast_dates))
+            entry = self.load(key) or {'observations': {}, 'model': None, 'forecasts': {}}
+            merged = {**entry['observations'], **{str(date): float(value) for date, value in observations.items()}}
+            results[i] = ('mean', dict.fromkeys(forecast_dates, float(np.mean(list(merged.values())))))
+
+            refit = merged != entry['observations'] or entry['model'] is None
+            if not refit and all(date in entry['forecasts'] for date in forecast_dates):
+                with self._lock:
+                    self.hits += 1
+                results[i] = ('prophet', {date: entry['forecasts'][date] for date in forecast_dates})
+                continue
+            if len(merged) < MIN_OBSERVATIONS:
+                continue
+
+            try:
+                future = forecast_pool.submit(run_model, sorted(merged.items()), forecast_dates, entry['model'], refit,
+                                              timeout=0)
+            except TimeoutError:
+                continue
+            if refit:
+                with self._lock:
+                    self.fits += 1
+            future.add_done_callback(self._stored(key, entry, merged, forecast_dates, refit))
+            futures[future] = i
+
+        done, _ = wait(futures, timeout=deadline)
+        for future in done:
+            if future.exception() is None:
+                _, predicted = future.result()
+                results[futures[future]] = ('prophet', dict(zip(results[futures[future]][1], predicted)))
+        return results
+
+    def _stored(self, key, entry, observations, forecast_dates, refit):
+        def store_result(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                logger.warning("Field forecast failed", exc_info=future.exception())
+                return
+            model_json, predicted = future.result()
+            forecasts = {} if refit else dict(entry['forecasts'])
+            forecasts.update(zip(forecast_dates, predicted))
+            self.store(key, {'observations': observations, 'model': model_json, 'forecasts': forecasts})
+        return store_result
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'fits': self.fits}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+
+field_forecast_cache = FieldForecastCache(
+    directory=settings.FIELD_FORECAST_CACHE_DIR,
+    max_entries=settings.FIELD_FORECAST_CACHE_MAX_ENTRIES,
+)
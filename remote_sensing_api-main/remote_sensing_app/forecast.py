@@ -0,0 +1,84 @@
+import numpy as np
+
+from .band_stack import NODATA
+from .polygonize import index_feature_batch
+
+YEAR = 365.25
+
+FORECAST_MODELS = ('trend', 'seasonal')
+
+# Pixels fitted at once. A chunk's float64 temporaries, its (date, pixel)
+# samples and (pixel, k, k) normal equations, take about 100 MB however
+# large the tile
+FIT_CHUNK_PIXELS = 256 * 1024
+
+
+def design_matrix(days, seasonal=False):
+    """Regressors of a linear trend in years, plus an annual harmonic when ``seasonal``."""
+    years = np.asarray(days, dtype=np.float64) / YEAR
+    columns = [np.ones_like(years), years]
+    if seasonal:
+        columns += [np.sin(2 * np.pi * years), np.cos(2 * np.pi * years)]
+    return np.stack(columns, axis=-1)
+
+
+def fit_chunk(design, samples, nodata):
+    """Least-squares model of every pixel's series in a (date, pixel) block, in one batched solve.
+
+    ``samples`` is ``nodata`` where a date has no valid sample. Each pixel is
+    fitted to its own valid samples only, through the normal equations
+    ``(X'WX) c = X'Wy`` stacked for all pixels. Pixels with fewer samples
+    than the model has coefficients keep their mean. Returns (pixel,
+    coefficient) coefficients and the sample count of each pixel.
+    """
+    values = samples.astype(np.float64)
+    weights = (values != nodata) & np.isfinite(values)
+    values = np.where(weights, values, 0)
+    weights = weights.astype(np.float64)
+
+    gram = np.einsum('tp,ti,tj->pij', weights, design, design)
+    moments = np.einsum('tp,ti->pi', weights * values, design)
+    counts = weights.sum(axis=0)
+
+    coefficients = np.zeros_like(moments)
+    solvable = counts >= design.shape[1]
+    if solvable.any():
+        # A tiny ridge keeps seasonal fits of same-phase dates solvable
+        ridge = 1e-9 * np.eye(design.shape[1])
+        coefficients[solvable] = np.linalg.solve(gram[solvable] + ridge, moments[solvable][..., None])[..., 0]
+    sparse = ~solvable & (counts > 0)
+    coefficients[sparse, 0] = moments[sparse, 0] / counts[sparse]
+    return coefficients, counts
+
+
+def forecast_cube(days, cube, forecast_days, seasonal=False, nodata=NODATA):
+    """Predict the index raster of every forecast day from a (date, y, x) cube.
+
+    Days are numbers of days on one axis (e.g. relative to the last
+    observation). Predictions are clipped to the range of values observed
+    anywhere in the cube, so a steep trend cannot leave the index's class
+    table; pixels without any valid sample stay ``nodata``, so a cube
+    without any is all ``nodata``.
+    """
+    valid = (cube != nodata) & np.isfinite(cube)
+    if not valid.any():
+        return np.full((len(forecast_days), *cube.shape[1:]), nodata, dtype=np.float32)
+    low, high = cube.min(where=valid, initial=np.inf), cube.max(where=valid, initial=-np.inf)
+    del valid
+
+    # Fitted and predicted FIT_CHUNK_PIXELS pixels at a time
+    design, forecast_design = design_matrix(days, seasonal), design_matrix(forecast_days, seasonal)
+    samples = cube.reshape(len(design), -1)
+    predicted = np.full((len(forecast_days), samples.shape[1]), nodata, dtype=np.float32)
+    for start in range(0, samples.shape[1], FIT_CHUNK_PIXELS):
+        chunk = predicted[:, start:start + FIT_CHUNK_PIXELS]
+        coefficients, counts = fit_chunk(design, samples[:, start:start + FIT_CHUNK_PIXELS], nodata)
+        has_data = counts > 0
+        chunk[:, has_data] = np.clip(forecast_design @ coefficients[has_data].T, low, high)
+    return predicted.reshape(len(forecast_days), *cube.shape[1:])
+
+
+def forecast_feature_batches(days, cube, forecast_days, seasonal, class_breaks, bbox, polygon, class_property='class_no'):
+    """Forecast a field's cube and polygonize the class raster of every forecast day, one FeatureBatch each."""
+    predictions = forecast_cube(days, cube, forecast_days, seasonal)
+    return [index_feature_batch(prediction, class_breaks, bbox, polygon, class_property) for prediction in predictions]
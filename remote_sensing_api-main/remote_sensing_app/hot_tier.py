@@ -0,0 +1,152 @@
+import fcntl
+import os
+import tempfile
+import threading
+import uuid
+
+import numpy as np
+from django.conf import settings
+
+
+class HotTier:
+    """Host-local tier of decoded rasters in shared memory.
+
+    Arrays are .npy files on a tmpfs (/dev/shm) that the workers and their
+    pool processes map read-only, so a hit neither reads nor decodes
+    anything and every process shares the same pages. A file's mtime is its
+    last use, so eviction is least recently used across processes; once
+    the tier grows past ``max_bytes`` whichever process gets the eviction
+    lock file trims it. Arrays returned are read-only. A file ``pin``-ned
+    for a pool task stays readable under its pin name even once evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self.bytes_served += array.nbytes
+        return array
+
+    def put(self, key, array):
+        if not isinstance(array, np.ndarray) or array.dtype.hasobject or array.nbytes > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.save(tmp_file, array)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def cached(self, key, compute):
+        """``compute()``, served from the tier when ``key`` is already in it."""
+        array = self.get(key)
+        if array is None:
+            array = compute()
+            self.put(key, array)
+        return array
+
+    def pin(self, path):
+        """Hard-link a tier file under a pin name that eviction skips; returns the pin's path."""
+        pin_path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex}.pin')
+        os.link(path, pin_path)
+        return pin_path
+
+    def unpin(self, pin_path):
+        try:
+            os.remove(pin_path)
+        except FileNotFoundError:
+            pass
+
+    def owns(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.directory)
+
+    def evict(self):
+        with open(os.path.join(self.directory, 'evict.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is already trimming the tier
+                return
+            try:
+                self._evict()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pin'):
+                self._remove_stale_pin(entry)
+                continue
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # Processes that mapped the file keep their pages until they let go
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def _remove_stale_pin(self, entry):
+        # A pin outlives its task only when the process that made it died
+        pid = int(entry.name.split('-', 1)[0])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            self.unpin(entry.path)
+        except PermissionError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'bytes_served': self.bytes_served}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+
+hot_tier = HotTier(
+    directory=settings.RASTER_HOT_TIER_DIR,
+    max_bytes=settings.RASTER_HOT_TIER_MAX_BYTES,
+)
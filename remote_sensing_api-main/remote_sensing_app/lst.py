@@ -0,0 +1,155 @@
+import numpy as np
+from rasterio.features import geometry_mask
+from rasterio.transform import from_bounds
+from sentinelhub import SentinelHubRequest, DataCollection, MimeType
+
+from .band_stack import request_size
+from .raster_cache import raster_cache
+
+# Metres per pixel of the fetched stacks, Sentinel-3 OLCI's native 300 m
+LST_RESOLUTION = 300
+
+# Orbit slots of one stack; a date rarely has more Sentinel-3 passes
+LST_MAX_ORBITS = 4
+
+# Bands of every orbit slot: SLSTR brightness temperature and OLCI radiances
+LST_BANDS = ('S8', 'B06', 'B08', 'B11')
+
+# Emissivity model of the original evalscript
+NDVI_SOIL = 0.2
+NDVI_VEGETATION = 0.8
+WATER_EMISSIVITY = 0.991
+SOIL_EMISSIVITY = 0.966
+VEGETATION_EMISSIVITY = 0.973
+CAVITY_EFFECT = 0.009
+WAVELENGTH = 0.000010854
+RHO = 0.01438
+
+LST_MODES = ('mean', 'max', 'std')
+
+# The raw bands of every Sentinel-3 orbit of the date, in up to
+# LST_MAX_ORBITS slots of len(LST_BANDS) FLOAT32 bands. Unused slots are 0,
+# which the validity checks of land_surface_temperature reject.
+LST_EVALSCRIPT = """
+//VERSION=3
+var MAX_ORBITS = __MAX_ORBITS__;
+
+function setup() {
+    return {
+        input: [
+            { datasource: "S3SLSTR", bands: ["S8"] },
+            { datasource: "S3OLCI", bands: ["B06", "B08", "B11"] }
+        ],
+        output: { bands: 4 * MAX_ORBITS, sampleType: "FLOAT32" },
+        mosaicking: "ORBIT"
+    };
+}
+
+function evaluatePixel(samples) {
+    var orbits = Math.min(samples.S3SLSTR.length, samples.S3OLCI.length, MAX_ORBITS);
+    var result = [];
+    for (var i = 0; i < MAX_ORBITS; i++) {
+        if (i < orbits) {
+            result.push(samples.S3SLSTR[i].S8, samples.S3OLCI[i].B06, samples.S3OLCI[i].B08, samples.S3OLCI[i].B11);
+        } else {
+            result.push(0, 0, 0, 0);
+        }
+    }
+    return result;
+}
+""".replace('__MAX_ORBITS__', str(LST_MAX_ORBITS))
+
+
+def fetch_lst_stack(bbox, date, config):
+    """Raw Sentinel-3 bands of one bbox and date, shape (height, width, orbit, band).
+
+    The stack does not depend on how it is reduced, so every mode and view
+    shares one cached download per bbox and date.
+    """
+    sentinel_request = SentinelHubRequest(
+        evalscript=LST_EVALSCRIPT,
+        input_data=[
+            SentinelHubRequest.input_data(
+                data_collection=DataCollection.SENTINEL3_SLSTR,
+                identifier="S3SLSTR",
+                time_interval=(date, date),
+            ),
+            SentinelHubRequest.input_data(
+                data_collection=DataCollection.SENTINEL3_OLCI,
+                identifier="S3OLCI",
+                time_interval=(date, date),
+            ),
+        ],
+        responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
+        bbox=bbox,
+        size=request_size(bbox, resolution=LST_RESOLUTION),
+        config=config,
+    )
+    data = raster_cache.get_data(sentinel_request)[0]
+    return data.reshape(*data.shape[:2], LST_MAX_ORBITS, len(LST_BANDS))
+
+
+def land_surface_temperature(stack):
+    """Land surface temperature in Celsius of every orbit of a stack, NaN where a sample is invalid.
+
+    Ports the evalscript's model: emissivity from an NDVI of OLCI B08 and
+    B11, by class thresholds or the vegetation fraction between them, and
+    the S8 brightness temperature corrected for it.
+    """
+    s8, b06, b08, b11 = (stack[..., LST_BANDS.index(band)].astype(np.float64) for band in LST_BANDS)
+    valid = (s8 > 173) & (s8 < 65000) & (b06 > 0) & (b08 > 0) & (b11 > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        brightness = s8 - 273.15
+        ndvi = (b08 - b11) / (b08 + b11)
+        vegetation_fraction = ((ndvi - NDVI_SOIL) / (NDVI_VEGETATION - NDVI_SOIL)) ** 2
+        emissivity = np.select(
+            [ndvi < 0, ndvi < NDVI_SOIL, ndvi > NDVI_VEGETATION],
+            [WATER_EMISSIVITY, SOIL_EMISSIVITY, VEGETATION_EMISSIVITY],
+            VEGETATION_EMISSIVITY * vegetation_fraction + SOIL_EMISSIVITY * (1 - vegetation_fraction) + CAVITY_EFFECT,
+        )
+        lst = brightness / (1 + (WAVELENGTH * brightness / RHO) * np.log(emissivity))
+    return np.where(valid, lst, np.nan).transpose(2, 0, 1)
+
+
+def lst_statistics(stack):
+    """Per-pixel mean, max and std (of the samples, like the evalscript) over the orbits, in one pass.
+
+    Returns a dict of (height, width) rasters by LST_MODES, NaN where a
+    pixel has too few valid samples.
+    """
+    lst = land_surface_temperature(stack)
+    valid = ~np.isnan(lst)
+    values = np.where(valid, lst, 0)
+    counts = valid.sum(axis=0)
+    totals = values.sum(axis=0)
+    squares = (values * values).sum(axis=0)
+    maxima = np.where(valid, lst, -np.inf).max(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = totals / counts
+        variance = np.maximum(squares - counts * mean * mean, 0) / (counts - 1)
+    return {
+        'mean': mean,
+        'max': np.where(counts > 0, maxima, np.nan),
+        'std': np.where(counts > 1, np.sqrt(variance), np.nan),
+    }
+
+
+def field_lst(stack, bbox, polygon):
+    """The field means of lst_statistics, by LST_MODES, over the pixels the polygon touches.
+
+    A mode without any valid pixel in the field is None; returns None when
+    no pixel has a valid sample.
+    """
+    statistics = lst_statistics(stack)
+    height, width = stack.shape[:2]
+    in_field = geometry_mask([polygon], out_shape=(height, width), transform=from_bounds(*bbox, width, height),
+                             invert=True, all_touched=True)
+
+    result = {}
+    for mode in LST_MODES:
+        values = statistics[mode][in_field]
+        values = values[np.isfinite(values)]
+        result[mode] = float(values.mean()) if values.size else None
+    return result if result['mean'] is not None else None
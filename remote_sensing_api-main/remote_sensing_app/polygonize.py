@@ -0,0 +1,248 @@
+import itertools
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.features import geometry_mask, shapes
+from scipy import ndimage, sparse
+from scipy.sparse import csgraph
+
+POLYGON_TYPES = ('Polygon', 'MultiPolygon')
+
+
+class FeatureBatch:
+    """Columnar features passed between the polygonize and forecast stages.
+
+    ``geometries`` is a shapely geometry array and every column a NumPy
+    array of one property, so batches are concatenated and annotated
+    without building a dict per feature; GeoJSON is written once, by
+    to_geojson at the response boundary.
+    """
+
+    def __init__(self, geometries, columns=None, regions=None, border=None):
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+        # Set by class_feature_batch for stitch_batches: the region number
+        # of each feature in its tile's raster, and the tile's TileBorder
+        self.regions = None if regions is None else np.asarray(regions)
+        self.border = border
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def with_column(self, name, value):
+        """A batch sharing this one's arrays, plus a column of one value for every feature."""
+        return FeatureBatch(self.geometries, {**self.columns, name: np.full(len(self), value)}, self.regions, self.border)
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return cls([])
+        names = batches[0].columns
+        return cls(np.concatenate([batch.geometries for batch in batches]),
+                   {name: np.concatenate([batch.columns[name] for batch in batches]) for name in names})
+
+    def to_geojson(self):
+        columns = {name: values.tolist() for name, values in self.columns.items()}
+        return {'type': 'FeatureCollection', 'features': [
+            {
+                'id': str(i),
+                'type': 'Feature',
+                'properties': {name: values[i] for name, values in columns.items()},
+                'geometry': geojson_geometry(geom),
+            }
+            for i, geom in enumerate(self.geometries)
+        ]}
+
+
+class TileBorder:
+    """The class regions along the edges of one tile's raster, for stitch_batches.
+
+    ``bounds`` is the tile's (west, south, east, north) and ``count`` the
+    number of its regions. ``regions`` and ``classes`` map every side
+    ('north', 'south', 'west', 'east') to the region number and class of
+    each pixel along it, from the west or the north.
+    """
+
+    def __init__(self, bounds, regions, classified_image, count):
+        self.bounds = tuple(bounds)
+        self.count = count
+        self.regions = raster_sides(regions)
+        self.classes = raster_sides(classified_image)
+
+
+def raster_sides(array):
+    return {'north': array[0].copy(), 'south': array[-1].copy(), 'west': array[:, 0].copy(), 'east': array[:, -1].copy()}
+
+
+def index_feature_collection(index_array, reclassify, bbox, polygon, class_property='class_no'):
+    """Reclassify an index raster and return its class polygons clipped to the field as GeoJSON."""
+    return index_feature_batch(index_array, reclassify, bbox, polygon, class_property).to_geojson()
+
+
+def index_feature_batch(index_array, reclassify, bbox, polygon, class_property='class_no'):
+    """index_feature_collection as a FeatureBatch."""
+    transform = rasterio.transform.from_bounds(*bbox, index_array.shape[1], index_array.shape[0])
+    return class_feature_batch(reclassify(index_array), transform, polygon, class_property)
+
+
+def class_feature_collection(classified_image, transform, polygon, class_property='class_no'):
+    """Polygonize a class raster inside the field polygon, as GeoJSON."""
+    return class_feature_batch(classified_image, transform, polygon, class_property).to_geojson()
+
+
+def class_feature_batch(classified_image, transform, polygon, class_property='class_no'):
+    """Polygonize a class raster inside the field polygon.
+
+    Gives the same features as polygonizing the whole raster and running
+    ``gpd.overlay`` against the field, without building either GeoDataFrame:
+    only pixels the field touches are polygonized, and only the regions
+    crossing the field boundary are clipped. The class of each feature is
+    the float ``class_property`` column; the batch also records the regions
+    along the raster's edges, for stitch_batches.
+    """
+    field = polygon_parts(polygon)
+    if field is None:
+        return FeatureBatch([], {class_property: np.empty(0)})
+    in_field = geometry_mask([field], out_shape=classified_image.shape, transform=transform, invert=True, all_touched=True)
+
+    # Label the class regions on the whole raster, so a region that leaves
+    # a concave field and comes back still ends up as one feature
+    regions, region_classes = label_regions(classified_image)
+    border = TileBorder(rasterio.transform.array_bounds(*classified_image.shape, transform), regions,
+                        classified_image, len(region_classes) - 1)
+    pieces, piece_regions = [], []
+    for geom, region in shapes(regions, mask=in_field & (regions > 0), transform=transform):
+        pieces.append(polygon_from_geojson(geom))
+        piece_regions.append(int(region))
+    pieces = np.array(pieces, dtype=object)
+
+    tree = shapely.STRtree(pieces)
+    inside = np.zeros(len(pieces), dtype=bool)
+    inside[tree.query(field, predicate='contains')] = True
+    crossing = np.zeros(len(pieces), dtype=bool)
+    crossing[tree.query(field, predicate='intersects')] = True
+    crossing &= ~inside
+    pieces[crossing] = [polygon_parts(geom) for geom in shapely.intersection(pieces[crossing], field)]
+
+    # Pieces of one region never share an edge, so their parts can be
+    # collected into a MultiPolygon without a union
+    region_parts = {}
+    for region, geom, keep in zip(piece_regions, pieces, inside | crossing):
+        if keep and geom is not None:
+            region_parts.setdefault(region, []).extend(getattr(geom, 'geoms', [geom]))
+
+    regions = sorted(region_parts)
+    geometries = np.empty(len(regions), dtype=object)
+    geometries[:] = [parts[0] if len(parts) == 1 else shapely.MultiPolygon(parts)
+                     for parts in (region_parts[region] for region in regions)]
+    return FeatureBatch(geometries, {class_property: region_classes[regions].astype(np.float64)}, regions, border)
+
+
+def stitch_batches(batches, grid_size, class_property='class_no'):
+    """Concatenate the FeatureBatches of adjacent tiles, dissolving the regions cut by a seam.
+
+    ``batches`` holds one class_feature_batch per tile of one pixel grid.
+    Facing pixels of one class across a seam join their regions, inside
+    the field or not, so regions connect as label_regions would connect
+    them on a single raster. The features of each joined region are
+    snapped to a grid of ``grid_size``, so coordinates either side of a
+    seam line up, and unioned into a single feature, a MultiPolygon if the
+    field clips it into parts. The batches carry only the class column.
+    """
+    batch = FeatureBatch.concat(batches)
+    if len(batches) < 2 or not len(batch) or any(tile_batch.border is None for tile_batch in batches):
+        return batch
+
+    # Regions of all tiles, numbered on one axis
+    borders = [tile_batch.border for tile_batch in batches]
+    offsets = np.cumsum([0] + [border.count for border in borders])
+    left, right = [], []
+    for a, b in itertools.permutations(range(len(borders)), 2):
+        sides = facing_sides(borders[a].bounds, borders[b].bounds, grid_size)
+        if sides is None:
+            continue
+        regions_a, regions_b = borders[a].regions[sides[0]], borders[b].regions[sides[1]]
+        if len(regions_a) != len(regions_b):
+            continue
+        joined = (regions_a > 0) & (borders[a].classes[sides[0]] == borders[b].classes[sides[1]])
+        left.append(regions_a[joined] - 1 + offsets[a])
+        right.append(regions_b[joined] - 1 + offsets[b])
+    if not left:
+        return batch
+    left, right = np.concatenate(left), np.concatenate(right)
+    graph = sparse.coo_matrix((np.ones(len(left)), (left, right)), shape=(offsets[-1], offsets[-1]))
+    _, labels = csgraph.connected_components(graph, directed=False)
+
+    feature_regions = np.concatenate([tile_batch.regions - 1 + offset for tile_batch, offset in zip(batches, offsets)])
+    components = labels[feature_regions]
+    joined = np.bincount(components)[components] > 1
+    if not joined.any():
+        return batch
+
+    classes = batch.columns[class_property]
+    order = np.flatnonzero(joined)[np.argsort(components[joined], kind='stable')]
+    groups = np.split(order, np.flatnonzero(np.diff(components[order])) + 1)
+    snapped = batch.geometries.copy()
+    snapped[order] = shapely.set_precision(batch.geometries[order], grid_size)
+    dissolved = np.empty(len(groups), dtype=object)
+    dissolved[:] = [shapely.union_all(snapped[group], grid_size=grid_size) for group in groups]
+    values = classes[[group[0] for group in groups]]
+
+    return FeatureBatch(np.concatenate([batch.geometries[~joined], dissolved]),
+                        {class_property: np.concatenate([classes[~joined], values])})
+
+
+def facing_sides(bounds_a, bounds_b, tolerance):
+    """The sides by which tile ``a`` borders tile ``b`` to its east or south, or None."""
+    west_a, south_a, east_a, north_a = bounds_a
+    west_b, south_b, east_b, north_b = bounds_b
+    if np.allclose((east_a, south_a, north_a), (west_b, south_b, north_b), rtol=0, atol=tolerance):
+        return 'east', 'west'
+    if np.allclose((south_a, west_a, east_a), (north_b, west_b, east_b), rtol=0, atol=tolerance):
+        return 'south', 'north'
+    return None
+
+
+def label_regions(classified_image):
+    """Number the 4-connected regions of every non-zero class, as shapes() would split them."""
+    regions = np.zeros(classified_image.shape, dtype=np.int32)
+    region_classes = [0]
+    for value in np.unique(classified_image):
+        if value == 0:
+            continue
+        labels, count = ndimage.label(classified_image == value)
+        in_class = labels > 0
+        regions[in_class] = labels[in_class] + (len(region_classes) - 1)
+        region_classes.extend([value] * count)
+    return regions, np.asarray(region_classes)
+
+
+def polygon_parts(geom):
+    """Keep only the polygonal part of an overlay result, like gpd.overlay(keep_geom_type=True)."""
+    if not geom.is_valid:
+        geom = shapely.make_valid(geom)
+    if geom.geom_type in POLYGON_TYPES:
+        return geom
+    if geom.geom_type == 'GeometryCollection':
+        parts = [part for part in geom.geoms if part.geom_type in POLYGON_TYPES]
+        if parts:
+            return shapely.union_all(parts)
+    return None
+
+
+def polygon_from_geojson(geometry):
+    shell, *holes = geometry['coordinates']
+    return shapely.polygons(shell, holes=[shapely.linearrings(hole) for hole in holes] or None)
+
+
+def geojson_geometry(geom):
+    # Same lists-of-lists structure json.loads(GeoDataFrame.to_json()) gave
+    if geom.geom_type == 'Polygon':
+        return {'type': 'Polygon', 'coordinates': polygon_coordinates(geom)}
+    return {'type': 'MultiPolygon', 'coordinates': [polygon_coordinates(part) for part in geom.geoms]}
+
+
+def polygon_coordinates(polygon):
+    return [shapely.get_coordinates(ring).tolist() for ring in (polygon.exterior, *polygon.interiors)]
@@ -0,0 +1,245 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+
+from .hot_tier import hot_tier
+
+
+class RasterCache:
+    """On-disk cache of decoded SentinelHubRequest responses.
+
+    Entries are keyed by a hash of the request payload (evalscript, data
+    collection, time interval, bbox and output size), evicted least recently
+    used first once the directory grows past ``max_bytes``. Requests that
+    reach today use ``volatile_ttl`` because new acquisitions may still be
+    ingested; past dates use ``immutable_ttl`` (``None`` never expires).
+
+    Identical requests missing the cache at the same time share one
+    download: threads of a worker wait on the first one's future, and the
+    workers of a host take turns on a lock file, so the later ones load
+    what the first stored.
+
+    Single-array responses of past dates are also kept in ``hot_tier``
+    (a HotTier), where every worker maps them without reading the file.
+    """
+
+    def __init__(self, directory, max_bytes, volatile_ttl, immutable_ttl=None, hot_tier=None):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.volatile_ttl = volatile_ttl
+        self.immutable_ttl = immutable_ttl
+        self.hot_tier = hot_tier
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.coalesced_across_workers = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        os.makedirs(os.path.join(self.directory, 'locks'), exist_ok=True)
+
+    @staticmethod
+    def request_key(sentinel_request):
+        payload = json.dumps(sentinel_request.payload, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, sentinel_request):
+        today = datetime.now(timezone.utc).date()
+        for data in sentinel_request.payload['input']['data']:
+            try:
+                time_to = datetime.fromisoformat(data['dataFilter']['timeRange']['to'].replace('Z', '+00:00'))
+            except (KeyError, TypeError, AttributeError, ValueError):
+                # A range without a parseable end is not known to be past
+                return self.volatile_ttl
+            if time_to.tzinfo is not None:
+                time_to = time_to.astimezone(timezone.utc)
+            if time_to.date() >= today:
+                return self.volatile_ttl
+        return self.immutable_ttl
+
+    def get_data(self, sentinel_request):
+        """Drop-in replacement for ``sentinel_request.get_data()``."""
+        key = self.request_key(sentinel_request)
+        if self.hot_tier is not None:
+            array = self.hot_tier.get(key)
+            if array is not None:
+                with self._lock:
+                    self.hits += 1
+                return [array]
+
+        data = self.load(key)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            self.promote(key, data, sentinel_request)
+            return data
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            data = self._fetch(key, sentinel_request)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _fetch(self, key, sentinel_request):
+        with self._worker_lock(key):
+            # Another worker may have downloaded it while this one waited
+            data = self.load(key)
+            if data is not None:
+                with self._lock:
+                    self.coalesced_across_workers += 1
+                return data
+
+            with self._lock:
+                self.misses += 1
+            data = sentinel_request.get_data()
+            self.store(key, data, self.ttl_for(sentinel_request))
+            self.promote(key, data, sentinel_request)
+            return data
+
+    def promote(self, key, data, sentinel_request):
+        # The hot tier never expires entries, so it only takes past dates
+        if self.hot_tier is None or len(data) != 1 or self.ttl_for(sentinel_request) is not None:
+            return
+        self.hot_tier.put(key, data[0])
+
+    @contextmanager
+    def _worker_lock(self, key):
+        # Keys share 4096 lock files, so the directory stays bounded; the
+        # lock files are never removed, which keeps flock race-free
+        with open(os.path.join(self.directory, 'locks', f'{key[:3]}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as archive:
+                if archive['__expires__'] < time.time():
+                    os.remove(path)
+                    return None
+                data = self._unpack(archive)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self, key, data, ttl):
+        arrays = self._pack(data)
+        if arrays is None:
+            return
+        arrays['__expires__'] = np.array(np.inf if ttl is None else time.time() + ttl)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.savez(tmp_file, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npz'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'coalesced': self.coalesced, 'coalesced_across_workers': self.coalesced_across_workers}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    @staticmethod
+    def _pack(data):
+        # get_data() returns one array per response, or one dict of arrays
+        # per request when several responses are packed into a tar
+        arrays = {}
+        for i, item in enumerate(data):
+            if isinstance(item, np.ndarray):
+                arrays[f'r{i}'] = item
+            elif isinstance(item, dict) and all(isinstance(v, np.ndarray) for v in item.values()):
+                for name, value in item.items():
+                    arrays[f'r{i}:{name}'] = value
+            else:
+                return None
+        return arrays
+
+    @staticmethod
+    def _unpack(archive):
+        data = {}
+        for name in archive.files:
+            if name == '__expires__':
+                continue
+            index, _, response = name[1:].partition(':')
+            if response:
+                data.setdefault(int(index), {})[response] = archive[name]
+            else:
+                data[int(index)] = archive[name]
+        return [data[i] for i in sorted(data)]
+
+
+raster_cache = RasterCache(
+    directory=settings.RASTER_CACHE_DIR,
+    max_bytes=settings.RASTER_CACHE_MAX_BYTES,
+    volatile_ttl=settings.RASTER_CACHE_VOLATILE_TTL,
+    immutable_ttl=settings.RASTER_CACHE_IMMUTABLE_TTL,
+    hot_tier=hot_tier,
+)
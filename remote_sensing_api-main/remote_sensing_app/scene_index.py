@@ -0,0 +1,201 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+import shapely
+from shapely.geometry import shape
+from django.conf import settings
+from sentinelhub import SentinelHubCatalog
+
+from .budget import RequestBudget
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    scene_id TEXT NOT NULL UNIQUE,
+    collection TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    date TEXT NOT NULL,
+    cloud_cover REAL,
+    footprint BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scenes_collection_date ON scenes (collection, date);
+CREATE VIRTUAL TABLE IF NOT EXISTS scene_bounds USING rtree (id, min_x, max_x, min_y, max_y);
+CREATE TABLE IF NOT EXISTS synced (
+    collection TEXT NOT NULL,
+    min_x REAL NOT NULL,
+    min_y REAL NOT NULL,
+    max_x REAL NOT NULL,
+    max_y REAL NOT NULL,
+    date_from TEXT NOT NULL,
+    date_to TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS synced_bbox_date ON synced (collection, min_x, min_y, max_x, max_y, date_from);
+'''
+
+CATALOG_FIELDS = {'include': ['id', 'geometry', 'properties.datetime', 'properties.eo:cloud_cover'], 'exclude': []}
+
+
+class SceneIndex:
+    """Local copy of Sentinel Hub catalog results in SQLite with an R-tree.
+
+    Every scene's footprint, acquisition time, cloud cover and collection is
+    stored once. ``synced`` records which days were searched for which bbox,
+    so a query only sends the catalog the days no earlier search covered
+    that bbox for, and answers the rest from the index. The last
+    ``settle_days`` are never recorded as synced, since scenes keep being
+    ingested for a while after acquisition. The ranges of one bbox are
+    merged as they are recorded, so repeated syncs do not grow the table.
+    """
+
+    def __init__(self, path, settle_days=3):
+        self.path = str(path)
+        self.settle_days = settle_days
+        self._sync_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            # WAL lets the other workers read while one of them syncs
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+
+    def scenes(self, collection, bbox, start, end, config, max_cloud_cover=None):
+        """Scenes of ``collection`` intersecting ``bbox`` between two dates, inclusive.
+
+        Syncs the missing days from the catalog first. Returns
+        ``(date, cloud_cover)`` rows ordered by date; ``max_cloud_cover``
+        keeps only scenes with less cloud cover, like the catalog's
+        ``eo:cloud_cover <`` filter.
+        """
+        self.sync(collection, bbox, start, end, config)
+        return self.query(collection, bbox, start, end, max_cloud_cover)
+
+    def sync(self, collection, bbox, start, end, config, timeout=None):
+        """Search the catalog for the days of ``[start, end]`` not synced for ``bbox`` yet.
+
+        Returns how many scenes were added. With a ``timeout`` it raises
+        TimeoutError once that many seconds have passed, waiting for the
+        lock, for SQLite or between catalog pages, and records nothing.
+        """
+        budget = None if timeout is None else RequestBudget(timeout)
+
+        def time_left():
+            if budget is None:
+                return None
+            left = budget.remaining()
+            if not left:
+                raise TimeoutError(f'The catalog sync did not finish within {timeout:.1f} s')
+            return left
+
+        # One sync at a time per worker; SQLite serializes the other workers
+        if not self._sync_lock.acquire(timeout=-1 if budget is None else budget.remaining()):
+            raise TimeoutError(f'Another catalog sync held the lock for {timeout:.1f} s')
+        try:
+            with self._connect(timeout=time_left() or 30) as connection:
+                missing = self.missing_ranges(connection, collection, bbox, start, end)
+                if not missing:
+                    return 0
+                # Page through the catalog before writing, so the database is
+                # only locked for the inserts
+                catalog = SentinelHubCatalog(config=config)
+                results = []
+                for date_from, date_to in missing:
+                    for result in catalog.search(collection=collection, bbox=bbox, time=(date_from, date_to), fields=CATALOG_FIELDS):
+                        time_left()
+                        results.append(result)
+                left = time_left()
+                if left is not None:
+                    connection.execute(f'PRAGMA busy_timeout = {int(left * 1000)}')
+                added = self._insert(connection, collection.name, results)
+
+                # Catalog dates are UTC, so is the cut-off
+                settled = datetime.now(timezone.utc).date() - timedelta(days=self.settle_days)
+                for date_from, date_to in missing:
+                    if date_from <= settled:
+                        self._record_synced(connection, collection.name, tuple(bbox), date_from, min(date_to, settled))
+                return added
+        finally:
+            self._sync_lock.release()
+
+    def missing_ranges(self, connection, collection, bbox, start, end):
+        """The ``(from, to)`` date ranges in ``[start, end]`` no sync covering ``bbox`` searched."""
+        min_x, min_y, max_x, max_y = tuple(bbox)
+        rows = connection.execute(
+            'SELECT date_from, date_to FROM synced WHERE collection = ? AND min_x <= ? AND min_y <= ? AND max_x >= ? AND max_y >= ? '
+            'AND date_to >= ? AND date_from <= ? ORDER BY date_from',
+            (collection.name, min_x, min_y, max_x, max_y, start.isoformat(), end.isoformat())
+        )
+        missing = []
+        cursor = start
+        for date_from, date_to in rows:
+            date_from, date_to = date.fromisoformat(date_from), date.fromisoformat(date_to)
+            if date_from > cursor:
+                missing.append((cursor, date_from - timedelta(days=1)))
+            cursor = max(cursor, date_to + timedelta(days=1))
+            if cursor > end:
+                break
+        if cursor <= end:
+            missing.append((cursor, end))
+        return missing
+
+    def query(self, collection, bbox, start, end, max_cloud_cover=None, timeout=30):
+        """Scenes of the index, see scenes; waits up to ``timeout`` seconds for SQLite."""
+        min_x, min_y, max_x, max_y = tuple(bbox)
+        sql = ('SELECT s.date, s.cloud_cover, s.footprint FROM scene_bounds b JOIN scenes s ON s.id = b.id '
+               'WHERE b.min_x <= ? AND b.max_x >= ? AND b.min_y <= ? AND b.max_y >= ? '
+               'AND s.collection = ? AND s.date BETWEEN ? AND ?')
+        params = [max_x, min_x, max_y, min_y, collection.name, start.isoformat(), end.isoformat()]
+        if max_cloud_cover is not None:
+            sql += ' AND s.cloud_cover < ?'
+            params.append(max_cloud_cover)
+        with self._connect(timeout) as connection:
+            rows = connection.execute(sql + ' ORDER BY s.date', params).fetchall()
+        if not rows:
+            return []
+
+        # The R-tree stores rounded boxes; check the real footprints
+        footprints = shapely.from_wkb([footprint for _, _, footprint in rows])
+        hits = shapely.intersects(footprints, shapely.box(min_x, min_y, max_x, max_y))
+        return [(scene_date, cloud_cover) for (scene_date, cloud_cover, _), hit in zip(rows, hits) if hit]
+
+    def _record_synced(self, connection, collection_name, bounds, date_from, date_to):
+        """Record a synced range of a bbox, merged with its overlapping or adjacent ranges."""
+        where = ('collection = ? AND min_x = ? AND min_y = ? AND max_x = ? AND max_y = ? '
+                 'AND date_to >= ? AND date_from <= ?')
+        params = (collection_name, *bounds, (date_from - timedelta(days=1)).isoformat(),
+                  (date_to + timedelta(days=1)).isoformat())
+        for row_from, row_to in connection.execute(f'SELECT date_from, date_to FROM synced WHERE {where}', params).fetchall():
+            date_from = min(date_from, date.fromisoformat(row_from))
+            date_to = max(date_to, date.fromisoformat(row_to))
+        connection.execute(f'DELETE FROM synced WHERE {where}', params)
+        connection.execute('INSERT INTO synced VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (collection_name, *bounds, date_from.isoformat(), date_to.isoformat()))
+
+    def _insert(self, connection, collection_name, results):
+        added = 0
+        for result in results:
+            scene_datetime = result['properties']['datetime']
+            footprint = shape(result['geometry'])
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO scenes (scene_id, collection, datetime, date, cloud_cover, footprint) VALUES (?, ?, ?, ?, ?, ?)',
+                (result['id'], collection_name, scene_datetime, scene_datetime[:10],
+                 result['properties'].get('eo:cloud_cover'), shapely.to_wkb(footprint))
+            )
+            if cursor.rowcount:
+                min_x, min_y, max_x, max_y = footprint.bounds
+                connection.execute('INSERT INTO scene_bounds VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, min_x, max_x, min_y, max_y))
+                added += 1
+        return added
+
+    @contextmanager
+    def _connect(self, timeout=30):
+        connection = sqlite3.connect(self.path, timeout=timeout)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+scene_index = SceneIndex(settings.SCENE_INDEX_PATH, settle_days=settings.SCENE_INDEX_SETTLE_DAYS)
@@ -3,7 +3,14 @@ from rest_framework import serializers
     
 class EndDateSerializer(serializers.Serializer):
     end_date = serializers.DateField()
+    start_date = serializers.DateField(required=False)
+
+
+# 'float' fetches the bands and classifies the indices here; 'classes' has
+# Sentinel Hub classify them and return 1-byte class rasters
+OUTPUT_MODES = ('float', 'classes')
 
 
 class IndicesSerializer(serializers.Serializer):
-    date = serializers.DateField()
\ No newline at end of file
+    date = serializers.DateField()
+    output = serializers.ChoiceField(choices=OUTPUT_MODES, default='float')
@@ -1,3 +1,1099 @@
-from django.test import TestCase
+import math
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from rasterio.features import shapes
+from sentinelhub import BBox, CRS, DataCollection
+
+from .band_stack import NODATA, REFLECTANCE_NODATA, REFLECTANCE_SCALE, decode_reflectance, tile_grid_size
+from . import cpu_pool as cpu_pool_module
+from .classification import CLASS_BREAKS, FORECAST_CLASS_BREAKS
+from .cpu_pool import CpuTimeout, ProcessPool, SharedArray, release_when_done, results, submit_shared
+from . import field_forecast, forecast
+from .field_forecast import FieldForecastCache
+from .forecast import design_matrix, fit_chunk, forecast_cube
+from .hot_tier import HotTier
+from .lst import LST_BANDS, LST_MAX_ORBITS, field_lst, land_surface_temperature, lst_statistics
+from .polygonize import class_feature_batch, stitch_batches
+from .raster_cache import RasterCache
+from .scene_index import SceneIndex
+from .viewscmput import (CacheStatsView, NDVIView, NDVIFView, CPU_TIMEOUT_ERROR, FETCH_TIMEOUT_ERROR,
+                         FORECAST_TIMEOUT_ERROR, preflight_jobs)
+
+
+class FakeRequest:
+    """Stand-in for a SentinelHubRequest: a payload and a counted get_data."""
+
+    def __init__(self, time_to='2024-05-31T23:59:59Z', value=1, payload=None):
+        self.payload = payload or {'input': {'data': [{'dataFilter': {'timeRange': {
+            'from': '2024-05-01T00:00:00Z', 'to': time_to}}}]}, 'value': value}
+        self.value = value
+        self.calls = 0
+
+    def get_data(self):
+        self.calls += 1
+        return [np.full((4, 4), self.value, dtype=np.float32)]
+
+
+class BlockingRequest(FakeRequest):
+    """FakeRequest whose download waits for ``release``, or fails with ``error``."""
+
+    def __init__(self, error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def get_data(self):
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            self.calls += 1
+            raise self.error
+        return super().get_data()
+
+
+class RasterCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = RasterCache(self.directory, max_bytes=1024 ** 2, volatile_ttl=60, immutable_ttl=None)
+
+    def test_ttl_for(self):
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%dT23:59:59Z')
+        self.assertIsNone(self.cache.ttl_for(FakeRequest('2024-05-31T23:59:59Z')))
+        self.assertIsNone(self.cache.ttl_for(FakeRequest('2024-05-31T23:59:59+00:00')))
+        self.assertEqual(self.cache.ttl_for(FakeRequest(today)), 60)
+        # Ends that do not parse are not known to be past
+        self.assertEqual(self.cache.ttl_for(FakeRequest('31/05/2024')), 60)
+        self.assertEqual(self.cache.ttl_for(FakeRequest(None)), 60)
+        self.assertEqual(self.cache.ttl_for(FakeRequest(payload={'input': {'data': [{}]}})), 60)
+        # Any input reaching today makes the request volatile
+        request = FakeRequest()
+        request.payload['input']['data'].append({'dataFilter': {'timeRange': {'to': today}}})
+        self.assertEqual(self.cache.ttl_for(request), 60)
+
+    def test_hit_and_miss(self):
+        request = FakeRequest(value=3)
+        first = self.cache.get_data(request)
+        second = self.cache.get_data(FakeRequest(value=3))
+        self.assertEqual(request.calls, 1)
+        np.testing.assert_array_equal(first[0], second[0])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expired_entries_are_fetched_again(self):
+        request = FakeRequest()
+        key = self.cache.request_key(request)
+        self.cache.store(key, request.get_data(), ttl=-1)
+        self.assertIsNone(self.cache.load(key))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'{key}.npz')))
+
+        self.cache.get_data(request)
+        self.assertEqual(request.calls, 2)
+
+    def test_evicts_least_recently_used(self):
+        requests = [FakeRequest(value=value) for value in range(3)]
+        keys = [self.cache.request_key(request) for request in requests]
+        for request in requests:
+            self.cache.get_data(request)
+        paths = [os.path.join(self.directory, f'{key}.npz') for key in keys]
+        now = time.time()
+        for age, path in zip((300, 200, 100), paths):
+            os.utime(path, (now - age, now - age))
+
+        # Reading the oldest entry makes it the most recently used
+        self.assertIsNotNone(self.cache.load(keys[0]))
+        self.cache.max_bytes = sum(os.path.getsize(path) for path in paths[:2])
+        self.cache.evict()
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+        self.assertEqual(self.cache.evictions, 1)
+
+    def coalesce(self, request, callers=4):
+        """Call get_data of ``request`` from ``callers`` threads at once; returns their results."""
+        results = [None] * callers
+
+        def call(i):
+            try:
+                results[i] = self.cache.get_data(request)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+        threads[0].start()
+        self.assertTrue(request.started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.time() + 5
+        while self.cache.coalesced < callers - 1 and time.time() < deadline:
+            time.sleep(0.01)
+        request.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_misses_share_one_download(self):
+        request = BlockingRequest(value=7)
+        results = self.coalesce(request)
+        self.assertEqual(request.calls, 1)
+        self.assertEqual(self.cache.coalesced, 3)
+        for result in results:
+            np.testing.assert_array_equal(result[0], 7)
+        self.assertEqual(self.cache._in_flight, {})
+
+    def test_failed_download_reaches_every_caller(self):
+        request = BlockingRequest(error=RuntimeError('download failed'))
+        results = self.coalesce(request)
+        self.assertEqual(request.calls, 1)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+        # Nothing is left in flight, so the next call downloads again
+        request.error = None
+        self.cache.get_data(request)
+        self.assertEqual(request.calls, 2)
+
+    def test_download_stored_by_another_worker(self):
+        request = FakeRequest()
+        key = self.cache.request_key(request)
+        self.cache.store(key, FakeRequest(value=5).get_data(), ttl=None)
+        data = self.cache._fetch(key, request)
+        self.assertEqual(request.calls, 0)
+        np.testing.assert_array_equal(data[0], 5)
+        self.assertEqual(self.cache.coalesced_across_workers, 1)
+
+
+
+class HotTierTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.tier = HotTier(self.directory, max_bytes=1024 ** 2)
+
+    def test_round_trip_is_a_read_only_map(self):
+        array = np.arange(12, dtype=np.float32).reshape(3, 4)
+        self.assertIsNone(self.tier.get('a'))
+        self.tier.put('a', array)
+        mapped = self.tier.get('a')
+        np.testing.assert_array_equal(mapped, array)
+        self.assertIsInstance(mapped, np.memmap)
+        self.assertFalse(mapped.flags.writeable)
+        self.assertEqual(self.tier.stats(), {'hits': 1, 'misses': 1, 'evictions': 0, 'bytes_served': array.nbytes})
+
+    def test_cached_computes_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return np.ones(4, dtype=np.uint8)
+        for _ in range(3):
+            np.testing.assert_array_equal(self.tier.cached('k', compute), 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_skips_what_it_cannot_map(self):
+        self.tier.put('objects', np.array([None, 1], dtype=object))
+        self.tier.put('large', np.zeros(1024 ** 2 + 1, dtype=np.uint8))
+        self.assertIsNone(self.tier.get('objects'))
+        self.assertIsNone(self.tier.get('large'))
+
+    def test_evicts_least_recently_used_but_keeps_pins(self):
+        arrays = [np.full(1000, i, dtype=np.float64) for i in range(3)]
+        for i, array in enumerate(arrays):
+            self.tier.put(str(i), array)
+        paths = [os.path.join(self.directory, f'{i}.npy') for i in range(3)]
+        now = time.time()
+        for age, path in zip((300, 200, 100), paths):
+            os.utime(path, (now - age, now - age))
+        pin = self.tier.pin(paths[1])
+
+        # Reading the oldest entry makes it the most recently used
+        self.tier.get('0')
+        self.tier.max_bytes = sum(os.path.getsize(path) for path in paths[:2])
+        self.tier.evict()
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+        np.testing.assert_array_equal(np.load(pin), 1)
+        self.tier.unpin(pin)
+        self.assertFalse(os.path.exists(pin))
+
+    def test_drops_pins_of_dead_processes(self):
+        self.tier.put('a', np.zeros(4))
+        stale = os.path.join(self.directory, '999999999-stale.pin')
+        os.link(os.path.join(self.directory, 'a.npy'), stale)
+        self.tier.evict()
+        self.assertFalse(os.path.exists(stale))
+
+
+
+class FakeCatalog:
+    """Stand-in for SentinelHubCatalog over a list of scenes, recording every search."""
+
+    def __init__(self, scenes):
+        self.scenes = scenes
+        self.searches = []
+        self.bboxes = []
+        # Bboxes whose pages never come, until released
+        self.stalled = set()
+        self.release = threading.Event()
+
+    def __call__(self, config=None):
+        return self
+
+    def search(self, collection, bbox, time, fields):
+        self.searches.append(time)
+        self.bboxes.append(tuple(bbox))
+        if tuple(bbox) in self.stalled:
+            return self.stalled_pages()
+        date_from, date_to = time
+        search_box = shapely.box(*tuple(bbox))
+        return [scene for scene in self.scenes if date_from.isoformat() <= scene['properties']['datetime'][:10] <= date_to.isoformat()
+                and shapely.geometry.shape(scene['geometry']).intersects(search_box)]
+
+    def stalled_pages(self):
+        while not self.release.wait(0.05):
+            yield catalog_scene('late', date(2024, 5, 1), shapely.box(-1, -1, 1, 1))
+
+
+def catalog_scene(scene_id, day, geometry, cloud_cover=10.0):
+    return {'id': scene_id, 'geometry': shapely.geometry.mapping(geometry),
+            'properties': {'datetime': f'{day.isoformat()}T10:30:00Z', 'eo:cloud_cover': cloud_cover}}
+
+
+class SceneIndexTests(SimpleTestCase):
+    collection = DataCollection.SENTINEL2_L2A
+    bbox = (10.0, 45.0, 10.1, 45.1)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = SceneIndex(os.path.join(directory.name, 'scenes.sqlite3'), settle_days=3)
+        tile = shapely.box(9.5, 44.5, 10.5, 45.5)
+        self.catalog = FakeCatalog([catalog_scene(f'S{day}', date(2024, 5, day), tile) for day in range(1, 31, 5)])
+        patcher = mock.patch('remote_sensing_app.scene_index.SentinelHubCatalog', self.catalog)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sync(self, start, end, bbox=None, timeout=None):
+        return self.index.sync(self.collection, bbox or self.bbox, start, end, config=None, timeout=timeout)
+
+    def missing(self, start, end, bbox=None):
+        with self.index._connect() as connection:
+            return self.index.missing_ranges(connection, self.collection, bbox or self.bbox, start, end)
+
+    def synced_rows(self):
+        with self.index._connect() as connection:
+            return connection.execute('SELECT date_from, date_to FROM synced ORDER BY date_from').fetchall()
+
+    def test_covered_range_makes_no_catalog_call(self):
+        self.assertEqual(self.sync(date(2024, 5, 1), date(2024, 5, 31)), 6)
+        self.assertEqual(len(self.catalog.searches), 1)
+        self.assertEqual(self.sync(date(2024, 5, 10), date(2024, 5, 20)), 0)
+        # A smaller bbox inside a synced one is covered too
+        self.assertEqual(self.sync(date(2024, 5, 1), date(2024, 5, 31), bbox=(10.02, 45.02, 10.05, 45.05)), 0)
+        self.assertEqual(len(self.catalog.searches), 1)
+        self.assertEqual([day for day, _ in self.index.query(self.collection, self.bbox, date(2024, 5, 10), date(2024, 5, 20))],
+                         ['2024-05-11', '2024-05-16'])
+
+    def test_partial_overlap_searches_only_the_gaps(self):
+        self.sync(date(2024, 5, 5), date(2024, 5, 10))
+        self.sync(date(2024, 5, 20), date(2024, 5, 25))
+        gaps = [(date(2024, 5, 1), date(2024, 5, 4)), (date(2024, 5, 11), date(2024, 5, 19)), (date(2024, 5, 26), date(2024, 5, 31))]
+        self.assertEqual(self.missing(date(2024, 5, 1), date(2024, 5, 31)), gaps)
+        self.assertEqual(self.missing(date(2024, 5, 7), date(2024, 5, 22)), [gaps[1]])
+
+        del self.catalog.searches[:]
+        self.sync(date(2024, 5, 1), date(2024, 5, 31))
+        self.assertEqual(self.catalog.searches, gaps)
+        self.assertEqual(self.synced_rows(), [('2024-05-01', '2024-05-31')])
+
+    def test_adjacent_and_overlapping_ranges_merge(self):
+        self.sync(date(2024, 5, 1), date(2024, 5, 10))
+        self.sync(date(2024, 5, 11), date(2024, 5, 15))
+        self.assertEqual(self.synced_rows(), [('2024-05-01', '2024-05-15')])
+        self.sync(date(2024, 5, 20), date(2024, 5, 25))
+        self.assertEqual(self.synced_rows(), [('2024-05-01', '2024-05-15'), ('2024-05-20', '2024-05-25')])
+        # A one-day gap keeps ranges apart, filling it joins them
+        self.sync(date(2024, 5, 17), date(2024, 5, 18))
+        self.assertEqual(len(self.synced_rows()), 3)
+        del self.catalog.searches[:]
+        self.sync(date(2024, 5, 16), date(2024, 5, 19))
+        self.assertEqual(self.catalog.searches, [(date(2024, 5, 16), date(2024, 5, 16)), (date(2024, 5, 19), date(2024, 5, 19))])
+        self.assertEqual(self.synced_rows(), [('2024-05-01', '2024-05-25')])
+
+    def test_unsettled_days_are_searched_again(self):
+        today = datetime.now(timezone.utc).date()
+        start = today - timedelta(days=10)
+        self.sync(start, today)
+        settled = today - timedelta(days=3)
+        self.assertEqual(self.synced_rows(), [(start.isoformat(), settled.isoformat())])
+
+        del self.catalog.searches[:]
+        self.sync(start, today)
+        self.assertEqual(self.catalog.searches, [(settled + timedelta(days=1), today)])
+
+        # A range entirely within the last days is never recorded
+        self.sync(today - timedelta(days=1), today)
+        self.sync(today - timedelta(days=1), today)
+        self.assertEqual(len(self.catalog.searches), 3)
+        self.assertEqual(len(self.synced_rows()), 1)
+
+    def test_sync_gives_up_after_its_timeout(self):
+        self.catalog.stalled.add(self.bbox)
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.sync(date(2024, 5, 1), date(2024, 5, 31), timeout=0.3)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.synced_rows(), [])
+
+        # A sync holding the lock counts against the timeout too
+        with self.index._sync_lock, self.assertRaises(TimeoutError):
+            self.sync(date(2024, 5, 1), date(2024, 5, 31), timeout=0.1)
+
+    def test_query_checks_real_footprints(self):
+        # The triangle's bounding box covers the bbox, the triangle does not
+        triangle = shapely.Polygon([(10.05, 45.2), (10.3, 45.2), (10.3, 44.9)])
+        self.catalog.scenes = [catalog_scene('inside', date(2024, 5, 2), shapely.box(9.5, 44.5, 10.5, 45.5), 80.0),
+                               catalog_scene('corner', date(2024, 5, 3), triangle)]
+        rows = self.index.scenes(self.collection, self.bbox, date(2024, 5, 1), date(2024, 5, 31), config=None)
+        self.assertEqual(rows, [('2024-05-02', 80.0)])
+        self.assertEqual(self.index.query(self.collection, self.bbox, date(2024, 5, 1), date(2024, 5, 31), max_cloud_cover=50), [])
+
+
+
+class PreflightTests(SimpleTestCase):
+    near = (10.0, 45.0, 10.01, 45.01)
+    far = (20.0, 50.0, 20.01, 50.01)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = SceneIndex(os.path.join(directory.name, 'scenes.sqlite3'))
+        self.catalog = FakeCatalog([catalog_scene('S1', date(2024, 5, 1), shapely.box(9.5, 44.5, 10.5, 45.5)),
+                                    catalog_scene('S5', date(2024, 5, 5), shapely.box(9.5, 44.5, 10.5, 45.5), 95.0)])
+        self.addCleanup(self.catalog.release.set)
+        for patcher in (mock.patch('remote_sensing_app.scene_index.SentinelHubCatalog', self.catalog),
+                        mock.patch('remote_sensing_app.viewscmput.scene_index', self.index)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def jobs(self, bounds, dates):
+        return [(BBox(bbox=bounds, crs=CRS.WGS84), day, shapely.box(*bounds)) for day in dates]
+
+    def test_syncs_each_field_alone(self):
+        usable, skipped = preflight_jobs(self.jobs(self.near, ['2024-05-01', '2024-05-02', '2024-05-05', 'soon'])
+                                         + self.jobs(self.far, ['2024-06-01']))
+        self.assertEqual([job[1] for job in usable], ['2024-05-01'])
+        self.assertEqual(skipped, [{'date': 'soon', 'reason': 'invalid_date'},
+                                   {'date': '2024-05-02', 'reason': 'no_acquisition'},
+                                   {'date': '2024-05-05', 'reason': 'cloud_cover', 'cloud_cover': 95.0},
+                                   {'date': '2024-06-01', 'reason': 'no_acquisition'}])
+        # Neither search spans the other field or its dates
+        self.assertEqual(sorted(zip(self.catalog.bboxes, self.catalog.searches)),
+                         [(self.near, (date(2024, 5, 1), date(2024, 5, 5))), (self.far, (date(2024, 6, 1), date(2024, 6, 1)))])
+
+    def test_fields_not_synced_in_time_are_kept(self):
+        self.catalog.stalled.add(self.far)
+        start = time.monotonic()
+        with self.assertLogs('remote_sensing_app.viewscmput', 'WARNING') as logs:
+            usable, skipped = preflight_jobs(self.jobs(self.near, ['2024-05-01', '2024-05-02'])
+                                             + self.jobs(self.far, ['2024-05-01', '2024-05-02']), timeout=0.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIn('1 of 2 fields unchecked', logs.output[0])
+        self.assertEqual([(tuple(job[0]), job[1]) for job in usable],
+                         [(self.near, '2024-05-01'), (self.far, '2024-05-01'), (self.far, '2024-05-02')])
+        self.assertEqual(skipped, [{'date': '2024-05-02', 'reason': 'no_acquisition'}])
+
+        # The stalled sync gives up on its own, within the same timeout
+        self.assertTrue(self.index._sync_lock.acquire(timeout=2))
+        self.index._sync_lock.release()
+
+    def test_unreachable_catalog_keeps_every_date(self):
+        self.catalog.search = mock.Mock(side_effect=ConnectionError('catalog down'))
+        with self.assertLogs('remote_sensing_app.viewscmput', 'WARNING'):
+            usable, skipped = preflight_jobs(self.jobs(self.near, ['2024-05-01', '2024-05-02']))
+        self.assertEqual(len(usable), 2)
+        self.assertEqual(skipped, [])
+
+
+# The cascades the views reclassified with before ClassBreaks, verbatim
+def reclassify_ndvi(ndvi_array):
+    classified_array = np.zeros_like(ndvi_array, dtype=np.uint8)
+    classified_array[(ndvi_array <= 0) & (ndvi_array != -9999)] = 1
+    classified_array[(ndvi_array > 0) & (ndvi_array <= 0.1)] = 2
+    classified_array[(ndvi_array > 0.1) & (ndvi_array <= 0.2)] = 3
+    classified_array[(ndvi_array > 0.2) & (ndvi_array <= 0.4)] = 4
+    classified_array[(ndvi_array > 0.4) & (ndvi_array <= 0.5)] = 5
+    classified_array[(ndvi_array > 0.5) & (ndvi_array <= 0.6)] = 6
+    classified_array[(ndvi_array > 0.6) & (ndvi_array <= 0.7)] = 7
+    classified_array[(ndvi_array > 0.7) & (ndvi_array <= 1)] = 8
+    classified_array[(ndvi_array == -9999)] = 0  # Set cloudy pixels to 0
+    return classified_array
+
+
+def reclassify_nir(nir_array):
+    classified_array = np.zeros_like(nir_array, dtype=np.uint8)
+    classified_array[(nir_array <= 0.1) & (nir_array != -9999)] = 1  # Unripe
+    classified_array[(nir_array > 0.1) & (nir_array <= 0.3)] = 2  # Almost ripe
+    classified_array[(nir_array > 0.3) & (nir_array <= 0.5)] = 3  # Ripe
+    classified_array[(nir_array > 0.5) & (nir_array <= 0.7)] = 4  # Overripe
+    classified_array[(nir_array > 0.7) & (nir_array <= 1)] = 5    # Very overripe
+    classified_array[(nir_array == -9999)] = 0  # Set cloudy pixels to 0
+    return classified_array
+
+
+def reclassify_ndwi(ndwi_array):
+    classified_array = np.zeros_like(ndwi_array, dtype=np.uint8)
+    classified_array[(ndwi_array <= -1) & (ndwi_array != -9999)] = 1
+    classified_array[(ndwi_array > -1) & (ndwi_array <= 0)] = 2
+    classified_array[(ndwi_array > 0) & (ndwi_array <= 0.1)] = 3
+    classified_array[(ndwi_array > 0.1) & (ndwi_array <= 0.2)] = 4
+    classified_array[(ndwi_array > 0.2) & (ndwi_array <= 0.3)] = 5
+    classified_array[(ndwi_array > 0.3) & (ndwi_array <= 0.4)] = 6
+    classified_array[(ndwi_array > 0.4) & (ndwi_array <= 0.5)] = 7
+    classified_array[(ndwi_array > 0.5) & (ndwi_array <= 1)] = 8
+    classified_array[(ndwi_array == -9999)] = 0  # Set cloudy pixels to 0
+    return classified_array
+
+
+def reclassify_cri(cri_array):
+    classified_array = np.zeros_like(cri_array, dtype=np.uint8)
+    classified_array[(cri_array <= 10) & (cri_array != -9999)] = 1
+    classified_array[(cri_array > 10) & (cri_array <= 20)] = 2
+    classified_array[(cri_array > 20) & (cri_array <= 30)] = 3
+    classified_array[(cri_array > 30) & (cri_array <= 40)] = 4
+    classified_array[(cri_array > 40) & (cri_array <= 50)] = 5
+    classified_array[(cri_array > 50) & (cri_array <= 60)] = 6
+    classified_array[(cri_array > 60) & (cri_array <= 70)] = 7
+    classified_array[(cri_array > 70) & (cri_array <= 100)] = 8
+    classified_array[(cri_array == -9999)] = 0  # Set cloudy pixels to 0
+    return classified_array
+
+
+def reclassify_ripeness(ripeness_array):
+    classified_array = np.zeros_like(ripeness_array, dtype=np.uint8)
+    classified_array[(ripeness_array <= 0) & (ripeness_array != -9999)] = 1  # Low ripeness
+    classified_array[(ripeness_array > 0) & (ripeness_array <= 0.3)] = 2  # Medium ripeness
+    classified_array[(ripeness_array > 0.3)] = 3  # High ripeness
+    classified_array[(ripeness_array == -9999)] = 0  # Cloudy pixels
+    return classified_array
+
+
+def reclassify_cari(cari_array):
+    classified_array = np.zeros_like(cari_array, dtype=np.uint8)
+    classified_array[(cari_array <= 0)] = 1
+    classified_array[(cari_array > 0) & (cari_array <= 0.1)] = 2
+    classified_array[(cari_array > 0.1) & (cari_array <= 0.2)] = 3
+    classified_array[(cari_array > 0.2) & (cari_array <= 0.4)] = 4
+    classified_array[(cari_array > 0.4) & (cari_array <= 0.5)] = 5
+    classified_array[(cari_array > 0.5) & (cari_array <= 0.6)] = 6
+    classified_array[(cari_array > 0.6) & (cari_array <= 0.7)] = 7
+    classified_array[(cari_array > 0.7)] = 8
+    classified_array[(cari_array == -9999)] = 0  # Set cloudy pixels to 0
+    return classified_array
+
+
+def edge_values(breaks, dtype, seed=0):
+    """Values on, just below and just above every edge of ``breaks``, random values, NODATA and NaN."""
+    edges = breaks.edges[np.isfinite(breaks.edges)].astype(dtype)
+    below = np.nextafter(edges, dtype(-np.inf))
+    above = np.nextafter(edges, dtype(np.inf))
+    low, high = edges[0] - 1, edges[-1] + 1
+    spread = np.random.default_rng(seed).uniform(low, high, 1000).astype(dtype)
+    return np.concatenate([edges, below, above, [low, high, NODATA, np.nan], spread]).astype(dtype)
+
+
+class ClassBreaksTests(SimpleTestCase):
+    cascades = [
+        (CLASS_BREAKS['ndvi'], reclassify_ndvi),
+        (CLASS_BREAKS['nir'], reclassify_nir),
+        (CLASS_BREAKS['ndwi'], reclassify_ndwi),
+        (CLASS_BREAKS['cri'], reclassify_cri),
+        (FORECAST_CLASS_BREAKS['ripeness'], reclassify_ripeness),
+        (FORECAST_CLASS_BREAKS['cari'], reclassify_cari),
+    ]
+
+    def test_classify_matches_cascades(self):
+        for breaks, cascade in self.cascades:
+            for dtype in (np.float32, np.float64):
+                with self.subTest(cascade=cascade.__name__, dtype=dtype.__name__):
+                    values = edge_values(breaks, dtype)[None, :]
+                    classes = breaks.classify(values)
+                    self.assertEqual(classes.dtype, np.uint8)
+                    np.testing.assert_array_equal(classes, cascade(values))
+
+    def test_nodata_and_nan_are_unclassified(self):
+        breaks = FORECAST_CLASS_BREAKS['cari']
+        np.testing.assert_array_equal(breaks.classify(np.array([NODATA, np.nan, -1e6, 1e6])), [0, 0, 1, 8])
+        np.testing.assert_array_equal(CLASS_BREAKS['ndvi'].classify(np.array([1, 1.01])), [8, 0])
+
+    def test_edges_must_increase(self):
+        with self.assertRaises(ValueError):
+            type(CLASS_BREAKS['ndvi'])((0, 0.2, 0.1))
+
+    def test_quantized_matches_decoded_cascade(self):
+        # The NIR view classifies its UINT16 reflectance codes directly
+        codes = np.arange(65536, dtype=np.uint16).reshape(256, 256)
+        classes = CLASS_BREAKS['nir'].classify_quantized(codes, scale=REFLECTANCE_SCALE, nodata=REFLECTANCE_NODATA)
+        expected = reclassify_nir(decode_reflectance(codes))
+        expected[codes == REFLECTANCE_NODATA] = 0
+        np.testing.assert_array_equal(classes, expected)
+
+    def test_quantized_with_offset_and_signed_codes(self):
+        breaks = CLASS_BREAKS['ndwi']
+        for dtype, scale, offset, nodata in ((np.uint8, 1 / 125, -1, 255), (np.int16, 1e-4, 0, -32768)):
+            with self.subTest(dtype=dtype.__name__):
+                info = np.iinfo(dtype)
+                codes = np.arange(info.min, info.max + 1).astype(dtype)
+                classes = breaks.classify_quantized(codes, scale=scale, offset=offset, nodata=nodata)
+                decoded = np.multiply(codes, scale, dtype=np.float32) + np.float32(offset)
+                expected = reclassify_ndwi(decoded)
+                expected[codes == nodata] = 0
+                np.testing.assert_array_equal(classes, expected)
+                # classify takes the lookup path for 8/16-bit input
+                np.testing.assert_array_equal(breaks.classify(codes), breaks.classify_quantized(codes))
+
+
+def overlay_features(classified_image, transform, polygon):
+    """The class polygons of the field as the views built them before FeatureBatch: (class, geometry) pairs."""
+    geometries = shapes(classified_image, mask=None, transform=transform)
+    features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
+    geojson_data = {"type": "FeatureCollection", "features": features}
+    geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
+    geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
+    intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
+    return list(zip(intersection_df['class_no'].astype(float), intersection_df.geometry))
+
+
+class PolygonizeTests(SimpleTestCase):
+    # 24x24 pixels of 0.001 degrees
+    bbox = (10.0, 45.0, 10.024, 45.024)
+    pixel = 0.001
+    # A U-shaped field, so regions leave it and come back, with axis-aligned
+    # edges off the pixel grid
+    field = shapely.Polygon([(10.0015, 45.0015), (10.0225, 45.0015), (10.0225, 45.0225), (10.0155, 45.0225),
+                             (10.0155, 45.0085), (10.0085, 45.0085), (10.0085, 45.0225), (10.0015, 45.0225)])
+
+    def classified(self, seed=0):
+        # Blocks of 4x4 pixels, so regions are large enough to cross seams
+        rng = np.random.default_rng(seed)
+        return np.kron(rng.integers(0, 4, (6, 6)), np.ones((4, 4))).astype(np.uint8)
+
+    def assert_same_features(self, batch, expected, tolerance):
+        """Each feature of ``batch`` matches one of ``expected`` of its class, up to ``tolerance`` degrees squared."""
+        features = list(zip(batch.columns['class_no'].tolist(), batch.geometries))
+        self.assertEqual(len(features), len(expected))
+        remaining = list(expected)
+        for value, geom in features:
+            overlaps = [shapely.intersection(geom, other).area if other_value == value else 0 for other_value, other in remaining]
+            match = int(np.argmax(overlaps))
+            self.assertGreater(overlaps[match], 0)
+            self.assertLess(shapely.symmetric_difference(geom, remaining[match][1]).area, tolerance)
+            del remaining[match]
+
+    def test_class_feature_batch_matches_overlay(self):
+        for seed, field in ((0, self.field), (1, self.field), (2, shapely.Polygon(
+                [(10.003, 45.002), (10.021, 45.006), (10.017, 45.022), (10.011, 45.012), (10.002, 45.019)]))):
+            with self.subTest(seed=seed):
+                classified = self.classified(seed)
+                transform = rasterio.transform.from_bounds(*self.bbox, *classified.shape[::-1])
+                batch = class_feature_batch(classified, transform, field)
+                self.assertTrue(np.all(shapely.is_valid(batch.geometries)))
+                self.assert_same_features(batch, overlay_features(classified, transform, field), 1e-14)
+
+    def test_regions_leaving_the_field_stay_one_feature(self):
+        # One class across the U's gap: both arms, one MultiPolygon
+        classified = np.ones((24, 24), dtype=np.uint8)
+        transform = rasterio.transform.from_bounds(*self.bbox, 24, 24)
+        batch = class_feature_batch(classified, transform, self.field)
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(batch.geometries[0].geom_type, 'Polygon')
+
+        classified[10:, 8:16] = 2
+        batch = class_feature_batch(classified, transform, self.field)
+        self.assertEqual(sorted(batch.columns['class_no'].tolist()), [1.0, 2.0])
+        self.assertAlmostEqual(shapely.union_all(batch.geometries).area, self.field.area, places=12)
+
+    def test_field_outside_the_raster(self):
+        classified = self.classified()
+        transform = rasterio.transform.from_bounds(*self.bbox, 24, 24)
+        batch = class_feature_batch(classified, transform, shapely.box(11, 46, 11.01, 46.01))
+        self.assertEqual(len(batch), 0)
+
+    def tile_batches(self, classified, col_edges, row_edges):
+        """The tile_grid tiles with these pixel edges, row by row from the north, and their batches."""
+        west, south, east, north = self.bbox
+        tiles, batches = [], []
+        for r in range(len(row_edges) - 1):
+            for c in range(len(col_edges) - 1):
+                bounds = (west + col_edges[c] * self.pixel, north - row_edges[r + 1] * self.pixel,
+                          west + col_edges[c + 1] * self.pixel, north - row_edges[r] * self.pixel)
+                size = (col_edges[c + 1] - col_edges[c], row_edges[r + 1] - row_edges[r])
+                tiles.append((BBox(bounds, crs=CRS.WGS84), size))
+                tile = classified[row_edges[r]:row_edges[r + 1], col_edges[c]:col_edges[c + 1]]
+                batches.append(class_feature_batch(tile, rasterio.transform.from_bounds(*bounds, *size), self.field))
+        return tiles, batches
+
+    def test_stitched_tiles_match_one_raster(self):
+        # Seed 1 has regions that cross a seam only in the U's gap, outside the field
+        for seed in range(4):
+            classified = self.classified(seed)
+            whole = class_feature_batch(classified, rasterio.transform.from_bounds(*self.bbox, 24, 24), self.field)
+            expected = list(zip(whole.columns['class_no'].tolist(), whole.geometries))
+            for col_edges, row_edges in (((0, 12, 24), (0, 12, 24)), ((0, 7, 15, 24), (0, 24)), ((0, 24), (0, 5, 13, 24))):
+                with self.subTest(seed=seed, col_edges=col_edges, row_edges=row_edges):
+                    tiles, batches = self.tile_batches(classified, col_edges, row_edges)
+                    stitched = stitch_batches(batches, tile_grid_size(tiles))
+                    self.assertGreater(sum(map(len, batches)), len(whole))
+                    self.assert_same_features(stitched, expected, 1e-12)
+
+    def test_single_tile_is_not_stitched(self):
+        classified = self.classified()
+        batch = class_feature_batch(classified, rasterio.transform.from_bounds(*self.bbox, 24, 24), self.field)
+        stitched = stitch_batches([batch], self.pixel / 100)
+        self.assertIs(stitched.geometries[0], batch.geometries[0])
+
+
+
+class ForecastTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.days = np.sort(rng.choice(np.arange(-720, 1), 24, replace=False)).astype(np.float64)
+        self.samples = rng.uniform(-1, 1, (len(self.days), 50)).astype(np.float32)
+        self.samples[rng.random(self.samples.shape) < 0.3] = NODATA
+        self.samples[:, 0] = NODATA
+        self.samples[1:, 1] = NODATA
+        self.samples[:3, 2] = np.nan
+
+    def test_fit_chunk_matches_per_pixel_least_squares(self):
+        for seasonal in (False, True):
+            design = design_matrix(self.days, seasonal)
+            coefficients, counts = fit_chunk(design, self.samples, NODATA)
+            for pixel in range(self.samples.shape[1]):
+                series = self.samples[:, pixel]
+                valid = (series != NODATA) & np.isfinite(series)
+                self.assertEqual(counts[pixel], valid.sum())
+                if valid.sum() >= design.shape[1]:
+                    expected = np.linalg.lstsq(design[valid], series[valid].astype(np.float64), rcond=None)[0]
+                    np.testing.assert_allclose(coefficients[pixel], expected, atol=1e-6)
+                elif valid.any():
+                    # Too few samples to fit: the model is the mean
+                    self.assertAlmostEqual(coefficients[pixel, 0], series[valid].mean(), places=6)
+                    self.assertFalse(coefficients[pixel, 1:].any())
+
+    def test_forecast_cube_is_chunked_transparently(self):
+        cube = self.samples.reshape(len(self.days), 5, 10)
+        forecast_days = [30, 60, 90]
+        whole = forecast_cube(self.days, cube, forecast_days, seasonal=True)
+        with mock.patch.object(forecast, 'FIT_CHUNK_PIXELS', 7):
+            np.testing.assert_array_equal(forecast_cube(self.days, cube, forecast_days, seasonal=True), whole)
+        self.assertEqual(whole.shape, (3, 5, 10))
+        self.assertEqual(whole.dtype, np.float32)
+
+        # Only the pixel without samples stays nodata, the rest stay in the observed range
+        self.assertTrue((whole[:, 0, 0] == NODATA).all())
+        data = np.delete(whole.reshape(3, -1), 0, axis=1)
+        valid = (cube != NODATA) & np.isfinite(cube)
+        self.assertGreaterEqual(data.min(), cube[valid].min())
+        self.assertLessEqual(data.max(), cube[valid].max())
+
+    def test_forecast_cube_without_samples_is_nodata(self):
+        cube = np.full((3, 2, 2), NODATA, dtype=np.float32)
+        np.testing.assert_array_equal(forecast_cube([-20, -10, 0], cube, [10]), NODATA)
+
+
+class FakeForecastPool:
+    """Stands in for the Prophet pool: submitted fits finish when the test says so."""
+
+    def __init__(self, full=False):
+        self.full = full
+        self.futures = []
+
+    def submit(self, func, *args, timeout=None):
+        if self.full:
+            raise TimeoutError('The forecast pool is full')
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+class FieldForecastCacheTests(SimpleTestCase):
+    series = [('field', {'2024-05-01': 1.0, '2024-05-08': 3.0}, ['2024-05-15'])]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = FieldForecastCache(directory.name, max_entries=10)
+
+    def pool(self, **kwargs):
+        pool = FakeForecastPool(**kwargs)
+        patcher = mock.patch.object(field_forecast, 'forecast_pool', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return pool
+
+    def test_fit_past_the_deadline_returns_the_mean_and_is_cached(self):
+        pool = self.pool()
+        started = time.monotonic()
+        self.assertEqual(self.cache.forecast(self.series, deadline=0.1), [('mean', {'2024-05-15': 2.0})])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIsNone(self.cache.load('field'))
+
+        # The fit finishes after the response
+        pool.futures[0].set_result(('model', [4.0]))
+        entry = self.cache.load('field')
+        self.assertEqual(entry['model'], 'model')
+        self.assertEqual(entry['forecasts'], {'2024-05-15': 4.0})
+
+        self.assertEqual(self.cache.forecast(self.series, deadline=0.1), [('prophet', {'2024-05-15': 4.0})])
+        self.assertEqual(len(pool.futures), 1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'fits': 1})
+
+    def test_failed_fit_returns_the_mean(self):
+        pool = self.pool()
+        pool_submit = pool.submit
+
+        def failing_submit(*args, **kwargs):
+            future = pool_submit(*args, **kwargs)
+            future.set_exception(ValueError('no fit'))
+            return future
+
+        pool.submit = failing_submit
+        with self.assertLogs('remote_sensing_app.field_forecast', 'WARNING'):
+            self.assertEqual(self.cache.forecast(self.series, deadline=1), [('mean', {'2024-05-15': 2.0})])
+        self.assertIsNone(self.cache.load('field'))
+
+    def test_short_series_and_full_pool_return_the_mean(self):
+        self.pool(full=True)
+        short = [('short', {'2024-05-01': 5.0}, ['2024-05-15'])]
+        self.assertEqual(self.cache.forecast(short + self.series, deadline=1),
+                         [('mean', {'2024-05-15': 5.0}), ('mean', {'2024-05-15': 2.0})])
+        self.assertEqual(self.cache.stats(), {'hits': 0, 'fits': 0})
+
+
+
+
+
+def blocked_task(started, release):
+    """A pool task that runs until ``release`` is set; returns its process id."""
+    started.set()
+    release.wait(10)
+    return os.getpid()
+
+
+class ProcessPoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.manager = multiprocessing.get_context('spawn').Manager()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.manager.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.started = self.manager.Event()
+        self.release = self.manager.Event()
+        self.addCleanup(self.release.set)
+
+    def pool(self, max_pending):
+        pool = ProcessPool(max_workers=2, max_pending=max_pending)
+        self.addCleanup(lambda: pool._executor is not None and pool._executor.shutdown(wait=True, cancel_futures=True))
+        # Cleanups run last first, so the blocked tasks end before the shutdown
+        self.addCleanup(self.release.set)
+        return pool
+
+    def block_workers(self, pool):
+        futures = [pool.submit(blocked_task, self.started, self.release) for _ in range(2)]
+        self.assertTrue(self.started.wait(30))
+        return futures
+
+    def wait_queued(self, future):
+        # The executor marks a task running as it queues it for its processes
+        deadline = time.monotonic() + 10
+        while not future.task.running() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(future.task.running())
+
+    def assert_slots_free(self, pool):
+        deadline = time.monotonic() + 10
+        while pool._slots._value < pool.max_pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool._slots._value, pool.max_pending)
+
+    def test_broken_pool_is_replaced_and_the_task_retried(self):
+        pool = self.pool(max_pending=4)
+        future = pool.submit(blocked_task, self.started, self.release)
+        self.assertTrue(self.started.wait(30))
+        killed = set(pool._executor._processes)
+        with self.assertLogs('remote_sensing_app.cpu_pool', 'WARNING'):
+            for pid in killed:
+                os.kill(pid, signal.SIGKILL)
+            self.release.set()
+            self.assertNotIn(future.result(timeout=30), killed)
+        self.assertEqual(pool.replaced, 1)
+        self.assert_slots_free(pool)
+
+    def test_task_that_breaks_every_pool_fails_after_one_retry(self):
+        pool = self.pool(max_pending=4)
+        future = pool.submit(os._exit, 1)
+        with self.assertLogs('remote_sensing_app.cpu_pool', 'WARNING') as logs, self.assertRaises(BrokenProcessPool):
+            future.result(timeout=30)
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(pool.replaced, 2)
+        self.assert_slots_free(pool)
+        self.assertEqual(pool.submit(abs, -3).result(timeout=30), 3)
+
+    def test_full_pool_fails_fast_until_its_tasks_end(self):
+        pool = self.pool(max_pending=2)
+        blocked = self.block_workers(pool)
+        with mock.patch.object(cpu_pool_module, 'cpu_pool', pool):
+            start = time.monotonic()
+            with self.assertRaises(CpuTimeout):
+                submit_shared(abs, (-3,), {}, timeout=0.2)
+            self.assertLess(time.monotonic() - start, 1)
+
+            # Giving up on the tasks does not free their slots while they run
+            with self.assertRaises(CpuTimeout):
+                results(blocked, timeout=0.1)
+            with self.assertRaises(CpuTimeout):
+                submit_shared(abs, (-3,), {}, timeout=0.1)
+
+            self.release.set()
+            self.assertEqual(submit_shared(abs, (-3,), {}, timeout=10).result(timeout=30), 3)
+
+    def test_timed_out_results_cancel_the_tasks_not_started(self):
+        pool = self.pool(max_pending=10)
+        futures = self.block_workers(pool) + [pool.submit(abs, -i) for i in range(8)]
+        self.wait_queued(futures[2])
+        with self.assertRaises(CpuTimeout):
+            results(futures, timeout=0.2)
+        cancelled = [future.cancelled() for future in futures]
+        # The executor already queued a few for its processes; those run anyway
+        self.assertFalse(any(cancelled[:2]))
+        self.assertTrue(cancelled[-1])
+        self.assertEqual(cancelled, sorted(cancelled))
+        # wait() sees cancelled futures done at once
+        self.assertEqual(wait(futures[-1:], timeout=0).done, {futures[-1]})
+
+        self.release.set()
+        wait(futures, timeout=30)
+        self.assertEqual([future.result() for future, gone in zip(futures[2:], cancelled[2:]) if not gone],
+                         [i for i, gone in zip(range(8), cancelled[2:]) if not gone])
+        self.assert_slots_free(pool)
+
+    def test_shared_arrays_outlive_the_tasks_that_read_them(self):
+        pool = self.pool(max_pending=10)
+        blocked = self.block_workers(pool)
+        array = np.arange(1000, dtype=np.float64)
+        shared = {}
+        with mock.patch.object(cpu_pool_module, 'cpu_pool', pool):
+            futures = [submit_shared(np.sum, (array,), shared) for _ in range(6)]
+        segment, = shared.values()
+        self.assertIsInstance(segment, SharedArray)
+        self.wait_queued(futures[0])
+
+        # The caller gives up: queued tasks cannot be cancelled and read the array later
+        cancelled = [future.cancel() for future in futures]
+        self.assertFalse(cancelled[0])
+        self.assertTrue(cancelled[-1])
+        release_when_done(futures, shared)
+        shared_memory.SharedMemory(name=segment.shm.name).close()
+
+        self.release.set()
+        wait(blocked + futures, timeout=30)
+        for future, gone in zip(futures, cancelled):
+            if not gone:
+                self.assertEqual(future.result(), array.sum())
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                shared_memory.SharedMemory(name=segment.shm.name).close()
+            except FileNotFoundError:
+                break
+            time.sleep(0.01)
+        else:
+            self.fail('The shared array was not released once its tasks ended')
+
+
+class StalledFuture(Future):
+    """A CPU pool future whose task never ends, recording whether it was cancelled."""
+
+    def __init__(self):
+        super().__init__()
+        self.cancel_calls = 0
+
+    def cancel(self):
+        self.cancel_calls += 1
+        return False
+
+
+@override_settings(REQUEST_BUDGET=1)
+class RequestBudgetTests(SimpleTestCase):
+    field = {'type': 'Polygon', 'coordinates': [[[10.0, 45.0], [10.01, 45.0], [10.01, 45.01], [10.0, 45.01], [10.0, 45.0]]]}
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.futures = []
+
+    def stalled_fetch(self, *args):
+        self.release.wait(10)
+        raise RuntimeError('released')
+
+    def slow_fetch(self, *args):
+        time.sleep(0.6)
+        return mock.Mock(valid=np.ones((4, 4), dtype=bool), data=np.zeros((4, 4, 5), dtype=np.uint16), key=None)
+
+    def stalled_task(self, *args, timeout=None):
+        self.futures.append(StalledFuture())
+        return self.futures[-1]
+
+    def post(self, view, data):
+        start = time.monotonic()
+        response = view.as_view()(APIRequestFactory().post('/', data, format='json'))
+        return response, time.monotonic() - start
+
+    def test_stalled_download_answers_within_the_budget(self):
+        with mock.patch('remote_sensing_app.viewscmput.fetch_band_stack', self.stalled_fetch):
+            response, elapsed = self.post(NDVIView, {'geometry': {'geometry': self.field}, 'date': '2024-05-01'})
+        self.assertEqual((response.status_code, response.data['error']), (504, FETCH_TIMEOUT_ERROR))
+        self.assertLess(elapsed, 1.5)
+
+    def test_cpu_stages_get_what_the_download_left(self):
+        # Each stage alone is within the budget, the two together are not
+        with mock.patch('remote_sensing_app.viewscmput.fetch_band_stack', self.slow_fetch), \
+                mock.patch('remote_sensing_app.viewscmput.submit_cpu', self.stalled_task):
+            response, elapsed = self.post(NDVIView, {'geometry': {'geometry': self.field}, 'date': '2024-05-01'})
+        self.assertEqual((response.status_code, response.data['error']), (504, CPU_TIMEOUT_ERROR))
+        self.assertGreaterEqual(elapsed, 0.9)
+        self.assertLess(elapsed, 1.5)
+        # The tile's task is cancelled once the request gives up on it
+        self.assertTrue(self.futures and all(future.cancel_calls for future in self.futures))
+
+    def test_forecast_downloads_get_what_the_preflight_left(self):
+        scene_index = mock.Mock()
+        scene_index.sync.side_effect = lambda *args, **kwargs: time.sleep(0.5)
+        scene_index.query.return_value = [('2024-05-01', 5.0)]
+        features = [{'geometry': self.field, 'properties': {'date': f'2024-05-{day:02d}'}} for day in (1, 11)]
+        with mock.patch('remote_sensing_app.viewscmput.scene_index', scene_index), \
+                mock.patch('remote_sensing_app.viewscmput.fetch_band_stacks', self.stalled_fetch):
+            response, elapsed = self.post(NDVIFView, {'features': features})
+        self.assertEqual((response.status_code, response.data['error']), (504, FORECAST_TIMEOUT_ERROR))
+        self.assertLess(elapsed, 1.5)
+
+
+
+def evalscript_lst(orbits):
+    """The original LST evalscript's per-pixel mean, max and std, transcribed sample by sample.
+
+    ``orbits`` are (S8, B06, B08, B11) tuples. Its cloud check read an SCL
+    band OLCI does not have, so every sample counted as valid. A pixel
+    without samples is NaN in every mode here rather than the script's
+    NaN mean and -Infinity max.
+    """
+    lsts = []
+    for s8, b06, b08, b11 in orbits:
+        if s8 <= 173 or s8 >= 65000 or b06 <= 0 or b08 <= 0 or b11 <= 0:
+            continue
+        brightness = s8 - 273.15
+        ndvi = (b08 - b11) / (b08 + b11)
+        pv = ((ndvi - 0.2) / (0.8 - 0.2)) ** 2
+        if ndvi < 0:
+            lse = 0.991
+        elif ndvi < 0.2:
+            lse = 0.966
+        elif ndvi > 0.8:
+            lse = 0.973
+        else:
+            lse = 0.973 * pv + 0.966 * (1 - pv) + 0.009
+        lsts.append(brightness / (1 + (0.000010854 * brightness / 0.01438) * math.log(lse)))
+    if not lsts:
+        return {'mean': math.nan, 'max': math.nan, 'std': math.nan}
+    mean = sum(lsts) / len(lsts)
+    std = math.sqrt(sum((lst - mean) ** 2 for lst in lsts) / (len(lsts) - 1)) if len(lsts) > 1 else math.nan
+    return {'mean': mean, 'max': max(lsts), 'std': std}
+
+
+class LSTTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        shape = (3, 4, LST_MAX_ORBITS)
+        s8 = rng.uniform(265, 325, shape)
+        b08 = rng.uniform(0.01, 0.5, shape)
+        # NDVIs below 0, between the soil and vegetation thresholds and above 0.8
+        ndvi = rng.choice([-0.3, 0.1, 0.2, 0.5, 0.8, 0.95], shape)
+        b11 = b08 * (1 - ndvi) / (1 + ndvi)
+        b06 = rng.uniform(0.01, 0.5, shape)
+        self.stack = np.stack([s8, b06, b08, b11], axis=-1).astype(np.float32)
+        self.assertEqual(LST_BANDS, ('S8', 'B06', 'B08', 'B11'))
+
+        # Unused orbit slots are zeros; some samples fail the range checks
+        self.stack[:, :, 3] = 0
+        self.stack[0, 0] = 0
+        self.stack[0, 1, 1:] = 0
+        self.stack[1, 0, 0, 0] = 65535
+        self.stack[1, 1, 1, 0] = 150
+        self.stack[1, 2, 2, 1] = 0
+
+    def test_temperatures_follow_the_evalscript(self):
+        lst = land_surface_temperature(self.stack)
+        self.assertEqual(lst.shape, (LST_MAX_ORBITS, 3, 4))
+        for y, x in np.ndindex(3, 4):
+            for orbit in range(LST_MAX_ORBITS):
+                expected = evalscript_lst([self.stack[y, x, orbit].astype(np.float64)])['mean']
+                if math.isnan(expected):
+                    self.assertTrue(np.isnan(lst[orbit, y, x]))
+                else:
+                    self.assertAlmostEqual(lst[orbit, y, x], expected, places=9)
+
+    def test_statistics_follow_the_evalscript(self):
+        statistics = lst_statistics(self.stack)
+        for y, x in np.ndindex(3, 4):
+            expected = evalscript_lst(self.stack[y, x].astype(np.float64))
+            for mode, value in expected.items():
+                if math.isnan(value):
+                    self.assertTrue(np.isnan(statistics[mode][y, x]), (mode, y, x))
+                else:
+                    self.assertAlmostEqual(statistics[mode][y, x], value, places=6, msg=(mode, y, x))
+        # No samples at all, then a single one: no std
+        self.assertTrue(np.isnan(statistics['mean'][0, 0]))
+        self.assertTrue(np.isnan(statistics['std'][0, 1]) and np.isfinite(statistics['mean'][0, 1]))
+
+    def test_field_means_skip_pixels_without_samples(self):
+        # The left half of the 4 x 3 pixel raster
+        bbox = (10.0, 45.0, 10.004, 45.003)
+        polygon = shapely.box(10.0, 45.0, 10.0015, 45.003)
+        result = field_lst(self.stack, bbox, polygon)
+        statistics = lst_statistics(self.stack)
+        for mode, value in result.items():
+            values = statistics[mode][:, :2]
+            self.assertAlmostEqual(value, float(values[np.isfinite(values)].mean()), places=9)
+
+        empty = np.zeros_like(self.stack)
+        self.assertIsNone(field_lst(empty, bbox, polygon))
+
+
+class CacheStatsViewTests(SimpleTestCase):
+    def test_reports_the_worker_counters(self):
+        response = CacheStatsView.as_view()(APIRequestFactory().get('/stats/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pid'], os.getpid())
+        self.assertEqual(set(response.data['raster_cache']),
+                         {'hits', 'misses', 'evictions', 'coalesced', 'coalesced_across_workers'})
+        self.assertEqual(set(response.data['hot_tier']), {'hits', 'misses', 'evictions', 'bytes_served'})
+        self.assertEqual(set(response.data['field_forecast_cache']), {'hits', 'fits'})
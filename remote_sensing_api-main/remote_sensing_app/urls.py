@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import path
 # from .views import SentinelDataAvailabilityView, NDVIView, NDWIView, NDMIView, CRIView, LSTView, WaterStressIndexView, CropYieldIndexView, ARVIView, CARIView, MCARIView, NDVIFView, NDWIFView, NDMIFView, CRIFView, LSTFView, WaterStressIndexForecastView, CropYieldIndexForecastView, ARVIFView, CARIFView, MCARIFView
 # from .viewscm import SentinelDataAvailabilityView, NDVIView, NDWIView, NDMIView, CRIView, LSTView, WaterStressIndexView, CropYieldIndexView, ARVIView, CARIView, MCARIView, NDVIFView, NDWIFView, NDMIFView, CRIFView, LSTFView, WaterStressIndexForecastView, CropYieldIndexForecastView, ARVIFView, CARIFView, MCARIFView
-from .viewscmput import SentinelDataAvailabilityView, NDVIView, NIRView, NDWIView, NDMIView, CRIView, LSTView, WaterStressIndexView, CropYieldIndexView, ARVIView, CARIView, MCARIView, NDVIFView, NDWIFView, NDMIFView, CRIFView, LSTFView, WaterStressIndexForecastView, CropYieldIndexForecastView, ARVIFView, CARIFView, MCARIFView
+from .viewscmput import SentinelDataAvailabilityView, NDVIView, NIRView, NDWIView, NDMIView, CRIView, LSTView, WaterStressIndexView, CropYieldIndexView, ARVIView, CARIView, MCARIView, IndicesView, NDVIFView, NDWIFView, NDMIFView, CRIFView, LSTFView, WaterStressIndexForecastView, CropYieldIndexForecastView, ARVIFView, CARIFView, MCARIFView, CacheStatsView
 
 urlpatterns = [
     path('sentinel-data-availability/', SentinelDataAvailabilityView.as_view(), name='sentinel-data-availability'),
@@ -18,6 +19,7 @@ urlpatterns = [
     path('dsw/', ARVIView.as_view(), name='dsw'),
     path('cpl/', CARIView.as_view(), name='cpl'),
     path('cpg/', MCARIView.as_view(), name='cpg'),    
+    path('indices/', IndicesView.as_view(), name='indices'),
 
     path('ndvif/', NDVIFView.as_view(), name='calculate_ndvif'),
     path('ndwif/', NDWIFView.as_view(), name='ndwi'),
@@ -29,4 +31,7 @@ urlpatterns = [
     path('dswf/', ARVIFView.as_view(), name='dsw'),
     path('cplf/', CARIFView.as_view(), name='cpl'),
     path('cpgf/', MCARIFView.as_view(), name='cpg'),
-]
\ No newline at end of file
+]
+
+if settings.DEBUG:
+    urlpatterns.append(path('stats/', CacheStatsView.as_view(), name='stats'))
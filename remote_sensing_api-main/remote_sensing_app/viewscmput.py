@@ -1,26 +1,176 @@
+from django.conf import settings
 from django.http import JsonResponse
+from django.utils.dateparse import parse_date
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from sentinelhub import SentinelHubRequest, SentinelHubCatalog, DataCollection, MimeType, CRS, SHConfig, BBox
+from sentinelhub import SentinelHubRequest, DataCollection, MimeType, CRS, SHConfig, BBox
 from shapely.geometry import shape, Point, mapping, Polygon, MultiPolygon
 from datetime import datetime, timedelta
-from sklearn.linear_model import LinearRegression
+from functools import partial
+import logging
+import os
+import sqlite3
 import numpy as np
-import rasterio
-from rasterio.features import shapes
+from rasterio.features import geometry_mask
 from rasterio.transform import from_bounds
-import geopandas as gpd
-from .serializers import EndDateSerializer, IndicesSerializer
-import json
-import pandas as pd
-from prophet import Prophet
-import random
+from .serializers import EndDateSerializer, IndicesSerializer, OUTPUT_MODES
+from .raster_cache import raster_cache
+from .hot_tier import hot_tier
+from .band_stack import (fetch_band_stack, fetch_band_stacks, fetch_class_stack, compute_index, request_size, tile_grid,
+                         tile_grid_size, cluster_bboxes, pixel_area, stack_feature_batches, class_stack_feature_batches,
+                         dates_per_request, NODATA, REFLECTANCE_SCALE, REFLECTANCE_NODATA)
+from .classification import CLASS_BREAKS, FORECAST_CLASS_BREAKS
+from .polygonize import index_feature_collection, stitch_batches, FeatureBatch
+from .budget import RequestBudget
+from .fetch_pool import fetch_all, FetchTimeout
+from .cpu_pool import (run as run_cpu, run_all as run_cpu_all, submit as submit_cpu, results as cpu_results, CpuTimeout,
+                       SharedArray)
+from .forecast import forecast_feature_batches, FORECAST_MODELS
+from .field_forecast import field_forecast_cache, field_key
+from .scene_index import scene_index
+from .lst import fetch_lst_stack, field_lst
+
+logger = logging.getLogger(__name__)
 
 config = SHConfig()
 config.sh_client_id = '9db91b67-1611-42b4-8b62-4b18344e9146'
 config.sh_client_secret = 'GR9vjnIhWF4DocX9nycKw7ulfF2aDk6T'
 
+# Availability queries without a start_date search from here
+AVAILABILITY_START_DATE = datetime(2023, 1, 1).date()
+
+CPU_TIMEOUT_ERROR = 'Processing the satellite data took too long. Try a smaller area.'
+FETCH_TIMEOUT_ERROR = 'Fetching the satellite data took too long. Try a smaller area.'
+NO_DATA_ERROR = 'No valid data available for the given date and area. Try adjusting the date or area.'
+
+# UINT16 reflectance code of NIRView's average NIR, 0 being reserved for no data
+NIR_CODE_FUNCTION = """
+        function encode(nir) {
+            return Math.min(65535, Math.max(1, Math.round(nir * 10000)));
+        }
+"""
+
+
+def polygonize_response(index_array, reclassify, bbox, polygon, class_property='class_no'):
+    """Class polygons of an index raster as a JsonResponse, computed on the CPU pool."""
+    try:
+        collection = run_cpu(index_feature_collection, index_array, reclassify, tuple(bbox), polygon, class_property)
+    except CpuTimeout:
+        return Response({'error': CPU_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    return JsonResponse(collection)
+
+
+def field_tiles(bbox, polygon):
+    """The tiles to fetch for a field: a tile_grid of every cluster of its parts.
+
+    Far-apart parts of a MultiPolygon are clustered (cluster_bboxes) rather
+    than fetched within one ``bbox``. Returns the (tile bbox, size) pairs
+    and the tile numbers of each cluster, and logs the pixels saved.
+    """
+    clusters = cluster_bboxes(polygon)
+    if len(clusters) == 1:
+        clusters = [bbox]
+    else:
+        envelope = pixel_area(tuple(bbox))
+        saved = envelope - sum(pixel_area(tuple(cluster)) for cluster in clusters)
+        logger.info("Fetching %d clusters instead of the field's bbox saves %d of %d pixels", len(clusters), saved, envelope)
+
+    tiles, cluster_tiles = [], []
+    for cluster in clusters:
+        grid = tile_grid(cluster)
+        cluster_tiles.append(list(range(len(tiles), len(tiles) + len(grid))))
+        tiles.extend(grid)
+    return tiles, cluster_tiles
+
+
+def stitch_clusters(tiles, clusters, tile_batches, class_properties, timeout=None):
+    """Merge the FeatureBatches of every tile into one per class property.
+
+    ``tile_batches`` maps the tile numbers with data to their batches, one
+    per class property. Tiles of one cluster are stitched on the CPU pool,
+    within ``timeout`` seconds (see run_all); clusters never overlap, so
+    they are simply concatenated.
+    """
+    merged = [[] for _ in class_properties]
+    stitch_jobs = []
+    for cluster in clusters:
+        cluster_batches = [tile_batches[t] for t in cluster if t in tile_batches]
+        if len(cluster) == 1:
+            for i, batch in enumerate(cluster_batches[0] if cluster_batches else []):
+                merged[i].append(batch)
+        elif cluster_batches:
+            grid_size = tile_grid_size([tiles[t] for t in cluster])
+            for i, class_property in enumerate(class_properties):
+                stitch_jobs.append((i, ([batches[i] for batches in cluster_batches], grid_size, class_property)))
+    for (i, _), batch in zip(stitch_jobs, run_cpu_all(stitch_batches, [job for _, job in stitch_jobs], timeout)):
+        merged[i].append(batch)
+    return [FeatureBatch.concat(batches) for batches in merged]
+
+
+def index_batches(bbox, date, polygon, indices, server_classes=False, budget=None):
+    """Class polygons of several indices of one field and date, one FeatureBatch each.
+
+    ``indices`` is a list of (index, class_breaks, class_property). The
+    field is fetched at RESOLUTION as the tiles of field_tiles,
+    concurrently. Each tile goes to the CPU pool as soon as it arrives, so
+    only the tiles in flight are held in memory, and the tiles' polygons
+    are stitched across the seams. With ``server_classes`` Sentinel Hub
+    classifies the tiles (fetch_class_stack) instead of this worker
+    computing the indices from their bands. Every stage waits only for what
+    is left of ``budget`` (a RequestBudget started here by default).
+    Returns None when no tile has valid data. Raises FetchTimeout or
+    CpuTimeout.
+    """
+    if budget is None:
+        budget = RequestBudget()
+    tiles, clusters = field_tiles(bbox, polygon)
+    class_properties = [class_property for _, _, class_property in indices]
+    futures = [None] * len(tiles)
+    try:
+        if server_classes:
+            class_indices = [(index, class_breaks) for index, class_breaks, _ in indices]
+            for t, classes in fetch_all(fetch_class_stack, [(tile, date, class_indices, config, size) for tile, size in tiles],
+                                        budget.remaining()):
+                # Pixels without valid data are class 0 like unclassified ones
+                if classes.any():
+                    futures[t] = submit_cpu(class_stack_feature_batches, classes, class_properties, tuple(tiles[t][0]), polygon,
+                                            timeout=budget.remaining())
+        else:
+            for t, stack in fetch_all(fetch_band_stack, [(tile, date, config, size) for tile, size in tiles], budget.remaining()):
+                if stack.valid.any():
+                    futures[t] = submit_cpu(stack_feature_batches, stack.data, indices, tuple(tiles[t][0]), polygon, stack.key,
+                                            timeout=budget.remaining())
+        if not any(futures):
+            return None
+
+        with_data = [t for t, future in enumerate(futures) if future is not None]
+        tile_batches = dict(zip(with_data, cpu_results([futures[t] for t in with_data], budget.remaining())))
+    except Exception:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        raise
+    return stitch_clusters(tiles, clusters, tile_batches, class_properties, budget.remaining())
+
+
+def index_response(bbox, date, polygon, index, class_property='class_no', output='float'):
+    """The class polygons of one index as a JsonResponse, or the error response.
+
+    ``output`` is one of OUTPUT_MODES; 'classes' has Sentinel Hub classify the index.
+    """
+    try:
+        batches = index_batches(bbox, date, polygon, [(index, CLASS_BREAKS[index], class_property)],
+                                server_classes=output == 'classes')
+    except FetchTimeout:
+        return Response({'error': FETCH_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    except CpuTimeout:
+        return Response({'error': CPU_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    if batches is None:
+        return Response({'error': NO_DATA_ERROR}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(batches[0].to_geojson())
+
+
 class SentinelDataAvailabilityView(APIView):
     def post(self, request):
         geojson_polygon = request.data.get('geometry')
@@ -36,21 +186,31 @@ class SentinelDataAvailabilityView(APIView):
         serializer = EndDateSerializer(data=request.data)
         if serializer.is_valid():
             end_date = serializer.validated_data['end_date']
+            start_date = serializer.validated_data.get('start_date', AVAILABILITY_START_DATE)
+            if start_date > end_date:
+                return Response({'error': 'Start date cannot be after end date.'}, status=status.HTTP_400_BAD_REQUEST)
             cloud_coverage = int(request.data.get('cloud_coverage', 100))
             if cloud_coverage > 100:
                 return Response({'error': 'Cloud coverage value cannot be greater than 100.'}, status=status.HTTP_400_BAD_REQUEST)
-            catalog = SentinelHubCatalog(config=config)
-            search_results = catalog.search(
-                collection=DataCollection.SENTINEL2_L2A,
-                bbox=bbox,
-                filter=f"eo:cloud_cover < {cloud_coverage}",
-                time=('2023-01-01', end_date),
-            )
-            dates = {datetime.fromisoformat(result['properties']['datetime'][:-1]).date().isoformat() for result in search_results}
-            return JsonResponse(list(dates), safe=False)
+            scenes = scene_index.scenes(DataCollection.SENTINEL2_L2A, bbox, start_date, end_date, config, max_cloud_cover=cloud_coverage)
+            dates = sorted({scene_date for scene_date, _ in scenes})
+            return JsonResponse(dates, safe=False)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+INDEX_CLASS_PROPERTIES = {
+    'ndvi': 'class_no',
+    'ndwi': 'class_no',
+    'ndmi': 'class_no',
+    'cri': 'class_no',
+    'wst': 'class_no',
+    'cyi': 'class_no',
+    'arvi': 'arvi_class',
+    'cari': 'cari_class',
+    'mcari': 'mcari_class',
+}
+
+
 # Vegetation Health
 class NDVIView(APIView):
     def post(self, request):
@@ -67,128 +227,10 @@ class NDVIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return { 
-                    input: ["B04", "B08", "B11", "SCL"],  // Added B11 for better vegetation detection under trees
-                    output: { bands: 1, sampleType: "FLOAT32" }, 
-                    mosaicking: "ORBIT" 
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB04 = [], validValuesB11 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B04 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB04[a] = sample.B04;
-                            validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                            a++;
-                        }
-                    }
-                }
-
-                var ndvi;
-                if (a > 0) {
-                    var avgB08 = getValue(validValuesB08);
-                    var avgB04 = getValue(validValuesB04);
-                    var avgB11 = getValue(validValuesB11);
-                    
-                    // Modified NDVI calculation to include under-canopy plants using B11
-                    if (avgB11 > 0.3) { // Threshold to identify tree canopies
-                        // Adjust NDVI for plants under tree canopies
-                        ndvi = (avgB08 - avgB04) / (avgB08 + avgB04 + avgB11); 
-                    } else {
-                        // Regular NDVI calculation
-                        ndvi = (avgB08 - avgB04) / (avgB08 + avgB04);
-                    }
-                } else {
-                    ndvi = -9999; // No valid data
-                }
-
-                return [ndvi];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            # Check if the response is empty (all invalid values)
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_ndvi(ndvi_array):
-                classified_array = np.zeros_like(ndvi_array, dtype=np.uint8)
-                classified_array[(ndvi_array <= 0) & (ndvi_array != -9999)] = 1
-                classified_array[(ndvi_array > 0) & (ndvi_array <= 0.1)] = 2
-                classified_array[(ndvi_array > 0.1) & (ndvi_array <= 0.2)] = 3
-                classified_array[(ndvi_array > 0.2) & (ndvi_array <= 0.4)] = 4
-                classified_array[(ndvi_array > 0.4) & (ndvi_array <= 0.5)] = 5
-                classified_array[(ndvi_array > 0.5) & (ndvi_array <= 0.6)] = 6
-                classified_array[(ndvi_array > 0.6) & (ndvi_array <= 0.7)] = 7
-                classified_array[(ndvi_array > 0.7) & (ndvi_array <= 1)] = 8
-                classified_array[(ndvi_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_ndvi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
+            return index_response(bbox, date, polygon, 'ndvi', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
 #COFFEE RIPENESS USING NIR
 class NIRView(APIView):
     def post(self, request):
@@ -205,12 +247,22 @@ class NIRView(APIView):
         date = request.data.get('date')
         if not date:
             return Response({'error': 'Date is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        output = request.data.get('output', 'float')
+        if output not in OUTPUT_MODES:
+            return Response({'error': f"Output must be one of {', '.join(OUTPUT_MODES)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The average NIR value travels as a UINT16 reflectance code, or as
+        # its ripeness class when Sentinel Hub classifies it
+        if output == 'classes':
+            sample_type, encode = 'UINT8', CLASS_BREAKS['nir'].evalscript_function('encode')
+        else:
+            sample_type, encode = 'UINT16', NIR_CODE_FUNCTION
 
         evalscript = """
         function setup() {
             return { 
                 input: ["B08", "B04", "SCL"],  // B08 for NIR, B04 for Red
-                output: { bands: 1, sampleType: "FLOAT32" }, 
+                output: { bands: 1, sampleType: "__SAMPLE_TYPE__" }, 
                 mosaicking: "ORBIT" 
             };
         }
@@ -223,7 +275,7 @@ class NIRView(APIView):
             }
             return true;
         }
-
+        __ENCODE__
         function evaluatePixel(samples) {
             var validValuesB08 = [], validValuesB04 = [];
             var a = 0;
@@ -240,56 +292,39 @@ class NIRView(APIView):
                 }
             }
 
-            var nirValue = -9999; // Default if no valid data
+            var nirValue = 0; // Default if no valid data
             if (a > 0) {
                 // Compute the average NIR value
-                nirValue = validValuesB08.reduce((a, b) => a + b, 0) / a;  // Average NIR
+                nirValue = encode(validValuesB08.reduce((a, b) => a + b, 0) / a);  // Average NIR
             }
 
             return [nirValue];
         }
-        """
+        """.replace('__SAMPLE_TYPE__', sample_type).replace('__ENCODE__', encode)
 
         sentinel_request = SentinelHubRequest(
             evalscript=evalscript,
             input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
             responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
             bbox=bbox,
-            size=[512, 354.253],
+            size=request_size(bbox),
             config=config,
         )
 
-        response = sentinel_request.get_data()[0]
+        response = raster_cache.get_data(sentinel_request)[0]
 
         # Check if the response is empty (all invalid values)
-        if np.all(response == -9999):
+        if np.all(response == REFLECTANCE_NODATA):
             return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
 
-        transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-        def reclassify_nir(nir_array):
-            classified_array = np.zeros_like(nir_array, dtype=np.uint8)
-            classified_array[(nir_array <= 0.1) & (nir_array != -9999)] = 1  # Unripe
-            classified_array[(nir_array > 0.1) & (nir_array <= 0.3)] = 2  # Almost ripe
-            classified_array[(nir_array > 0.3) & (nir_array <= 0.5)] = 3  # Ripe
-            classified_array[(nir_array > 0.5) & (nir_array <= 0.7)] = 4  # Overripe
-            classified_array[(nir_array > 0.7) & (nir_array <= 1)] = 5    # Very overripe
-            classified_array[(nir_array == -9999)] = 0  # Set cloudy pixels to 0
-            return classified_array
-
-        classified_image = reclassify_nir(response)
-        shapes_gen = shapes(classified_image, mask=None, transform=transform)
-        geometries = list(shapes_gen)
-
-        features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-        geojson_data = {"type": "FeatureCollection", "features": features}
-
-        geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-        geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-        intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-        intersection_geojson = intersection_df.to_json()
+        if output == 'classes':
+            # Already classes, polygonized as they are
+            reclassify = np.asarray
+        else:
+            # The codes are classified through a lookup table, never decoded
+            reclassify = partial(CLASS_BREAKS['nir'].classify_quantized, scale=REFLECTANCE_SCALE, nodata=REFLECTANCE_NODATA)
+        return polygonize_response(response, reclassify, bbox, polygon)
 
-        return JsonResponse(json.loads(intersection_geojson))
 
 # Humidity level
 class NDWIView(APIView):
@@ -307,125 +342,7 @@ class NDWIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return { 
-                    input: ["B03", "B08", "B11", "SCL"],  // Added B11 for detecting vegetation under trees
-                    output: { bands: 1, sampleType: "FLOAT32" }, 
-                    mosaicking: "ORBIT" 
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Using SCL to filter out clouds, shadows, and invalid pixels
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude cloud and cloud shadow pixels
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB03 = [], validValuesB08 = [], validValuesB11 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B03 > 0 && sample.B08 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB03[a] = sample.B03;
-                            validValuesB08[a] = sample.B08;
-                            validValuesB11[a] = sample.B11;  // B11 added for under-tree vegetation detection
-                            a++;
-                        }
-                    }
-                }
-
-                var ndwi;
-                if (a > 0) {
-                    var avgB03 = getValue(validValuesB03);
-                    var avgB08 = getValue(validValuesB08);
-                    var avgB11 = getValue(validValuesB11);
-
-                    if (avgB11 > 0.3) {  // Threshold to account for vegetation under tree canopies
-                        // Adjust NDWI considering B11 for under-canopy water
-                        ndwi = (avgB03 - avgB08) / (avgB03 + avgB08 + avgB11);
-                    } else {
-                        // Standard NDWI calculation
-                        ndwi = (avgB03 - avgB08) / (avgB03 + avgB08);
-                    }
-                } else {
-                    ndwi = -9999; // No valid data
-                }
-
-                return [ndwi];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            # Check if the response is empty (all invalid values)
-            if np.all(response == 0):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_ndwi(ndwi_array):
-                classified_array = np.zeros_like(ndwi_array, dtype=np.uint8)
-                classified_array[(ndwi_array <= -1) & (ndwi_array != -9999)] = 1
-                classified_array[(ndwi_array > -1) & (ndwi_array <= 0)] = 2
-                classified_array[(ndwi_array > 0) & (ndwi_array <= 0.1)] = 3
-                classified_array[(ndwi_array > 0.1) & (ndwi_array <= 0.2)] = 4
-                classified_array[(ndwi_array > 0.2) & (ndwi_array <= 0.3)] = 5
-                classified_array[(ndwi_array > 0.3) & (ndwi_array <= 0.4)] = 6
-                classified_array[(ndwi_array > 0.4) & (ndwi_array <= 0.5)] = 7
-                classified_array[(ndwi_array > 0.5) & (ndwi_array <= 1)] = 8
-                classified_array[(ndwi_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_ndwi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
+            return index_response(bbox, date, polygon, 'ndwi', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -445,125 +362,7 @@ class NDMIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return { 
-                    input: ["B08", "B11", "B04", "SCL"],  // Added B04 for vegetation detection under trees
-                    output: { bands: 1, sampleType: "FLOAT32" }, 
-                    mosaicking: "ORBIT" 
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Using SCL to filter out clouds and invalid pixels, keeping tree canopy (SCL = 4) for analysis
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB11 = [], validValuesB04 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B11 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB11[a] = sample.B11;
-                            validValuesB04[a] = sample.B04;  // Added B04 for better vegetation assessment
-                            a++;
-                        }
-                    }
-                }
-
-                var ndmi;
-                if (a > 0) {
-                    var avgB08 = getValue(validValuesB08);
-                    var avgB11 = getValue(validValuesB11);
-                    var avgB04 = getValue(validValuesB04);
-
-                    if (avgB04 > 0.3) { // Threshold to detect vegetation under tree canopies
-                        // Adjust NDMI for plants under tree canopies
-                        ndmi = (avgB08 - avgB11) / (avgB08 + avgB11 + avgB04); 
-                    } else {
-                        // Regular NDMI calculation
-                        ndmi = (avgB08 - avgB11) / (avgB08 + avgB11);
-                    }
-                } else {
-                    ndmi = -9999; // No valid data
-                }
-
-                return [ndmi];
-            }
-            """
-            
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            # Check if the response is empty (all invalid values)
-            if np.all(response == 0):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_ndmi(ndmi_array):
-                classified_array = np.zeros_like(ndmi_array, dtype=np.uint8)
-                classified_array[(ndmi_array <= -1) & (ndmi_array != -9999)] = 1
-                classified_array[(ndmi_array > -1) & (ndmi_array <= 0)] = 2
-                classified_array[(ndmi_array > 0) & (ndmi_array <= 0.1)] = 3
-                classified_array[(ndmi_array > 0.1) & (ndmi_array <= 0.2)] = 4
-                classified_array[(ndmi_array > 0.2) & (ndmi_array <= 0.3)] = 5
-                classified_array[(ndmi_array > 0.3) & (ndmi_array <= 0.4)] = 6
-                classified_array[(ndmi_array > 0.4) & (ndmi_array <= 0.5)] = 7
-                classified_array[(ndmi_array > 0.5) & (ndmi_array <= 1)] = 8
-                classified_array[(ndmi_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_ndmi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
+            return index_response(bbox, date, polygon, 'ndmi', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -581,117 +380,9 @@ class CRIView(APIView):
 
         bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
         serializer = IndicesSerializer(data=request.data)
-
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return { 
-                    input: ["B04", "B11", "SCL"],  // Included B11 for detecting vegetation under trees
-                    output: { bands: 1, sampleType: "FLOAT32" }, 
-                    mosaicking: "ORBIT" 
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB04 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B04 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB04[a] = sample.B04;
-                            a++;
-                        }
-                    }
-                }
-
-                var cri;
-                if (a > 0) {
-                    cri = getValue(validValuesB04);
-                } else {
-                    cri = -9999; // No valid data
-                }
-
-                return [cri];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            # Check if the response is empty (all invalid values)
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_cri(cri_array):
-                classified_array = np.zeros_like(cri_array, dtype=np.uint8)
-                classified_array[(cri_array <= 10) & (cri_array != -9999)] = 1
-                classified_array[(cri_array > 10) & (cri_array <= 20)] = 2
-                classified_array[(cri_array > 20) & (cri_array <= 30)] = 3
-                classified_array[(cri_array > 30) & (cri_array <= 40)] = 4
-                classified_array[(cri_array > 40) & (cri_array <= 50)] = 5
-                classified_array[(cri_array > 50) & (cri_array <= 60)] = 6
-                classified_array[(cri_array > 60) & (cri_array <= 70)] = 7
-                classified_array[(cri_array > 70) & (cri_array <= 100)] = 8
-                classified_array[(cri_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_cri(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
-
+            return index_response(bbox, date, polygon, 'cri', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -720,156 +411,20 @@ class LSTView(APIView):
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        evalscript = """
-            var option = 0;
-            var minC = 0;
-            var maxC = 50;
-            var NDVIs = 0.2;
-            var NDVIv = 0.8;
-            var waterE = 0.991;
-            var soilE = 0.966;
-            var vegetationE = 0.973;
-            var C = 0.009;
-            var bCent = 0.000010854;
-            var rho = 0.01438;
-
-            if (option == 2) {
-                minC = 0;
-                maxC = 25;
-            }
-
-            let viz = ColorGradientVisualizer.createRedTemperature(minC, maxC);
-
-            function setup() {
-                return {
-                    input: [
-                        { datasource: "S3SLSTR", bands: ["S8"] },
-                        { datasource: "S3OLCI", bands: ["B06", "B08", "B11"] } // Include B11 for vegetation detection under trees
-                    ],
-                    output: [
-                        { id: "default", bands: 3, sampleType: SampleType.AUTO }
-                    ],
-                    mosaicking: "ORBIT"
-                };
-            }
-
-            // Cloud validation function
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Using SCL to filter out clouds and invalid pixels
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude cloud and cloud shadow pixels
-                }
-                return true;
-            }
-
-            // Function to calculate Land Surface Emissivity (LSE)
-            function LSEcalc(NDVI, Pv) {
-                var LSE;
-                if (NDVI < 0) {
-                    LSE = waterE;
-                } else if (NDVI < NDVIs) {
-                    LSE = soilE;
-                } else if (NDVI > NDVIv) {
-                    LSE = vegetationE;
-                } else {
-                    LSE = vegetationE * Pv + soilE * (1 - Pv) + C;
-                }
-                return LSE;
-            }
-
-            function evaluatePixel(samples) {
-                var validLSTs = [];
-                var invalidLSTs = [];
-                var N = samples.S3SLSTR.length;
-
-                for (let i = 0; i < N; i++) {
-                    var sampleSLSTR = samples.S3SLSTR[i];
-                    var sampleOLCI = samples.S3OLCI[i];
-
-                    var Bi = sampleSLSTR.S8;
-                    var B06i = sampleOLCI.B06;
-                    var B08i = sampleOLCI.B08;
-                    var B11i = sampleOLCI.B11; // Added B11 for better vegetation assessment
-
-                    if ((Bi <= 173 || Bi >= 65000) || (B06i <= 0 || B08i <= 0 || B11i <= 0)) {
-                        continue; // Skip invalid measurements
-                    }
-
-                    var isValid = validate(sampleOLCI); // Validate using the cloud mask (SCL)
-                    var S8BTi = Bi - 273.15; // Convert to Celsius
-                    var NDVIi = (B08i - B11i) / (B08i + B11i); // Adjusted NDVI calculation
-                    var PVi = Math.pow(((NDVIi - NDVIs) / (NDVIv - NDVIs)), 2);
-                    var LSEi = LSEcalc(NDVIi, PVi);
-                    var LSTi = (S8BTi / (1 + (((bCent * S8BTi) / rho) * Math.log(LSEi))));
-
-                    if (isValid) {
-                        validLSTs.push(LSTi);
-                    } else {
-                        invalidLSTs.push(LSTi);
-                    }
-                }
-
-                // Select valid LSTs if available, otherwise fall back to invalid ones
-                var LSTsToUse = validLSTs.length > 0 ? validLSTs : invalidLSTs;
-
-                var outLST;
-                if (option == 0) {
-                    outLST = LSTsToUse.reduce((a, b) => a + b, 0) / LSTsToUse.length; // Average
-                } else if (option == 1) {
-                    outLST = Math.max(...LSTsToUse); // Maximum
-                } else {
-                    var avg = LSTsToUse.reduce((a, b) => a + b, 0) / LSTsToUse.length;
-                    outLST = Math.sqrt(LSTsToUse.reduce((sum, lst) => sum + Math.pow(lst - avg, 2), 0) / (LSTsToUse.length - 1)); // Standard deviation
-                }
-
-                return viz.process(outLST);
-            }
-        """
-
-        request = SentinelHubRequest(
-            evalscript=evalscript,
-            input_data=[
-                SentinelHubRequest.input_data(
-                    data_collection=DataCollection.SENTINEL3_SLSTR,
-                    identifier="S3SLSTR",
-                    time_interval=(date, date),
-                ),
-                SentinelHubRequest.input_data(
-                    data_collection=DataCollection.SENTINEL3_OLCI,
-                    identifier="S3OLCI",
-                    time_interval=(date, date),
-                ),
-            ],
-            responses=[
-                SentinelHubRequest.output_response('default', MimeType.TIFF),
-            ],
-            bbox=bbox,
-            size=[512, 354.253],
-            config=config,
-        )
-
-        response = request.get_data()
-        response_data = response[0]
-        print(response_data)
-
-        transform = rasterio.transform.from_bounds(*bbox, response_data.shape[1], response_data.shape[0])
-
-        # Scaling factors
-        minC = 0  # Set based on your evalscript
-        maxC = 50  # Set based on your evalscript
-
-        # Convert red channel values to temperature
-        response_data_temp = minC + (response_data[..., 0] / 255.0) * (maxC - minC)
-
-        # Check if any value in red channel is 255
-        if np.any(response_data[..., 0] == 255):
-            return Response({'error': 'Red channel value is 255, possibly querying temperature for tomorrow.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            (_, stack), = fetch_all(fetch_lst_stack, [(bbox, date, config)], RequestBudget().remaining())
+        except FetchTimeout:
+            return Response({'error': FETCH_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
 
-        # Calculate mean of response_data_temp and round to nearest integer
-        mean_temp = np.round(np.mean(response_data_temp))
+        # Temperatures come from the raw Sentinel-3 bands of the field's pixels
+        temperatures = field_lst(stack, tuple(bbox), polygon)
+        if temperatures is None:
+            return Response({'error': NO_DATA_ERROR}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response({'mean_temperature': int(mean_temp)}, status=status.HTTP_200_OK)
+        return Response({
+            'mean_temperature': int(round(temperatures['mean'])),
+            'statistics': {mode: None if value is None else round(value, 2) for mode, value in temperatures.items()},
+        }, status=status.HTTP_200_OK)
 
 
 #Water Stress
@@ -888,121 +443,7 @@ class WaterStressIndexView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return {
-                    input: ["B04", "B08", "B11", "SCL"], // Added B11 for better vegetation detection under trees
-                    output: { bands: 1, sampleType: "FLOAT32" },
-                    mosaicking: "ORBIT"
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000); // Filter by recent data
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude cloud and invalid pixels, keep tree canopy (SCL = 4) for processing
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB04 = [], validValuesB11 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B04 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB04[a] = sample.B04;
-                            validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                            a++;
-                        }
-                    }
-                }
-
-                var wst;
-                if (a > 0) {
-                    // Calculate WST using valid pixel data
-                    var avgB04 = getValue(validValuesB04);
-                    var avgB08 = getValue(validValuesB08);
-                    var avgB11 = getValue(validValuesB11);
-
-                    // Modified WST calculation to include under-canopy plants using B11
-                    wst = (avgB04 - avgB08) / (avgB04 + avgB08 + avgB11);
-                } else {
-                    wst = -9999; // No valid data
-                }
-
-                return [wst];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            # Check if the response is empty (all invalid values)
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_wsi(wsi_array):
-                classified_array = np.zeros_like(wsi_array, dtype=np.uint8)
-                classified_array[(wsi_array <= -1) & (wsi_array != -9999)] = 1
-                classified_array[(wsi_array > -1) & (wsi_array <= 0)] = 2
-                classified_array[(wsi_array > 0) & (wsi_array <= 0.1)] = 3
-                classified_array[(wsi_array > 0.1) & (wsi_array <= 0.2)] = 4
-                classified_array[(wsi_array > 0.2) & (wsi_array <= 0.3)] = 5
-                classified_array[(wsi_array > 0.3) & (wsi_array <= 0.4)] = 6
-                classified_array[(wsi_array > 0.4) & (wsi_array <= 0.5)] = 7
-                classified_array[(wsi_array > 0.5) & (wsi_array <= 1)] = 8
-                classified_array[(wsi_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_wsi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
+            return index_response(bbox, date, polygon, 'wst', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -1022,126 +463,7 @@ class CropYieldIndexView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return { 
-                    input: ["B04", "B08", "B02", "B11", "SCL"],  // Added B11 for better vegetation detection under trees
-                    output: { bands: 1, sampleType: "FLOAT32" }, 
-                    mosaicking: "ORBIT" 
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude clouds and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB04 = [], validValuesB02 = [], validValuesB11 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B04 > 0 && sample.B02 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB04[a] = sample.B04;
-                            validValuesB02[a] = sample.B02;
-                            validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                            a++;
-                        }
-                    }
-                }
-
-                var arvi;
-                if (a > 0) {
-                    var NIR = getValue(validValuesB08);
-                    var RED = getValue(validValuesB04);
-                    var BLUE = getValue(validValuesB02);
-                    var avgB11 = getValue(validValuesB11);
-
-                    // Adjusting ARVI for plants under tree canopies using B11
-                    if (avgB11 > 0.3) { // Threshold to identify tree canopies
-                        arvi = (NIR - (2 * RED - BLUE)) / (NIR + (2 * RED - BLUE + avgB11));
-                    } else {
-                        arvi = (NIR - (2 * RED - BLUE)) / (NIR + (2 * RED - BLUE));
-                    }
-                } else {
-                    arvi = -9999; // No valid data
-                }
-
-                return [arvi];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            # Check if the response is empty (all invalid values)
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_cyi(cyi_array):
-                classified_array = np.zeros_like(cyi_array, dtype=np.uint8)
-                classified_array[(cyi_array <= 0) & (cyi_array != -9999)] = 1
-                classified_array[(cyi_array > 0) & (cyi_array <= 0.1)] = 2
-                classified_array[(cyi_array > 0.1) & (cyi_array <= 0.2)] = 3
-                classified_array[(cyi_array > 0.2) & (cyi_array <= 0.3)] = 4
-                classified_array[(cyi_array > 0.3) & (cyi_array <= 0.4)] = 5
-                classified_array[(cyi_array > 0.4) & (cyi_array <= 0.5)] = 6
-                classified_array[(cyi_array > 0.5) & (cyi_array <= 0.6)] = 7
-                classified_array[(cyi_array > 0.6) & (cyi_array <= 1)] = 8
-                classified_array[(cyi_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_cyi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
+            return index_response(bbox, date, polygon, 'cyi', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -1161,131 +483,7 @@ class ARVIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return {
-                    input: ["B02", "B04", "B08", "B11", "SCL"],  // Include Blue, Red, NIR, SWIR bands and Scene Classification Layer (SCL)
-                    output: {
-                        id: "default",
-                        bands: 1,
-                        sampleType: "FLOAT32"
-                    },
-                    mosaicking: "ORBIT"  // Use ORBIT-based mosaicking
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);  // Filter scenes from the last 3 months
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);  // Use first quartile as the value
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false;  // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB04 = [], validValuesB02 = [], validValuesB11 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B04 > 0 && sample.B02 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB04[a] = sample.B04;
-                            validValuesB02[a] = sample.B02;  
-                            validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                            a++;
-                        }
-                    }
-                }
-
-                var ARVI;
-                if (a > 0) {
-                    var avgB08 = getValue(validValuesB08);
-                    var avgB04 = getValue(validValuesB04);
-                    var avgB02 = getValue(validValuesB02);
-                    var avgB11 = getValue(validValuesB11);
-                    
-                    // Adjust ARVI calculation to account for plants under tree canopies
-                    if (avgB11 > 0.3) { // Threshold to identify tree canopies
-                        // Adjust ARVI for under-canopy plants using SWIR
-                        ARVI = (avgB08 - (2 * avgB04 - avgB02)) / (avgB08 + (2 * avgB04 - avgB02) + avgB11);
-                    } else {
-                        // Regular ARVI calculation
-                        ARVI = (avgB08 - (2 * avgB04 - avgB02)) / (avgB08 + (2 * avgB04 - avgB02));
-                    }
-                } else {
-                    ARVI = -9999;  // No valid data
-                }
-
-                return [ARVI];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            if np.all(response == 0):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            # The reclassification logic is the same as before
-            def reclassify_arvi(arvi_array):
-                classified_array = np.zeros_like(arvi_array, dtype=np.uint8)
-                classified_array[(arvi_array <= 0) & (arvi_array != -9999)] = 1
-                classified_array[(arvi_array > 0) & (arvi_array <= 0.1)] = 2
-                classified_array[(arvi_array > 0.1) & (arvi_array <= 0.2)] = 3
-                classified_array[(arvi_array > 0.2) & (arvi_array <= 0.3)] = 4
-                classified_array[(arvi_array > 0.3) & (arvi_array <= 0.4)] = 5
-                classified_array[(arvi_array > 0.4) & (arvi_array <= 0.5)] = 6
-                classified_array[(arvi_array > 0.5) & (arvi_array <= 0.6)] = 7
-                classified_array[(arvi_array > 0.6) & (arvi_array <= 1)] = 8
-                classified_array[(arvi_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_arvi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"arvi_class": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
-        
+            return index_response(bbox, date, polygon, 'arvi', class_property='arvi_class', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -1305,133 +503,7 @@ class CARIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return {
-                    input: ["B03", "B04", "B08", "B11", "SCL"], // Added B11 for better vegetation detection
-                    output: {
-                        id: "default",
-                        bands: 1,
-                        sampleType: "FLOAT32"
-                    },
-                    mosaicking: "ORBIT"
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000); // 3-month filter
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude clouds, cloud shadows, and water
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false;
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB04 = [], validValuesB03 = [], validValuesB11 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B04 > 0 && sample.B03 > 0 && sample.B11 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB04[a] = sample.B04;
-                            validValuesB03[a] = sample.B03;
-                            validValuesB11[a] = sample.B11; // Using B11 for vegetation under trees
-                            a++;
-                        }
-                    }
-                }
-
-                var CARI;
-                if (a > 0) {
-                    var GREEN = getValue(validValuesB03);
-                    var RED = getValue(validValuesB04);
-                    var NIR = getValue(validValuesB08);
-                    var SWIR = getValue(validValuesB11); // Incorporating B11
-
-                    // Calculate CARI considering vegetation under trees
-                    var term1 = Math.pow((NIR - GREEN) / 150, 2);
-                    var term2 = Math.pow((RED - GREEN), 2);
-                    CARI = Math.sqrt(term1 + term2);
-
-                    // Adjust CARI calculation for conditions under tree canopies
-                    if (SWIR > 0.3) { // Threshold for identifying vegetation under canopies
-                        CARI *= 1.1; // Example adjustment factor
-                    }
-                } else {
-                    CARI = -9999; // No valid data
-                }
-
-                return [CARI];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_cari(cari_array):
-                classified_array = np.zeros_like(cari_array, dtype=np.uint8)
-                classified_array[(cari_array <= 0) & (cari_array != -9999)] = 1
-                classified_array[(cari_array > 0) & (cari_array <= 0.1)] = 2
-                classified_array[(cari_array > 0.1) & (cari_array <= 0.2)] = 3
-                classified_array[(cari_array > 0.2) & (cari_array <= 0.3)] = 4
-                classified_array[(cari_array > 0.3) & (cari_array <= 0.4)] = 5
-                classified_array[(cari_array > 0.4) & (cari_array <= 0.5)] = 6
-                classified_array[(cari_array > 0.5) & (cari_array <= 0.6)] = 7
-                classified_array[(cari_array > 0.6) & (cari_array <= 1)] = 8
-                classified_array[(cari_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_cari(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"cari_class": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
-
+            return index_response(bbox, date, polygon, 'cari', class_property='cari_class', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -1451,130 +523,12 @@ class MCARIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-                return {
-                    input: ["B02", "B03", "B04", "B08", "B11", "SCL"],  // Added B11 for better vegetation detection under trees
-                    output: {
-                        id: "default",
-                        bands: 1,
-                        sampleType: "FLOAT32"
-                    },
-                    mosaicking: "ORBIT"
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000); // Last 3 months of data
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesBlue = [], validValuesGreen = [], validValuesRed = [], validValuesNIR = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B02 > 0 && sample.B03 > 0 && sample.B04 > 0 && sample.B08 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesBlue[a] = sample.B02;
-                            validValuesGreen[a] = sample.B03;
-                            validValuesRed[a] = sample.B04;
-                            validValuesNIR[a] = sample.B08; // Including NIR for under-canopy plants
-                            a++;
-                        }
-                    }
-                }
-
-                var mcari;
-                if (a > 0) {
-                    // Calculate MCARI using valid values
-                    var BLUE = getValue(validValuesBlue);
-                    var GREEN = getValue(validValuesGreen);
-                    var RED = getValue(validValuesRed);
-                    var NIR = getValue(validValuesNIR);
-
-                    mcari = (RED - GREEN) - 0.2 * (RED - BLUE) * (RED / NIR);
-                } else {
-                    mcari = -9999; // No valid data
-                }
-
-                return [mcari];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_mcari(mcari_array):
-                classified_array = np.zeros_like(mcari_array, dtype=np.uint8)
-                classified_array[(mcari_array <= 0) & (mcari_array != -9999)] = 1
-                classified_array[(mcari_array > 0) & (mcari_array <= 0.1)] = 2
-                classified_array[(mcari_array > 0.1) & (mcari_array <= 0.2)] = 3
-                classified_array[(mcari_array > 0.2) & (mcari_array <= 0.3)] = 4
-                classified_array[(mcari_array > 0.3) & (mcari_array <= 0.4)] = 5
-                classified_array[(mcari_array > 0.4) & (mcari_array <= 0.5)] = 6
-                classified_array[(mcari_array > 0.5) & (mcari_array <= 0.6)] = 7
-                classified_array[(mcari_array > 0.6) & (mcari_array <= 1)] = 8
-                classified_array[(mcari_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_mcari(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"mcari_class": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
+            return index_response(bbox, date, polygon, 'mcari', class_property='mcari_class', output=serializer.validated_data['output'])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-# Chlorophyll Growth
-class MCARIView(APIView):
+# All indices of one field and date
+class IndicesView(APIView):
     def post(self, request):
         geojson_polygon = request.data.get('geometry')
         if not geojson_polygon:
@@ -1589,125 +543,275 @@ class MCARIView(APIView):
         serializer = IndicesSerializer(data=request.data)
         if serializer.is_valid():
             date = serializer.validated_data['date']
-            evalscript = """
-            function setup() {
-              return {
-                input: [{
-                  bands: [
-                    "B04",
-                    "B03",
-                    "B02",
-                    "SCL"
-                  ]
-                }],
-                output: { bands: 3, sampleType: "UINT16" },
-                mosaicking: "ORBIT"
-              };
-            }
-
-            function preProcessScenes(collections) {
-              collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                var orbitDateFrom = new Date(orbit.dateFrom)
-                return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-              })
-              return collections
-            }
-
-            function getValue(values) {
-              values.sort(function (a, b) { return a - b; });
-              return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-              var index = Math.floor(sortedValues.length / 4);
-              return sortedValues[index];
-            }
-
-            function validate(samples) {
-              var scl = samples.SCL;
-
-              if (scl === 3 || scl === 9 || scl === 8 || scl === 7 || scl === 10 || scl === 11 || scl === 1) {
-                return false;
-              }
-              return true;
-            }
+            indices = [(index, CLASS_BREAKS[index], class_property) for index, class_property in INDEX_CLASS_PROPERTIES.items()]
+            try:
+                batches = index_batches(bbox, date, polygon, indices,
+                                        server_classes=serializer.validated_data['output'] == 'classes')
+            except FetchTimeout:
+                return Response({'error': FETCH_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+            except CpuTimeout:
+                return Response({'error': CPU_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
 
-            function evaluatePixel(samples) {
-              var clo_b02 = []; var clo_b03 = []; var clo_b04 = [];
-              var a = 0;
+            if batches is None:
+                return Response({'error': NO_DATA_ERROR}, status=status.HTTP_404_NOT_FOUND)
 
-              for (var i = 0; i < samples.length; i++) {
-                var sample = samples[i];
+            return JsonResponse({index: batch.to_geojson() for index, batch in zip(INDEX_CLASS_PROPERTIES, batches)})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-                if (sample.B02 > 0 && sample.B03 > 0 && sample.B04 > 0) {
-                  var isValid = validate(sample);
 
-                  if (isValid) {
-                    clo_b02[a] = sample.B02;
-                    clo_b03[a] = sample.B03;
-                    clo_b04[a] = sample.B04;
-                    a = a + 1;
-                  }
-                }
-              }
-
-              var rValue, gValue, bValue;
-              if (a > 0) {
-                rValue = getValue(clo_b04);
-                gValue = getValue(clo_b03);
-                bValue = getValue(clo_b02);
-              } else {
-                rValue = gValue = bValue = 0; // No valid data case
-              }
-              return [rValue * 10000, gValue * 10000, bValue * 10000];
-            }
-            """
-
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                ],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            if np.all(response == -9999):
-                return Response({'error': 'No valid data available for the given date and area. Try adjusting the date or area.'}, status=status.HTTP_404_NOT_FOUND)
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            def reclassify_mcari(mcari_array):
-                classified_array = np.zeros_like(mcari_array, dtype=np.uint8)
-                classified_array[(mcari_array <= 0) & (mcari_array != -9999)] = 1
-                classified_array[(mcari_array > 0) & (mcari_array <= 0.1)] = 2
-                classified_array[(mcari_array > 0.1) & (mcari_array <= 0.2)] = 3
-                classified_array[(mcari_array > 0.2) & (mcari_array <= 0.3)] = 4
-                classified_array[(mcari_array > 0.3) & (mcari_array <= 0.4)] = 5
-                classified_array[(mcari_array > 0.4) & (mcari_array <= 0.5)] = 6
-                classified_array[(mcari_array > 0.5) & (mcari_array <= 0.6)] = 7
-                classified_array[(mcari_array > 0.6) & (mcari_array <= 1)] = 8
-                classified_array[(mcari_array == -9999)] = 0  # Set cloudy pixels to 0
-                return classified_array
-
-            classified_image = reclassify_mcari(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"mcari_class": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            return JsonResponse(json.loads(intersection_geojson))
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+# Forecast views fetch every date of the request concurrently
+FORECAST_TIMEOUT_ERROR = 'Fetching the satellite data took too long. Try fewer dates or a smaller area.'
+
+# Forecast horizon of a field observed on a single date
+DEFAULT_FORECAST_DAYS = 30
+
+# LSTFView forecasts the mean temperature a week past the last date
+LST_FORECAST_DAYS = 7
+
+
+def feature_date(date):
+    """The date of a forecast feature, or None when it is not a valid date."""
+    try:
+        return parse_date(str(date))
+    except ValueError:
+        return None
+
+
+def sync_scenes(bbox, start, end, timeout):
+    """scene_index.sync of one pre-flight bbox, returning the error rather than raising it."""
+    try:
+        scene_index.sync(DataCollection.SENTINEL2_L2A, bbox, start, end, config, timeout=timeout)
+    except Exception as e:
+        return e
+    return None
+
+
+def preflight_jobs(jobs, max_cloud_cover=None, timeout=None):
+    """Split (bbox, date, polygon) jobs into those worth downloading and skipped dates.
+
+    The scene index syncs each bbox of the jobs, from its earliest to its
+    latest date, concurrently on the fetch pool; each job is then checked
+    locally for a Sentinel-2 scene over its bbox on its date with less than
+    ``max_cloud_cover`` percent cloud (FORECAST_MAX_CLOUD_COVER by default).
+    The jobs of a bbox whose sync fails, or is still running after
+    ``timeout`` seconds (SCENE_INDEX_PREFLIGHT_TIMEOUT by default), are kept
+    unchecked. Jobs whose date does not parse are always skipped.
+    """
+    if max_cloud_cover is None:
+        max_cloud_cover = settings.FORECAST_MAX_CLOUD_COVER
+    if timeout is None:
+        timeout = settings.SCENE_INDEX_PREFLIGHT_TIMEOUT
+
+    invalid = [{'date': date, 'reason': 'invalid_date'} for _, date, _ in jobs if feature_date(date) is None]
+    jobs = [job for job in jobs if feature_date(job[1]) is not None]
+    if not jobs:
+        return [], invalid
+
+    # Far-apart fields, or one field's dates, never widen another's search
+    areas = {}
+    for bbox, date, _ in jobs:
+        areas.setdefault(tuple(bbox), []).append(feature_date(date))
+    areas = list(areas.items())
+    budget = RequestBudget(timeout)
+    sync_jobs = [(BBox(bbox=bounds, crs=CRS.WGS84), min(dates), max(dates), timeout) for bounds, dates in areas]
+    checked = set()
+    try:
+        for a, error in fetch_all(sync_scenes, sync_jobs, budget.remaining()):
+            if error is None:
+                checked.add(areas[a][0])
+            else:
+                logger.warning("Catalog pre-flight failed, fetching every date: %s", error)
+    except FetchTimeout:
+        logger.warning("Catalog pre-flight ran out of time, fetching the dates of %d of %d fields unchecked",
+                       len(areas) - len(checked), len(areas))
+
+    usable, skipped = [], invalid
+    for job in jobs:
+        if tuple(job[0]) not in checked:
+            usable.append(job)
+            continue
+        job_date = feature_date(job[1])
+        try:
+            scenes = scene_index.query(DataCollection.SENTINEL2_L2A, job[0], job_date, job_date, timeout=budget.remaining())
+        except sqlite3.OperationalError as e:
+            logger.warning("Scene index unavailable, fetching %s unchecked: %s", job[1], e)
+            usable.append(job)
+            continue
+        if not scenes:
+            skipped.append({'date': job[1], 'reason': 'no_acquisition'})
+            continue
+        cloud_cover = min(100 if cloud is None else cloud for _, cloud in scenes)
+        if cloud_cover >= max_cloud_cover:
+            skipped.append({'date': job[1], 'reason': 'cloud_cover', 'cloud_cover': cloud_cover})
+            continue
+        usable.append(job)
+    return usable, skipped
+
+
+def forecast_fields(jobs, index, class_breaks, forecast_dates=None, seasonal=False, class_property='class_no', budget=None):
+    """Forecast the index classes of every field from its (bbox, date, polygon) jobs.
+
+    Dates the catalog pre-flight rules out are never downloaded. Each
+    geometry is fetched as the tiles of field_tiles, within the request size
+    limit, and the dates of each tile come from multi-temporal requests,
+    split by dates_per_request so each response stays within
+    MAX_REQUEST_VALUES band values, that download concurrently, tile after
+    tile. Every tile's index rasters are written into a (date, y, x) cube in
+    shared memory, which goes to the CPU pool as soon as the tile's last
+    request arrives and is released when its task ends, so only the tiles in
+    flight are held in memory. There a per-pixel trend (plus an annual
+    harmonic when ``seasonal``) is fitted to each pixel's valid samples;
+    each forecast date is then predicted, reclassified and polygonized once,
+    and the tiles are stitched across their seams. Without
+    ``forecast_dates`` a field is forecast one median interval of its
+    downloaded dates past the last one. The mean index of each field is
+    forecast as well, by the cached field models of field_forecast. Returns
+    a FeatureCollection whose features carry their forecast 'date' and whose
+    'fields' list the mean forecasts, and the skipped dates with their
+    reason. Every stage waits only for what is left of ``budget`` (a
+    RequestBudget started here by default); raises FetchTimeout when the
+    downloads outlast it and CpuTimeout when the fits and polygons do.
+    """
+    if budget is None:
+        budget = RequestBudget()
+    jobs, skipped = preflight_jobs(jobs, timeout=budget.remaining(settings.SCENE_INDEX_PREFLIGHT_TIMEOUT))
+
+    fields = {}
+    for i, (bbox, date, polygon) in enumerate(jobs):
+        field = fields.get(polygon.wkb)
+        if field is None:
+            tiles, clusters = field_tiles(bbox, polygon)
+            field = fields[polygon.wkb] = {'bbox': bbox, 'polygon': polygon, 'tiles': tiles, 'clusters': clusters,
+                                           'dates': {}, 'cubes': {}, 'futures': {}, 'batches': {}}
+        field['dates'].setdefault(feature_date(date).isoformat(), []).append(i)
+    requests = []
+    for field in fields.values():
+        dates = sorted(field['dates'])
+        observed = [parse_date(date) for date in dates]
+        field['targets'] = forecast_dates or [observed[-1] + default_forecast_step(observed)]
+        field['days'] = [(date - observed[-1]).days for date in observed]
+        field['forecast_days'] = [(date - observed[-1]).days for date in field['targets']]
+        # (total, count) of the valid index values inside the field, by date
+        field['sums'] = {date: (0.0, 0) for date in dates}
+        field['valid'] = set()
+        # Requests are tile-major, so the pool finishes one tile's dates before the next tile's
+        for t, (_, size) in enumerate(field['tiles']):
+            step = dates_per_request(size)
+            for start in range(0, len(dates), step):
+                requests.append((field, t, start, dates[start:start + step]))
+
+    fetch_jobs = [(field['tiles'][t][0], dates, config, field['tiles'][t][1]) for field, t, _, dates in requests]
+    try:
+        for r, stacks in fetch_all(fetch_band_stacks, fetch_jobs, budget.remaining()):
+            field, t, start, dates = requests[r]
+            cube = field['cubes'].get(t)
+            if cube is None:
+                cube = field['cubes'][t] = new_tile_cube(field, t, stacks[0].valid.shape)
+            for d, (date, stack) in enumerate(zip(dates, stacks), start):
+                values = compute_index(stack, index)
+                cube['values'].array()[d] = values
+                valid = (values != NODATA) & np.isfinite(values)
+                if valid.any():
+                    field['valid'].add(date)
+                    cube['has_data'] = True
+                in_field = values[cube['in_field'] & valid]
+                total, count = field['sums'][date]
+                field['sums'][date] = (total + float(in_field.sum(dtype=np.float64)), count + in_field.size)
+
+            cube['requests'] -= 1
+            if cube['requests']:
+                continue
+            del field['cubes'][t]
+            if cube['has_data']:
+                field['futures'][t] = submit_cpu(forecast_feature_batches, field['days'], cube['values'],
+                                                 field['forecast_days'], seasonal, class_breaks,
+                                                 tuple(field['tiles'][t][0]), field['polygon'], class_property,
+                                                 timeout=budget.remaining())
+            else:
+                cube['values'].unlink()
+    except Exception:
+        for field in fields.values():
+            for cube in field['cubes'].values():
+                cube['values'].unlink()
+            for future in field['futures'].values():
+                future.cancel()
+        raise
+
+    means = []
+    for field in fields.values():
+        for date in sorted(field['dates']):
+            if date not in field['valid']:
+                skipped.extend({'date': jobs[i][1], 'reason': 'no_valid_data'} for i in field['dates'][date])
+        field_means = {date: total / count for date, (total, count) in sorted(field['sums'].items()) if count}
+        if field_means:
+            means.append((field, (field_key(field['polygon'], index), field_means,
+                                  [target.isoformat() for target in field['targets']])))
+
+    # Fitting and polygonizing the tiles runs on the CPU pool
+    job_tiles = [(field, t) for field in fields.values() for t in sorted(field['futures'])]
+    for (field, t), tile_batches in zip(job_tiles, cpu_results([field['futures'][t] for field, t in job_tiles], budget.remaining())):
+        field['batches'][t] = tile_batches
+
+    # Each tile has one batch per forecast date, stitched like class properties
+    batches = []
+    for field in fields.values():
+        if not field['batches']:
+            continue
+        stitched = stitch_clusters(field['tiles'], field['clusters'], field['batches'], [class_property] * len(field['targets']),
+                                   budget.remaining())
+        batches.extend(batch.with_column('date', target.isoformat()) for target, batch in zip(field['targets'], stitched))
+
+    # The field models get what is left, up to FIELD_FORECAST_DEADLINE
+    forecasts = field_forecast_cache.forecast([series for _, series in means], budget.remaining(settings.FIELD_FORECAST_DEADLINE))
+    field_forecasts = []
+    for (field, _), (model, forecast) in zip(means, forecasts):
+        field_forecasts.append({'bbox': list(field['bbox']), 'model': model, 'mean': forecast})
+    collection = FeatureBatch.concat(batches).to_geojson()
+    collection['fields'] = field_forecasts
+    return collection, skipped
+
+
+def new_tile_cube(field, t, shape):
+    """The empty shared (date, y, x) cube of one tile of a forecast field, with its field mask."""
+    height, width = shape
+    in_field = geometry_mask([field['polygon']], out_shape=shape, transform=from_bounds(*field['tiles'][t][0], width, height),
+                             invert=True, all_touched=True)
+    return {'values': SharedArray.empty((len(field['dates']), height, width), np.float32), 'in_field': in_field,
+            'requests': -(-len(field['dates']) // dates_per_request(field['tiles'][t][1])), 'has_data': False}
+
+
+def default_forecast_step(dates):
+    if len(dates) < 2:
+        return timedelta(days=DEFAULT_FORECAST_DAYS)
+    return timedelta(days=int(np.median(np.diff([date.toordinal() for date in dates]))))
+
+
+def forecast_response(request, jobs, index, class_breaks, class_property='class_no'):
+    """Run forecast_fields for a forecast view, with the request's forecast options.
+
+    ``forecast_dates`` (a list of ISO dates) and ``forecast_model`` ('trend'
+    or 'seasonal') are optional in the request body.
+    """
+    forecast_dates = request.data.get('forecast_dates')
+    if forecast_dates is not None:
+        if not isinstance(forecast_dates, list) or not forecast_dates:
+            return Response({'error': 'forecast_dates must be a list of dates.'}, status=status.HTTP_400_BAD_REQUEST)
+        forecast_dates = [feature_date(date) for date in forecast_dates]
+        if None in forecast_dates:
+            return Response({'error': 'forecast_dates must be a list of dates.'}, status=status.HTTP_400_BAD_REQUEST)
+    forecast_model = request.data.get('forecast_model', 'trend')
+    if forecast_model not in FORECAST_MODELS:
+        return Response({'error': f"forecast_model must be one of {', '.join(FORECAST_MODELS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        collection, skipped = forecast_fields(jobs, index, class_breaks, forecast_dates,
+                                              seasonal=forecast_model == 'seasonal', class_property=class_property)
+    except FetchTimeout:
+        return Response({'error': FORECAST_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    except CpuTimeout:
+        return Response({'error': CPU_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    collection['skipped'] = skipped
+    return Response(collection, status=status.HTTP_200_OK)
 
 
 # Vegetation Health Forecast
@@ -1717,8 +821,7 @@ class NDVIFView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-        
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -1732,224 +835,28 @@ class NDVIFView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            serializer = IndicesSerializer(data={'date': date})  # Adjust data as needed
+            serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return { 
-                        input: ["B04", "B08", "B11", "SCL"],  // Added B11 for better vegetation detection under trees
-                        output: { bands: 1, sampleType: "FLOAT32" }, 
-                        mosaicking: "ORBIT" 
-                    };
-                }
+                jobs.append((bbox, date, polygon))
 
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                    });
-                    return collections;
-                }
+        return forecast_response(request, jobs, 'ndvi', FORECAST_CLASS_BREAKS['ndvi'])
 
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);
-                }
 
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
 
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false; // Exclude clouds, cloud shadows, and water
-                    }
-                    return true;
-                }
+# Humidity Forecast
+class NDWIFView(APIView):
+    def post(self, request):
+        geojson_collection = request.data.get('features')
+        if not geojson_collection:
+            return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB08 = [], validValuesB04 = [], validValuesB11 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B08 > 0 && sample.B04 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB08[a] = sample.B08;
-                                validValuesB04[a] = sample.B04;
-                                validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                                a++;
-                            }
-                        }
-                    }
+        jobs = []
+        for feature in geojson_collection:
+            geojson_polygon = feature['geometry']
+            date = feature['properties'].get('date')
 
-                    var ndvi;
-                    if (a > 0) {
-                        var avgB08 = getValue(validValuesB08);
-                        var avgB04 = getValue(validValuesB04);
-                        var avgB11 = getValue(validValuesB11);
-                        
-                        // Modified NDVI calculation to include under-canopy plants using B11
-                        if (avgB11 > 0.3) { // Threshold to identify tree canopies
-                            // Adjust NDVI for plants under tree canopies
-                            ndvi = (avgB08 - avgB04) / (avgB08 + avgB04 + avgB11); 
-                        } else {
-                            // Regular NDVI calculation
-                            ndvi = (avgB08 - avgB04) / (avgB08 + avgB04);
-                        }
-                    } else {
-                        ndvi = -9999; // No valid data
-                    }
-
-                    return [ndvi];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue 
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_ndvi(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_ndvi(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_ndvi(self, ndvi_array):
-        classified_array = np.zeros_like(ndvi_array, dtype=np.uint8)
-        classified_array[(ndvi_array <= 0) & (ndvi_array != -9999)] = 1
-        classified_array[(ndvi_array > 0) & (ndvi_array <= 0.1)] = 2
-        classified_array[(ndvi_array > 0.1) & (ndvi_array <= 0.2)] = 3
-        classified_array[(ndvi_array > 0.2) & (ndvi_array <= 0.4)] = 4
-        classified_array[(ndvi_array > 0.4) & (ndvi_array <= 0.5)] = 5
-        classified_array[(ndvi_array > 0.5) & (ndvi_array <= 0.6)] = 6
-        classified_array[(ndvi_array > 0.6) & (ndvi_array <= 0.7)] = 7
-        classified_array[(ndvi_array > 0.7) & (ndvi_array <= 1)] = 8
-        classified_array[(ndvi_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_ndvi(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array) 
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates'] 
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
-
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
-
-        return predicted_geojson
-
-
-# Humidity Forecast
-class NDWIFView(APIView):
-    def post(self, request):
-        geojson_collection = request.data.get('features')
-        if not geojson_collection:
-            return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        results = []
-        
-        for feature in geojson_collection:
-            geojson_polygon = feature['geometry']
-            date = feature['properties'].get('date')
-
-            if not geojson_polygon or not date:
-                continue
+            if not geojson_polygon or not date:
+                continue
 
             try:
                 polygon = shape(geojson_polygon)
@@ -1957,193 +864,12 @@ class NDWIFView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            serializer = IndicesSerializer(data={'date': date})  # Adjust data as needed
+            serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return { 
-                        input: ["B03", "B08", "B11", "SCL"],  // Added B11 for detecting vegetation under trees
-                        output: { bands: 1, sampleType: "FLOAT32" }, 
-                        mosaicking: "ORBIT" 
-                    };
-                }
-
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                    });
-                    return collections;
-                }
-
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);
-                }
-
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
-
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Using SCL to filter out clouds, shadows, and invalid pixels
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false; // Exclude cloud and cloud shadow pixels
-                    }
-                    return true;
-                }
-
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB03 = [], validValuesB08 = [], validValuesB11 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B03 > 0 && sample.B08 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB03[a] = sample.B03;
-                                validValuesB08[a] = sample.B08;
-                                validValuesB11[a] = sample.B11;  // B11 added for under-tree vegetation detection
-                                a++;
-                            }
-                        }
-                    }
-
-                    var ndwi;
-                    if (a > 0) {
-                        var avgB03 = getValue(validValuesB03);
-                        var avgB08 = getValue(validValuesB08);
-                        var avgB11 = getValue(validValuesB11);
-
-                        if (avgB11 > 0.3) {  // Threshold to account for vegetation under tree canopies
-                            // Adjust NDWI considering B11 for under-canopy water
-                            ndwi = (avgB03 - avgB08) / (avgB03 + avgB08 + avgB11);
-                        } else {
-                            // Standard NDWI calculation
-                            ndwi = (avgB03 - avgB08) / (avgB03 + avgB08);
-                        }
-                    } else {
-                        ndwi = -9999; // No valid data
-                    }
-
-                    return [ndwi];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[
-                        SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                    ],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue 
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_ndwi(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_ndwi(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_ndwi(self, ndwi_array):
-        classified_array = np.zeros_like(ndwi_array, dtype=np.uint8)
-        classified_array[(ndwi_array <= 0) & (ndwi_array != -9999)] = 1
-        classified_array[(ndwi_array > 0) & (ndwi_array <= 0.1)] = 2
-        classified_array[(ndwi_array > 0.1) & (ndwi_array <= 0.2)] = 3
-        classified_array[(ndwi_array > 0.2) & (ndwi_array <= 0.4)] = 4
-        classified_array[(ndwi_array > 0.4) & (ndwi_array <= 0.5)] = 5
-        classified_array[(ndwi_array > 0.5) & (ndwi_array <= 0.6)] = 6
-        classified_array[(ndwi_array > 0.6) & (ndwi_array <= 0.7)] = 7
-        classified_array[(ndwi_array > 0.7) & (ndwi_array <= 1)] = 8
-        classified_array[(ndwi_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_ndwi(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
+                jobs.append((bbox, date, polygon))
 
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
+        return forecast_response(request, jobs, 'ndwi', FORECAST_CLASS_BREAKS['ndwi'], class_property='predicted_class')
 
-        # Placeholder for prediction logic, you can implement your own model prediction
-        predicted_class = np.round(np.mean(class_numbers_array)).astype(int) 
-
-        # Formulate output features
-        for idx, geometry in enumerate(valid_results):
-            predicted_features.append({
-                "type": "Feature",
-                "geometry": geometry['geometry'],
-                "properties": {"predicted_class": predicted_class}
-            })
-
-        return {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
 
 
 # Plant Moisture Forecast
@@ -2153,8 +879,7 @@ class NDMIFView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-        
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -2168,205 +893,10 @@ class NDMIFView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            
-            evalscript = """
-            function setup() {
-                return { 
-                    input: ["B08", "B11", "B04", "SCL"],  // Added B04 for vegetation detection under trees
-                    output: { bands: 1, sampleType: "FLOAT32" }, 
-                    mosaicking: "ORBIT" 
-                };
-            }
-
-            function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom);
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                });
-                return collections;
-            }
-
-            function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-            }
-
-            function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-            }
-
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Using SCL to filter out clouds and invalid pixels, keeping tree canopy (SCL = 4) for analysis
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude clouds, cloud shadows, and water
-                }
-                return true;
-            }
-
-            function evaluatePixel(samples, scenes) {
-                var validValuesB08 = [], validValuesB11 = [], validValuesB04 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-                    if (sample.B08 > 0 && sample.B11 > 0) {
-                        var isValid = validate(sample);
-                        if (isValid) {
-                            validValuesB08[a] = sample.B08;
-                            validValuesB11[a] = sample.B11;
-                            validValuesB04[a] = sample.B04;  // Added B04 for better vegetation assessment
-                            a++;
-                        }
-                    }
-                }
-
-                var ndmi;
-                if (a > 0) {
-                    var avgB08 = getValue(validValuesB08);
-                    var avgB11 = getValue(validValuesB11);
-                    var avgB04 = getValue(validValuesB04);
-
-                    if (avgB04 > 0.3) { // Threshold to detect vegetation under tree canopies
-                        // Adjust NDMI for plants under tree canopies
-                        ndmi = (avgB08 - avgB11) / (avgB08 + avgB11 + avgB04); 
-                    } else {
-                        // Regular NDMI calculation
-                        ndmi = (avgB08 - avgB11) / (avgB08 + avgB11);
-                    }
-                } else {
-                    ndmi = -9999; // No valid data
-                }
-
-                return [ndmi];
-            }
-            """
-            
-            sentinel_request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            response = sentinel_request.get_data()[0]
-
-            if np.all(response == -9999):
-                continue 
-
-            transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-            classified_image = self.reclassify_ndmi(response)
-            shapes_gen = shapes(classified_image, mask=None, transform=transform)
-            geometries = list(shapes_gen)
-
-            features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-            geojson_data = {"type": "FeatureCollection", "features": features}
-
-            geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-            geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-            intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-            intersection_geojson = intersection_df.to_json()
-
-            results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_ndmi(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_ndmi(self, ndmi_array):
-        classified_array = np.zeros_like(ndmi_array, dtype=np.uint8)
-        classified_array[(ndmi_array <= -1) & (ndmi_array != -9999)] = 1
-        classified_array[(ndmi_array > -1) & (ndmi_array <= 0)] = 2
-        classified_array[(ndmi_array > 0) & (ndmi_array <= 0.1)] = 3
-        classified_array[(ndmi_array > 0.1) & (ndmi_array <= 0.2)] = 4
-        classified_array[(ndmi_array > 0.2) & (ndmi_array <= 0.3)] = 5
-        classified_array[(ndmi_array > 0.3) & (ndmi_array <= 0.4)] = 6
-        classified_array[(ndmi_array > 0.4) & (ndmi_array <= 0.5)] = 7
-        classified_array[(ndmi_array > 0.5) & (ndmi_array <= 1)] = 8
-        classified_array[(ndmi_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_ndmi(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 # print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array) 
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates'] 
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
+            jobs.append((bbox, date, polygon))
 
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
+        return forecast_response(request, jobs, 'ndmi', FORECAST_CLASS_BREAKS['ndmi'])
 
-        return predicted_geojson
 
 
 # Coffee Ripeness Forecast
@@ -2376,8 +906,7 @@ class CRIFView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -2393,197 +922,30 @@ class CRIFView(APIView):
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
             serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return { 
-                        input: ["B04", "B11", "SCL"],  // Included B11 for detecting vegetation under trees
-                        output: { bands: 1, sampleType: "FLOAT32" }, 
-                        mosaicking: "ORBIT" 
-                    };
-                }
-
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                    });
-                    return collections;
-                }
-
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);
-                }
-
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
-
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false; // Exclude clouds, cloud shadows, and water
-                    }
-                    return true;
-                }
-
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB04 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B04 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB04[a] = sample.B04;
-                                a++;
-                            }
-                        }
-                    }
-
-                    var cri;
-                    if (a > 0) {
-                        cri = getValue(validValuesB04);
-                    } else {
-                        cri = -9999; // No valid data
-                    }
-
-                    return [cri];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_ripeness(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"ripeness_class": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_ripeness(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_ripeness(self, ripeness_array):
-        classified_array = np.zeros_like(ripeness_array, dtype=np.uint8)
-        classified_array[(ripeness_array <= 0) & (ripeness_array != -9999)] = 1  # Low ripeness
-        classified_array[(ripeness_array > 0) & (ripeness_array <= 0.3)] = 2  # Medium ripeness
-        classified_array[(ripeness_array > 0.3)] = 3  # High ripeness
-        classified_array[(ripeness_array == -9999)] = 0  # Cloudy pixels
-        return classified_array
-
-    def predict_ripeness(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_ripeness_classes = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        ripeness_class = item.get('properties', {}).get('ripeness_class')
-                        if ripeness_class is not None:
-                            valid_ripeness_classes.append(ripeness_class)
-                        else:
-                            print("Ripeness class missing in properties.")
-                    else:
-                        a = 3  #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_ripeness_classes:
-            print("No valid coordinates or ripeness classes found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        ripeness_classes_array = np.array(valid_ripeness_classes)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, ripeness_classes_array)
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_ripeness_class = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": ripeness_class
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates']
-                }
-            }
-            for i, (idx, ripeness_class) in enumerate(zip(sampled_indices, predicted_ripeness_class))
-        ]
+                jobs.append((bbox, date, polygon))
 
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
+        return forecast_response(request, jobs, 'cri', FORECAST_CLASS_BREAKS['ripeness'])
 
-        return predicted_geojson
 
 
 # Ground Temperature Forecast
 class LSTFView(APIView):
+    """Next week's mean ground temperature of the posted fields, from each field's Prophet model.
+
+    A field falls back to the mean of its observed temperatures when it has
+    a single date, when its fit fails, when the fit is still running at
+    FIELD_FORECAST_DEADLINE (or the end of the request budget), or when
+    FIELD_FORECAST_MAX_PENDING fits are already queued. A fit past the
+    deadline is cached when it finishes, so a repeat request gets it.
+    """
+
     def post(self, request, format=None):
         geojson_features = request.data.get('features')
         if not geojson_features:
             return Response({'error': 'GeoJSON features are required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        all_temperatures = []
+        lst_jobs = []
+        request_fields = []
 
         # Process each polygon feature in the input
         for feature in geojson_features:
@@ -2599,162 +961,50 @@ class LSTFView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Define bounding box based on the polygon
+            serializer = IndicesSerializer(data={'date': date})
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            date = serializer.validated_data['date'].isoformat()
+
             bbox = polygon.bounds  # (minx, miny, maxx, maxy)
             bbox = BBox(bbox=(bbox[0], bbox[1], bbox[2], bbox[3]), crs=CRS.WGS84)
 
-            evalscript = """
-            var option = 0;
-            var minC = 0;
-            var maxC = 50;
-            var NDVIs = 0.2;
-            var NDVIv = 0.8;
-            var waterE = 0.991;
-            var soilE = 0.966;
-            var vegetationE = 0.973;
-            var C = 0.009;
-            var bCent = 0.000010854;
-            var rho = 0.01438;
-
-            if (option == 2) {
-                minC = 0;
-                maxC = 25;
-            }
-
-            let viz = ColorGradientVisualizer.createRedTemperature(minC, maxC);
-
-            function setup() {
-                return {
-                    input: [
-                        { datasource: "S3SLSTR", bands: ["S8"] },
-                        { datasource: "S3OLCI", bands: ["B06", "B08", "B11"] } // Include B11 for vegetation detection under trees
-                    ],
-                    output: [
-                        { id: "default", bands: 3, sampleType: SampleType.AUTO }
-                    ],
-                    mosaicking: "ORBIT"
-                };
-            }
-
-            // Cloud validation function
-            function validate(sample) {
-                var scl = sample.SCL;
-                // Using SCL to filter out clouds and invalid pixels
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                    return false; // Exclude cloud and cloud shadow pixels
-                }
-                return true;
-            }
-
-            // Function to calculate Land Surface Emissivity (LSE)
-            function LSEcalc(NDVI, Pv) {
-                var LSE;
-                if (NDVI < 0) {
-                    LSE = waterE;
-                } else if (NDVI < NDVIs) {
-                    LSE = soilE;
-                } else if (NDVI > NDVIv) {
-                    LSE = vegetationE;
-                } else {
-                    LSE = vegetationE * Pv + soilE * (1 - Pv) + C;
-                }
-                return LSE;
-            }
-
-            function evaluatePixel(samples) {
-                var validLSTs = [];
-                var invalidLSTs = [];
-                var N = samples.S3SLSTR.length;
-
-                for (let i = 0; i < N; i++) {
-                    var sampleSLSTR = samples.S3SLSTR[i];
-                    var sampleOLCI = samples.S3OLCI[i];
-
-                    var Bi = sampleSLSTR.S8;
-                    var B06i = sampleOLCI.B06;
-                    var B08i = sampleOLCI.B08;
-                    var B11i = sampleOLCI.B11; // Added B11 for better vegetation assessment
-
-                    if ((Bi <= 173 || Bi >= 65000) || (B06i <= 0 || B08i <= 0 || B11i <= 0)) {
-                        continue; // Skip invalid measurements
-                    }
+            lst_jobs.append((bbox, date, config))
+            request_fields.append((polygon, date))
 
-                    var isValid = validate(sampleOLCI); // Validate using the cloud mask (SCL)
-                    var S8BTi = Bi - 273.15; // Convert to Celsius
-                    var NDVIi = (B08i - B11i) / (B08i + B11i); // Adjusted NDVI calculation
-                    var PVi = Math.pow(((NDVIi - NDVIs) / (NDVIv - NDVIs)), 2);
-                    var LSEi = LSEcalc(NDVIi, PVi);
-                    var LSTi = (S8BTi / (1 + (((bCent * S8BTi) / rho) * Math.log(LSEi))));
-
-                    if (isValid) {
-                        validLSTs.push(LSTi);
-                    } else {
-                        invalidLSTs.push(LSTi);
-                    }
-                }
-
-                // Select valid LSTs if available, otherwise fall back to invalid ones
-                var LSTsToUse = validLSTs.length > 0 ? validLSTs : invalidLSTs;
-
-                var outLST;
-                if (option == 0) {
-                    outLST = LSTsToUse.reduce((a, b) => a + b, 0) / LSTsToUse.length; // Average
-                } else if (option == 1) {
-                    outLST = Math.max(...LSTsToUse); // Maximum
-                } else {
-                    var avg = LSTsToUse.reduce((a, b) => a + b, 0) / LSTsToUse.length;
-                    outLST = Math.sqrt(LSTsToUse.reduce((sum, lst) => sum + Math.pow(lst - avg, 2), 0) / (LSTsToUse.length - 1)); // Standard deviation
-                }
-
-                return viz.process(outLST);
-            }
-        """
-
-            request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(
-                        data_collection=DataCollection.SENTINEL3_SLSTR,
-                        identifier="S3SLSTR",
-                        time_interval=(date, date),
-                    ),
-                    SentinelHubRequest.input_data(
-                        data_collection=DataCollection.SENTINEL3_OLCI,
-                        identifier="S3OLCI",
-                        time_interval=(date, date),
-                    )
-                ],
-                responses=[
-                    SentinelHubRequest.output_response('default', MimeType.TIFF),
-                ],
-                bbox=bbox,
-                size=[512, 354.253],
-                config=config,
-            )
-
-            # Get the data and calculate temperature
-            response = request.get_data()
-            if response and len(response) > 0:
-                response_data = response[0]
-                minC = 0  # Set based on your evalscript
-                maxC = 50  # Set based on your evalscript
-
-                response_data_temp = minC + (response_data[..., 0] / 255.0) * (maxC - minC)
-
-                # Calculate mean of response_data_temp and round to nearest integer
-                mean_temp = np.round(np.mean(response_data_temp))
-                all_temperatures.append(mean_temp)
-
-        # Predict next week's temperature using a simple model
-        if len(all_temperatures) > 0:
-            predicted_temperature = self.simple_prediction(all_temperatures)
+        # Get the data of every date concurrently and calculate temperatures
+        budget = RequestBudget()
+        temperatures = [None] * len(lst_jobs)
+        try:
+            for i, stack in fetch_all(fetch_lst_stack, lst_jobs, budget.remaining()):
+                (polygon, _), (bbox, _, _) = request_fields[i], lst_jobs[i]
+                field_temperatures = field_lst(stack, tuple(bbox), polygon)
+                if field_temperatures is not None:
+                    temperatures[i] = field_temperatures['mean']
+        except FetchTimeout:
+            return Response({'error': FORECAST_TIMEOUT_ERROR}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+        # Each field's mean temperature series, averaging features of one date
+        fields = {}
+        for (polygon, date), temperature in zip(request_fields, temperatures):
+            if temperature is None:
+                continue
+            field = fields.setdefault(polygon.wkb, {'polygon': polygon, 'temperatures': {}})
+            field['temperatures'].setdefault(date, []).append(float(temperature))
+
+        # Predict next week's temperature of every field with its cached model
+        if fields:
+            series = []
+            for field in fields.values():
+                observations = {date: np.mean(values) for date, values in field['temperatures'].items()}
+                next_week = parse_date(max(observations)) + timedelta(days=LST_FORECAST_DAYS)
+                series.append((field_key(field['polygon'], 'lst'), observations, [next_week.isoformat()]))
+            forecasts = field_forecast_cache.forecast(series, budget.remaining(settings.FIELD_FORECAST_DEADLINE))
+            predicted_temperature = int(round(np.mean([next(iter(forecast.values())) for _, forecast in forecasts])))
             return Response({'mean_temperature': predicted_temperature}, status=status.HTTP_200_OK)
 
         return Response({'error': 'No temperature data available for predictions.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    def simple_prediction(self, temperatures):
-        # Simple prediction model: average of the collected temperatures
-        return int(np.mean(temperatures))  # Return average as the predicted temperature for next week
-
 
 # Water Stress Forecast
 class WaterStressIndexForecastView(APIView):
@@ -2763,8 +1013,7 @@ class WaterStressIndexForecastView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -2778,202 +1027,12 @@ class WaterStressIndexForecastView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            serializer = IndicesSerializer(data={'date': date})  # Adjust data as needed
+            serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return {
-                        input: ["B04", "B08", "B11", "SCL"], // Added B11 for better vegetation detection under trees
-                        output: { bands: 1, sampleType: "FLOAT32" },
-                        mosaicking: "ORBIT"
-                    };
-                }
+                jobs.append((bbox, date, polygon))
 
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000); // Filter by recent data
-                    });
-                    return collections;
-                }
+        return forecast_response(request, jobs, 'wst', FORECAST_CLASS_BREAKS['npci'])
 
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);
-                }
-
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
-
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Exclude cloud and invalid pixels, keep tree canopy (SCL = 4) for processing
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false; // Exclude clouds, cloud shadows, and water
-                    }
-                    return true;
-                }
-
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB08 = [], validValuesB04 = [], validValuesB11 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B08 > 0 && sample.B04 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB08[a] = sample.B08;
-                                validValuesB04[a] = sample.B04;
-                                validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                                a++;
-                            }
-                        }
-                    }
-
-                    var wst;
-                    if (a > 0) {
-                        // Calculate WST using valid pixel data
-                        var avgB04 = getValue(validValuesB04);
-                        var avgB08 = getValue(validValuesB08);
-                        var avgB11 = getValue(validValuesB11);
-
-                        // Modified WST calculation to include under-canopy plants using B11
-                        wst = (avgB04 - avgB08) / (avgB04 + avgB08 + avgB11);
-                    } else {
-                        wst = -9999; // No valid data
-                    }
-
-                    return [wst];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_npci(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_npci(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_npci(self, npci_array):
-        classified_array = np.zeros_like(npci_array, dtype=np.uint8)
-        classified_array[(npci_array <= 0) & (npci_array != -9999)] = 1
-        classified_array[(npci_array > 0) & (npci_array <= 0.1)] = 2
-        classified_array[(npci_array > 0.1) & (npci_array <= 0.2)] = 3
-        classified_array[(npci_array > 0.2) & (npci_array <= 0.4)] = 4
-        classified_array[(npci_array > 0.4) & (npci_array <= 0.5)] = 5
-        classified_array[(npci_array > 0.5) & (npci_array <= 0.6)] = 6
-        classified_array[(npci_array > 0.6) & (npci_array <= 0.7)] = 7
-        classified_array[(npci_array > 0.7) & (npci_array <= 1)] = 8
-        classified_array[(npci_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_npci(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array) 
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates'] 
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
-
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
-
-        return predicted_geojson
 
 
 # Crop Yield Forecast
@@ -2983,8 +1042,7 @@ class CropYieldIndexForecastView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -2998,205 +1056,12 @@ class CropYieldIndexForecastView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            serializer = IndicesSerializer(data={'date': date})  # Adjust data as needed
+            serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return { 
-                        input: ["B04", "B08", "B02", "B11", "SCL"],  // Added B11 for better vegetation detection under trees
-                        output: { bands: 1, sampleType: "FLOAT32" }, 
-                        mosaicking: "ORBIT" 
-                    };
-                }
-
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                    });
-                    return collections;
-                }
-
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);
-                }
-
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
-
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Exclude clouds and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false; // Exclude clouds, cloud shadows, and water
-                    }
-                    return true;
-                }
-
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB08 = [], validValuesB04 = [], validValuesB02 = [], validValuesB11 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B08 > 0 && sample.B04 > 0 && sample.B02 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB08[a] = sample.B08;
-                                validValuesB04[a] = sample.B04;
-                                validValuesB02[a] = sample.B02;
-                                validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                                a++;
-                            }
-                        }
-                    }
-
-                    var arvi;
-                    if (a > 0) {
-                        var NIR = getValue(validValuesB08);
-                        var RED = getValue(validValuesB04);
-                        var BLUE = getValue(validValuesB02);
-                        var avgB11 = getValue(validValuesB11);
-
-                        // Adjusting ARVI for plants under tree canopies using B11
-                        if (avgB11 > 0.3) { // Threshold to identify tree canopies
-                            arvi = (NIR - (2 * RED - BLUE)) / (NIR + (2 * RED - BLUE + avgB11));
-                        } else {
-                            arvi = (NIR - (2 * RED - BLUE)) / (NIR + (2 * RED - BLUE));
-                        }
-                    } else {
-                        arvi = -9999; // No valid data
-                    }
+                jobs.append((bbox, date, polygon))
 
-                    return [arvi];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_arvi(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_crop_yield(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_arvi(self, arvi_array):
-        classified_array = np.zeros_like(arvi_array, dtype=np.uint8)
-        classified_array[(arvi_array <= 0) & (arvi_array != -9999)] = 1
-        classified_array[(arvi_array > 0) & (arvi_array <= 0.1)] = 2
-        classified_array[(arvi_array > 0.1) & (arvi_array <= 0.2)] = 3
-        classified_array[(arvi_array > 0.2) & (arvi_array <= 0.4)] = 4
-        classified_array[(arvi_array > 0.4) & (arvi_array <= 0.5)] = 5
-        classified_array[(arvi_array > 0.5) & (arvi_array <= 0.6)] = 6
-        classified_array[(arvi_array > 0.6) & (arvi_array <= 0.7)] = 7
-        classified_array[(arvi_array > 0.7) & (arvi_array <= 1)] = 8
-        classified_array[(arvi_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_crop_yield(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array)
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
+        return forecast_response(request, jobs, 'cyi', FORECAST_CLASS_BREAKS['arvi'])
 
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates']
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
-
-        return {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
 
 
 # Disease Weed Forecast
@@ -3206,8 +1071,7 @@ class ARVIFView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -3221,215 +1085,12 @@ class ARVIFView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            serializer = IndicesSerializer(data={'date': date})  # Adjust data as needed
+            serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return {
-                        input: ["B02", "B04", "B08", "B11", "SCL"],  // Include Blue, Red, NIR, SWIR bands and Scene Classification Layer (SCL)
-                        output: {
-                            id: "default",
-                            bands: 1,
-                            sampleType: "FLOAT32"
-                        },
-                        mosaicking: "ORBIT"  // Use ORBIT-based mosaicking
-                    };
-                }
+                jobs.append((bbox, date, polygon))
 
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);  // Filter scenes from the last 3 months
-                    });
-                    return collections;
-                }
+        return forecast_response(request, jobs, 'arvi', FORECAST_CLASS_BREAKS['arvi'])
 
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);  // Use first quartile as the value
-                }
-
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
-
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Exclude cloud and other invalid pixels, keep tree canopy (SCL = 4) for processing
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false;  // Exclude clouds, cloud shadows, and water
-                    }
-                    return true;
-                }
-
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB08 = [], validValuesB04 = [], validValuesB02 = [], validValuesB11 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B08 > 0 && sample.B04 > 0 && sample.B02 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB08[a] = sample.B08;
-                                validValuesB04[a] = sample.B04;
-                                validValuesB02[a] = sample.B02;  
-                                validValuesB11[a] = sample.B11;  // Using SWIR for under-canopy plants
-                                a++;
-                            }
-                        }
-                    }
-
-                    var ARVI;
-                    if (a > 0) {
-                        var avgB08 = getValue(validValuesB08);
-                        var avgB04 = getValue(validValuesB04);
-                        var avgB02 = getValue(validValuesB02);
-                        var avgB11 = getValue(validValuesB11);
-                        
-                        // Adjust ARVI calculation to account for plants under tree canopies
-                        if (avgB11 > 0.3) { // Threshold to identify tree canopies
-                            // Adjust ARVI for under-canopy plants using SWIR
-                            ARVI = (avgB08 - (2 * avgB04 - avgB02)) / (avgB08 + (2 * avgB04 - avgB02) + avgB11);
-                        } else {
-                            // Regular ARVI calculation
-                            ARVI = (avgB08 - (2 * avgB04 - avgB02)) / (avgB08 + (2 * avgB04 - avgB02));
-                        }
-                    } else {
-                        ARVI = -9999;  // No valid data
-                    }
-
-                    return [ARVI];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[
-                        SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date)),
-                    ],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_arvi(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_arvi(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_arvi(self, arvi_array):
-        classified_array = np.zeros_like(arvi_array, dtype=np.uint8)
-        classified_array[(arvi_array <= 0) & (arvi_array != -9999)] = 1
-        classified_array[(arvi_array > 0) & (arvi_array <= 0.1)] = 2
-        classified_array[(arvi_array > 0.1) & (arvi_array <= 0.2)] = 3
-        classified_array[(arvi_array > 0.2) & (arvi_array <= 0.4)] = 4
-        classified_array[(arvi_array > 0.4) & (arvi_array <= 0.5)] = 5
-        classified_array[(arvi_array > 0.5) & (arvi_array <= 0.6)] = 6
-        classified_array[(arvi_array > 0.6) & (arvi_array <= 0.7)] = 7
-        classified_array[(arvi_array > 0.7) & (arvi_array <= 1)] = 8
-        classified_array[(arvi_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_arvi(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array)
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates']
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
-
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
-
-        return predicted_geojson
 
 
 # Chlorophyll Forecast
@@ -3439,8 +1100,7 @@ class CARIFView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-        
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -3454,214 +1114,12 @@ class CARIFView(APIView):
                 return Response({'error': 'Invalid GeoJSON polygon.'}, status=status.HTTP_400_BAD_REQUEST)
 
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
-            serializer = IndicesSerializer(data={'date': date})  # Adjust data as needed
+            serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                    return {
-                        input: ["B03", "B04", "B08", "B11", "SCL"], // Added B11 for better vegetation detection
-                        output: {
-                            id: "default",
-                            bands: 1,
-                            sampleType: "FLOAT32"
-                        },
-                        mosaicking: "ORBIT"
-                    };
-                }
-
-                function preProcessScenes(collections) {
-                    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                        var orbitDateFrom = new Date(orbit.dateFrom);
-                        return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000); // 3-month filter
-                    });
-                    return collections;
-                }
-
-                function getValue(values) {
-                    values.sort(function (a, b) { return a - b; });
-                    return getFirstQuartile(values);
-                }
-
-                function getFirstQuartile(sortedValues) {
-                    var index = Math.floor(sortedValues.length / 4);
-                    return sortedValues[index];
-                }
+                jobs.append((bbox, date, polygon))
 
-                function validate(sample) {
-                    var scl = sample.SCL;
-                    // Exclude clouds, cloud shadows, and water
-                    if (scl === 3 || scl === 9 || scl === 8 || scl === 10 || scl === 11 || scl === 1) {
-                        return false;
-                    }
-                    return true;
-                }
+        return forecast_response(request, jobs, 'cari', FORECAST_CLASS_BREAKS['cari'])
 
-                function evaluatePixel(samples, scenes) {
-                    var validValuesB08 = [], validValuesB04 = [], validValuesB03 = [], validValuesB11 = [];
-                    var a = 0;
-
-                    for (var i = 0; i < samples.length; i++) {
-                        var sample = samples[i];
-                        if (sample.B08 > 0 && sample.B04 > 0 && sample.B03 > 0 && sample.B11 > 0) {
-                            var isValid = validate(sample);
-                            if (isValid) {
-                                validValuesB08[a] = sample.B08;
-                                validValuesB04[a] = sample.B04;
-                                validValuesB03[a] = sample.B03;
-                                validValuesB11[a] = sample.B11; // Using B11 for vegetation under trees
-                                a++;
-                            }
-                        }
-                    }
-
-                    var CARI;
-                    if (a > 0) {
-                        var GREEN = getValue(validValuesB03);
-                        var RED = getValue(validValuesB04);
-                        var NIR = getValue(validValuesB08);
-                        var SWIR = getValue(validValuesB11); // Incorporating B11
-
-                        // Calculate CARI considering vegetation under trees
-                        var term1 = Math.pow((NIR - GREEN) / 150, 2);
-                        var term2 = Math.pow((RED - GREEN), 2);
-                        CARI = Math.sqrt(term1 + term2);
-
-                        // Adjust CARI calculation for conditions under tree canopies
-                        if (SWIR > 0.3) { // Threshold for identifying vegetation under canopies
-                            CARI *= 1.1; // Example adjustment factor
-                        }
-                    } else {
-                        CARI = -9999; // No valid data
-                    }
-
-                    return [CARI];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue 
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_cari(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_cari(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_cari(self, cari_array):
-        classified_array = np.zeros_like(cari_array, dtype=np.uint8)
-        classified_array[(cari_array <= 0)] = 1
-        classified_array[(cari_array > 0) & (cari_array <= 0.1)] = 2
-        classified_array[(cari_array > 0.1) & (cari_array <= 0.2)] = 3
-        classified_array[(cari_array > 0.2) & (cari_array <= 0.4)] = 4
-        classified_array[(cari_array > 0.4) & (cari_array <= 0.5)] = 5
-        classified_array[(cari_array > 0.5) & (cari_array <= 0.6)] = 6
-        classified_array[(cari_array > 0.6) & (cari_array <= 0.7)] = 7
-        classified_array[(cari_array > 0.7)] = 8
-        classified_array[(cari_array == -9999)] = 0  # Set cloudy pixels to 0
-        return classified_array
-
-    def predict_cari(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        a = 3 #print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array) 
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates'] 
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
-
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
-
-        return predicted_geojson
 
 
 # Chlorophyll Growth Forecast
@@ -3671,8 +1129,7 @@ class MCARIFView(APIView):
         if not geojson_collection:
             return Response({'error': 'GeoJSON feature collection is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-
+        jobs = []
         for feature in geojson_collection:
             geojson_polygon = feature['geometry']
             date = feature['properties'].get('date')
@@ -3688,206 +1145,14 @@ class MCARIFView(APIView):
             bbox = BBox(bbox=polygon.bounds, crs=CRS.WGS84)
             serializer = IndicesSerializer(data={'date': date})
             if serializer.is_valid():
-                evalscript = """
-                function setup() {
-                return {
-                    input: [{
-                    bands: [
-                        "B04",
-                        "B03",
-                        "B02",
-                        "SCL"
-                    ]
-                    }],
-                    output: { bands: 3, sampleType: "UINT16" },
-                    mosaicking: "ORBIT"
-                };
-                }
-
-                function preProcessScenes(collections) {
-                collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
-                    var orbitDateFrom = new Date(orbit.dateFrom)
-                    return orbitDateFrom.getTime() >= (collections.to.getTime() - 3 * 31 * 24 * 3600 * 1000);
-                })
-                return collections
-                }
-
-                function getValue(values) {
-                values.sort(function (a, b) { return a - b; });
-                return getFirstQuartile(values);
-                }
-
-                function getFirstQuartile(sortedValues) {
-                var index = Math.floor(sortedValues.length / 4);
-                return sortedValues[index];
-                }
-
-                function validate(samples) {
-                var scl = samples.SCL;
-
-                if (scl === 3 || scl === 9 || scl === 8 || scl === 7 || scl === 10 || scl === 11 || scl === 1) {
-                    return false;
-                }
-                return true;
-                }
-
-                function evaluatePixel(samples) {
-                var clo_b02 = []; var clo_b03 = []; var clo_b04 = [];
-                var a = 0;
-
-                for (var i = 0; i < samples.length; i++) {
-                    var sample = samples[i];
-
-                    if (sample.B02 > 0 && sample.B03 > 0 && sample.B04 > 0) {
-                    var isValid = validate(sample);
-
-                    if (isValid) {
-                        clo_b02[a] = sample.B02;
-                        clo_b03[a] = sample.B03;
-                        clo_b04[a] = sample.B04;
-                        a = a + 1;
-                    }
-                    }
-                }
-
-                var rValue, gValue, bValue;
-                if (a > 0) {
-                    rValue = getValue(clo_b04);
-                    gValue = getValue(clo_b03);
-                    bValue = getValue(clo_b02);
-                } else {
-                    rValue = gValue = bValue = 0; // No valid data case
-                }
-                return [rValue * 10000, gValue * 10000, bValue * 10000];
-                }
-                """
-
-                sentinel_request = SentinelHubRequest(
-                    evalscript=evalscript,
-                    input_data=[SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL2_L2A, time_interval=(date, date))],
-                    responses=[SentinelHubRequest.output_response('default', MimeType.TIFF)],
-                    bbox=bbox,
-                    size=[512, 354.253],
-                    config=config,
-                )
-
-                response = sentinel_request.get_data()[0]
-
-                if np.all(response == -9999):
-                    continue
-
-                transform = rasterio.transform.from_bounds(*bbox, response.shape[1], response.shape[0])
-
-                classified_image = self.reclassify_mcari(response)
-                shapes_gen = shapes(classified_image, mask=None, transform=transform)
-                geometries = list(shapes_gen)
-
-                features = [{"type": "Feature", "geometry": geom, "properties": {"class_no": value}} for geom, value in geometries if value != 0]
-                geojson_data = {"type": "FeatureCollection", "features": features}
-
-                geojson_polygon_df = gpd.GeoDataFrame(geometry=[polygon], crs='epsg:4326')
-                geojson_data_df = gpd.GeoDataFrame.from_features(geojson_data, crs='epsg:4326')
-                intersection_df = gpd.overlay(geojson_data_df, geojson_polygon_df)
-                intersection_geojson = intersection_df.to_json()
-
-                results.append(json.loads(intersection_geojson))
-
-        predicted_results = self.predict_mcari(results)
-        return Response(predicted_results, status=status.HTTP_200_OK)
-
-    def reclassify_mcari(self, mcari_array):
-        classified_array = np.zeros_like(mcari_array, dtype=np.uint8)
-        classified_array[(mcari_array <= 0) & (mcari_array != -9999)] = 1
-        classified_array[(mcari_array > 0) & (mcari_array <= 0.1)] = 2
-        classified_array[(mcari_array > 0.1) & (mcari_array <= 0.2)] = 3
-        classified_array[(mcari_array > 0.2) & (mcari_array <= 0.4)] = 4
-        classified_array[(mcari_array > 0.4) & (mcari_array <= 0.5)] = 5
-        classified_array[(mcari_array > 0.5) & (mcari_array <= 0.6)] = 6
-        classified_array[(mcari_array > 0.6) & (mcari_array <= 0.7)] = 7
-        classified_array[(mcari_array > 0.7) & (mcari_array <= 1)] = 8
-        classified_array[(mcari_array == -9999)] = 0  # Cloudy pixels set to 0
-        return classified_array
-
-    def predict_mcari(self, results):
-        predicted_features = []
-        valid_coordinates = []
-        valid_class_numbers = []
-        valid_results = []
-
-        if not results or not isinstance(results, list):
-            print("No results provided or results are not in the expected format.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features 
-            }
-
-        for feature in results:
-            if 'features' not in feature:
-                print("Feature missing 'features' key:", feature)
-                continue
-
-            for item in feature['features']:
-                geometry = item.get('geometry', {})
-                coords = geometry.get('coordinates', [])
-
-                if isinstance(coords, list) and coords and isinstance(coords[0], list):
-                    if len(coords[0]) > 0 and len(coords[0][0]) == 2:
-                        valid_coord = coords[0][0]
-                        valid_coordinates.append(valid_coord)
-                        valid_results.append(item)
-
-                        class_no = item.get('properties', {}).get('class_no')
-                        if class_no is not None:
-                            valid_class_numbers.append(class_no)
-                        else:
-                            print("Class number missing in properties.")
-                    else:
-                        print(f"Invalid coordinate structure found: {coords}")
-                else:
-                    print(f"Invalid coordinate found: {coords}")
-
-        if not valid_coordinates or not valid_class_numbers:
-            print("No valid coordinates or class numbers found.")
-            return {
-                "type": "FeatureCollection",
-                "features": predicted_features
-            }
-
-        coordinates_array = np.array(valid_coordinates)
-        class_numbers_array = np.array(valid_class_numbers)
-
-        model = LinearRegression()
-        model.fit(coordinates_array, class_numbers_array)
-
-        max_sample_size = min(1000, len(coordinates_array))
-        sampled_indices = random.sample(range(len(coordinates_array)), max_sample_size)
-
-        sampled_coordinates = coordinates_array[sampled_indices]
-        predicted_class_no = model.predict(sampled_coordinates).astype(int)
-
-        predicted_features = [
-            {
-                "id": str(i),
-                "type": "Feature",
-                "properties": {
-                    "class_no": class_no
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": valid_results[idx]['geometry']['coordinates']
-                }
-            }
-            for i, (idx, class_no) in enumerate(zip(sampled_indices, predicted_class_no))
-        ]
-
-        predicted_geojson = {
-            "type": "FeatureCollection",
-            "features": predicted_features
-        }
-
-        return predicted_geojson
-
+                jobs.append((bbox, date, polygon))
 
+        return forecast_response(request, jobs, 'mcari', FORECAST_CLASS_BREAKS['mcari'])
 
 
+class CacheStatsView(APIView):
+    """Counters of this worker's caches, for debugging; routed only with DEBUG."""
 
+    def get(self, request):
+        return Response({'pid': os.getpid(), 'raster_cache': raster_cache.stats(), 'hot_tier': hot_tier.stats(),
+                         'field_forecast_cache': field_forecast_cache.stats()})
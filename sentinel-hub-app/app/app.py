@@ -1,26 +1,50 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 # from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from dotenv import load_dotenv
 import datetime
+import atexit
 import requests
 import json
 import jwt
 import os
 
-# from firebase_api_usage_func import use_api_key
-from sentinel_hub_func import get_all_crop_and_pest_info
-
-
+# The modules below read their settings from the environment when imported
 load_dotenv(dotenv_path='./config/.env')
 
+# from firebase_api_usage_func import use_api_key
+from sentinel_hub_func import get_all_crop_and_pest_info, get_locations_info
+from raster_cache import raster_cache
+from usage import UsageCounter
+from token_cache import TokenCache
+from user_cache import UserCache
+
 cred = credentials.Certificate('./config/firebase-adminsdk-secret-key.json')
 firebase_admin.initialize_app(cred)
 db = firestore.client()
 
+# API usage is counted in memory and flushed to Firestore in the background
+usage_counter = UsageCounter(db, interval=float(os.getenv('USAGE_FLUSH_INTERVAL', 10)),
+                             threshold=int(os.getenv('USAGE_FLUSH_THRESHOLD', 100)))
+atexit.register(usage_counter.close)
+
+# Claims of recently verified tokens, so polling clients skip the HS256 check
+token_cache = TokenCache(ttl=int(os.getenv('TOKEN_CACHE_TTL', 300)))
+
+# Login documents by user id, so sign-in is usually a dict lookup
+user_cache = UserCache(db, ttl=int(os.getenv('USER_CACHE_TTL', 600)),
+                       max_entries=int(os.getenv('USER_CACHE_MAX_ENTRIES', 4096)))
+if os.getenv('USER_CACHE_WARM', '').lower() in ('1', 'true', 'yes'):
+    try:
+        print(f"Loaded {user_cache.warm()} users into the sign-in cache")
+    except Exception as e:
+        print(f"Error warming the sign-in cache: {str(e)}")
+    # Warmed users are loaded again before they expire
+    user_cache.keep_warm()
+    atexit.register(user_cache.close)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
@@ -43,7 +67,22 @@ def create_token(user_id):
     return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
 
 
+def server_timing(timings):
+    '''Format stage durations in seconds as a Server-Timing header value.'''
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
+
+
+def verify_token(token):
+    '''Return the claims of a valid token, verifying it only on a cache miss.'''
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+        token_cache.put(token, claims)
+    return claims
+
+
 def token_required(f):
+    '''Reject requests without a valid token; the claims go to g.claims.'''
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
@@ -51,7 +90,7 @@ def token_required(f):
             return jsonify({'error': 'Token is missing', 'status': status_code_messages[401]}), 401
         try:
             token = token.split(' ')[1]
-            jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            g.claims = verify_token(token)
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired', 'status': status_code_messages[401]}), 401
         except jwt.InvalidTokenError:
@@ -78,9 +117,7 @@ def signup():
         password = data['password']
 
         # Check if user already exists
-        users_ref = db.collection('logins').where(
-            filter=FieldFilter('id', '==', userId)).get()
-        if users_ref:
+        if user_cache.get(userId):
             return jsonify({'error': 'User already exists', 'status': status_code_messages[400]}), 400
 
         # Hash the password for security
@@ -91,6 +128,7 @@ def signup():
             'id': userId,
             'password': password
         })
+        user_cache.invalidate(userId)
         token = create_token(user_ref[1].id)
 
         return jsonify({'message': 'Account created successfully.', 'token': token, 'status': status_code_messages[200]}), 200
@@ -105,54 +143,40 @@ def signin():
         userId = data['id']
         password = data['password']
 
-        # Retrieve user from Firestore
-        users_ref = db.collection('logins').where(
-            filter=FieldFilter('id', '==', userId)).stream()
-        user_doc = next(users_ref, None)
+        # Retrieve user from the cache, or Firestore on a miss
+        user = user_cache.get(userId)
 
-        if not user_doc:
+        if not user:
             return jsonify({'error': 'User not found', 'status': status_code_messages[401]}), 401
 
-        user_data = user_doc.to_dict()
+        # A cached password may be outdated, so read the user again before
+        # rejecting it
+        if user[1]['password'] != password:
+            user_cache.invalidate(userId)
+            user = user_cache.get(userId)
+            if not user:
+                return jsonify({'error': 'User not found', 'status': status_code_messages[401]}), 401
+
+        user_doc_id, user_data = user
 
         # Verify the password
         # if not check_password_hash(user_data['password'], password):
         if user_data['password'] != password:
             return jsonify({'error': 'Incorrect password', 'status': status_code_messages[401]}), 401
 
-        token = create_token(user_doc.id)
+        token = create_token(user_doc_id)
 
         return jsonify({'token': token, 'status': status_code_messages[200]}), 200
     except Exception as e:
         return jsonify({'error': str(e), 'status': status_code_messages[400]}), 400
 
 
-def increment_api_usage(user_id):
-    try:
-        user_ref = db.collection('logins').document(user_id)
-        user_snapshot = user_ref.get()
-        if user_snapshot.exists:
-            current_count = user_snapshot.to_dict().get('calculate_usage', 0)
-        else:
-            current_count = 0
-        update_data = {
-            'calculate_usage': current_count + 1,
-            'last_used': datetime.datetime.utcnow()
-        }
-        user_ref.update(update_data)
-    except Exception as e:
-        print(f"Error incrementing API usage for {user_id}: {str(e)}")
-
-
 @app.route('/api/calculate', methods=['GET'])
 @token_required
 def calculate():
     try:
         # Extract the user ID from the token
-        token = request.headers.get('Authorization').split(' ')[1]
-        decoded_token = jwt.decode(
-            token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = decoded_token['sub']
+        user_id = g.claims['sub']
 
         # Retrieve parameters from the request
         latitude = float(request.args.get('latitude'))
@@ -160,16 +184,18 @@ def calculate():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
 
+        timings = {}
         result = get_all_crop_and_pest_info(
-            latitude, longitude, start_date, end_date)
+            latitude, longitude, start_date, end_date, timings=timings)
+        headers = {'Server-Timing': server_timing(timings)}
 
         # Increment the usage count for this user
-        increment_api_usage(user_id)
+        usage_counter.add(user_id)
 
         if 'error' in result and result['error']:
-            return jsonify({'error': result['error'], 'status': status_code_messages[result['status']]}), result['status']
+            return jsonify({'error': result['error'], 'status': status_code_messages[result['status']]}), result['status'], headers
 
-        return jsonify({'result': [result], 'status': status_code_messages[200]}), 200
+        return jsonify({'result': [result], 'status': status_code_messages[200]}), 200, headers
 
     except ValueError as ve:
         return jsonify({'error': f'Invalid value: {str(ve)}', 'status': status_code_messages[400]}), 400
@@ -182,10 +208,7 @@ def calculate():
 def calculate_multiple():
     try:
         # Extract the user ID from the token
-        token = request.headers.get('Authorization').split(' ')[1]
-        decoded_token = jwt.decode(
-            token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = decoded_token['sub']
+        user_id = g.claims['sub']
 
         # Retrieve parameters from the request
         locations_param = request.args.get('locations')
@@ -202,36 +225,38 @@ def calculate_multiple():
         if not isinstance(locations, list):
             return jsonify({'error': 'Locations should be a list of objects', 'status': status_code_messages[400]}), 400
 
-        results = []
-
-        for location in locations:
+        # Parse every location first, so the valid ones can be fetched together
+        results = [None] * len(locations)
+        parsed = {}
+        for position, location in enumerate(locations):
             try:
                 latitude = float(location.get('latitude'))
                 longitude = float(location.get('longitude'))
                 start_date = location.get('start_date')
                 end_date = location.get('end_date')
-
-                result = get_all_crop_and_pest_info(
-                    latitude, longitude, start_date, end_date)
-
-                # Increment the usage count for this user
-                increment_api_usage(user_id)
-
-                if 'error' in result and result['error']:
-                    results.append(
-                        {'location': location, 'error': result['error'], 'status': status_code_messages[result['status']]})
-                else:
-                    results.append(
-                        {'location': location, 'result': result, 'status': status_code_messages[200]})
+                if not isinstance(start_date, str) or not isinstance(end_date, str):
+                    raise ValueError('start_date and end_date are required')
+                parsed[position] = (latitude, longitude, start_date, end_date)
 
             except ValueError as ve:
-                results.append(
-                    {'location': location, 'error': f'Invalid value: {str(ve)}', 'status': status_code_messages[400]})
+                results[position] = {'location': location, 'error': f'Invalid value: {str(ve)}', 'status': status_code_messages[400]}
             except Exception as e:
-                results.append(
-                    {'location': location, 'error': f'An error occurred: {str(e)}', 'status': status_code_messages[500]})
+                results[position] = {'location': location, 'error': f'An error occurred: {str(e)}', 'status': status_code_messages[500]}
+
+        timings = {}
+        location_results = get_locations_info(list(parsed.values()), timings=timings)
+        for position, result in zip(parsed, location_results):
+            location = locations[position]
+            if 'error' in result and result['error']:
+                results[position] = {'location': location, 'error': result['error'], 'status': status_code_messages[result['status']]}
+            else:
+                results[position] = {'location': location, 'result': result, 'status': status_code_messages[200]}
 
-        return jsonify({'results': results}), 200
+        # Charge every processed location at once
+        if parsed:
+            usage_counter.add(user_id, len(parsed))
+
+        return jsonify({'results': results}), 200, {'Server-Timing': server_timing(timings)}
 
     except Exception as e:
         return jsonify({'error': f'An error occurred: {str(e)}', 'status': status_code_messages[500]}), 500
@@ -257,5 +282,14 @@ def get_coffee_farmers():
         return jsonify({"error": str(e)}), 500
 
 
+# Counters of this worker's caches, for debugging; off unless enabled
+if os.getenv('STATS_ENDPOINT', '').lower() in ('1', 'true', 'yes'):
+    @app.route('/api/stats', methods=['GET'])
+    @token_required
+    def stats():
+        return jsonify({'pid': os.getpid(), 'raster_cache': raster_cache.stats(), 'usage': usage_counter.stats(),
+                        'token_cache': token_cache.stats(), 'user_cache': user_cache.stats()}), 200
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+class RasterCache:
+    """On-disk cache of decoded SentinelHubRequest responses.
+
+    Entries are keyed by a hash of the request payload (evalscript, data
+    collection, time interval, bbox and output size), evicted least recently
+    used first once the directory grows past ``max_bytes``. Requests that
+    reach today use ``volatile_ttl`` because new acquisitions may still be
+    ingested; past dates use ``immutable_ttl`` (``None`` never expires).
+    """
+
+    def __init__(self, directory, max_bytes, volatile_ttl, immutable_ttl=None):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.volatile_ttl = volatile_ttl
+        self.immutable_ttl = immutable_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def request_key(sentinel_request):
+        payload = json.dumps(sentinel_request.payload, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, sentinel_request):
+        today = datetime.now(timezone.utc).date()
+        for data in sentinel_request.payload['input']['data']:
+            try:
+                time_to = datetime.fromisoformat(data['dataFilter']['timeRange']['to'].replace('Z', '+00:00'))
+            except (KeyError, TypeError, AttributeError, ValueError):
+                # A range without a parseable end is not known to be past
+                return self.volatile_ttl
+            if time_to.tzinfo is not None:
+                time_to = time_to.astimezone(timezone.utc)
+            if time_to.date() >= today:
+                return self.volatile_ttl
+        return self.immutable_ttl
+
+    def get_data(self, sentinel_request):
+        """Drop-in replacement for ``sentinel_request.get_data()``."""
+        key = self.request_key(sentinel_request)
+        data = self.load(key)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            return data
+
+        with self._lock:
+            self.misses += 1
+        data = sentinel_request.get_data()
+        self.store(key, data, self.ttl_for(sentinel_request))
+        return data
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as archive:
+                if archive['__expires__'] < time.time():
+                    os.remove(path)
+                    return None
+                data = self._unpack(archive)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self, key, data, ttl):
+        arrays = self._pack(data)
+        if arrays is None:
+            return
+        arrays['__expires__'] = np.array(np.inf if ttl is None else time.time() + ttl)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.savez(tmp_file, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npz'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    @staticmethod
+    def _pack(data):
+        # get_data() returns one array per response, or one dict of arrays
+        # per request when several responses are packed into a tar
+        arrays = {}
+        for i, item in enumerate(data):
+            if isinstance(item, np.ndarray):
+                arrays[f'r{i}'] = item
+            elif isinstance(item, dict) and all(isinstance(v, np.ndarray) for v in item.values()):
+                for name, value in item.items():
+                    arrays[f'r{i}:{name}'] = value
+            else:
+                return None
+        return arrays
+
+    @staticmethod
+    def _unpack(archive):
+        data = {}
+        for name in archive.files:
+            if name == '__expires__':
+                continue
+            index, _, response = name[1:].partition(':')
+            if response:
+                data.setdefault(int(index), {})[response] = archive[name]
+            else:
+                data[int(index)] = archive[name]
+        return [data[i] for i in sorted(data)]
+
+
+raster_cache = RasterCache(
+    directory=os.getenv('RASTER_CACHE_DIR', './cache/rasters'),
+    max_bytes=int(os.getenv('RASTER_CACHE_MAX_BYTES', 1024 ** 3)),
+    volatile_ttl=int(os.getenv('RASTER_CACHE_VOLATILE_TTL', 15 * 60)),
+    immutable_ttl=None,
+)
@@ -1,23 +1,41 @@
 from sentinelhub import SHConfig, BBox, CRS, SentinelHubRequest, DataCollection, MimeType, bbox_to_dimensions
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import namedtuple
 import numpy as np
+import time
 import os
 
+from raster_cache import raster_cache
+
 
 # Configure Sentinel Hub instance
 config = SHConfig()
 config.sh_client_id = os.getenv('SH_CLIENT_ID')
 config.sh_client_secret = os.getenv('SH_CLIENT_SECRET')
+config.download_timeout_seconds = float(os.getenv('SH_DOWNLOAD_TIMEOUT', 30))
+config.max_download_attempts = int(os.getenv('SH_MAX_DOWNLOAD_ATTEMPTS', 2))
 
+# Independent downloads of a request run concurrently on this pool. They all
+# use the config above, so sentinelhub hands them one cached OAuth session.
+fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SENTINEL_FETCH_WORKERS', 8)), thread_name_prefix='sentinel-fetch')
 
-# Function to calculate indices from Sentinel-2
-def calculate_optical_indices(latitude, longitude, start_date, end_date):  
-    resolution = 10  
-    buffer_distance = np.sqrt(20917) / 111320  # Approx. conversion for meter to degree  
-    bbox = BBox((longitude - buffer_distance, latitude - buffer_distance,  
-                 longitude + buffer_distance, latitude + buffer_distance), CRS.WGS84)  
-    time_interval = (start_date, end_date)  
-
-    evalscript = '''  
+# Seconds get_all_crop_and_pest_info waits before giving up on slow stages
+FETCH_DEADLINE = float(os.getenv('SENTINEL_FETCH_DEADLINE', 60))
+# The same for a whole get_locations_info batch
+BATCH_FETCH_DEADLINE = float(os.getenv('SENTINEL_BATCH_DEADLINE', 300))
+
+
+# Sentinel-2 window around a location and its resolution in meters
+OPTICAL_BUFFER = np.sqrt(20917) / 111320  # Approx. conversion for meter to degree
+OPTICAL_RESOLUTION = 10
+
+# The optical indices travel as INT16 codes of value / OPTICAL_SCALE, half
+# the bytes of FLOAT32 and exact to 1e-4 over [-1, 1]. OPTICAL_NODATA marks
+# invalid pixels and decodes to NaN.
+OPTICAL_SCALE = 1e-4
+OPTICAL_NODATA = -32768
+
+OPTICAL_EVALSCRIPT = '''  
     //VERSION=3  
     
     function setup() {  
@@ -27,7 +45,7 @@ def calculate_optical_indices(latitude, longitude, start_date, end_date):
             }],  
             output: {  
                 bands: 3,  
-                sampleType: "FLOAT32"  
+                sampleType: "INT16"  
             }  
         };  
     }  
@@ -41,8 +59,14 @@ def calculate_optical_indices(latitude, longitude, start_date, end_date):
         return true;  
     }  
 
+    // INT16 code of an index value, -32768 being reserved for invalid pixels  
+    function encode(value) {  
+        if (!isFinite(value)) return -32768;  
+        return Math.min(32767, Math.max(-32767, Math.round(value * 10000)));  
+    }  
+
     function evaluatePixel(sample) {  
-        if (!validate(sample)) return [NaN, NaN, NaN];  
+        if (!validate(sample)) return [-32768, -32768, -32768];  
 
         // Extract band values  
         var B04 = sample.B04;  
@@ -68,12 +92,19 @@ def calculate_optical_indices(latitude, longitude, start_date, end_date):
             ndmi = (B08 - B11) / (B08 + B11);  
         }  
 
-        return [ndvi, ndwi, ndmi];  
+        return [encode(ndvi), encode(ndwi), encode(ndmi)];  
     }  
     '''  
 
-    request = SentinelHubRequest(
-        evalscript=evalscript,
+
+def optical_bbox(latitude, longitude):
+    return BBox((longitude - OPTICAL_BUFFER, latitude - OPTICAL_BUFFER,
+                 longitude + OPTICAL_BUFFER, latitude + OPTICAL_BUFFER), CRS.WGS84)
+
+
+def optical_request(bbox, time_interval):
+    return SentinelHubRequest(
+        evalscript=OPTICAL_EVALSCRIPT,
         input_data=[
             SentinelHubRequest.input_data(
                 data_collection=DataCollection.SENTINEL2_L2A,
@@ -84,15 +115,21 @@ def calculate_optical_indices(latitude, longitude, start_date, end_date):
             SentinelHubRequest.output_response('default', MimeType.TIFF)
         ],
         bbox=bbox,
-        size=bbox_to_dimensions(bbox, resolution=resolution),
+        size=bbox_to_dimensions(bbox, resolution=OPTICAL_RESOLUTION),
         config=config
     )
 
-    response = request.get_data()
-    if not response:
-        return None
 
-    indices = response[0]
+def decode_optical(codes):
+    """Float32 index values of INT16 codes, NaN where a pixel was invalid."""
+    values = np.multiply(codes, OPTICAL_SCALE, dtype=np.float32)
+    values[codes == OPTICAL_NODATA] = np.nan
+    return values
+
+
+def summarize_optical(indices):
+    # Decoded here, after any windowing, so only the pixels summarized are
+    indices = decode_optical(indices)
 
     # Use numpy for quick statistics
     ndvi = indices[..., 0]
@@ -119,14 +156,19 @@ def calculate_optical_indices(latitude, longitude, start_date, end_date):
     }
 
 
-# Function to retrieve LST from Sentinel-3
-def retrieve_lst_from_sentinel3(latitude, longitude, start_date, end_date):
-    bbox = BBox(bbox=(longitude-0.1, latitude-0.1,
-                longitude+0.1, latitude+0.1), crs=CRS.WGS84)
-    resolution = 500  # Resolution in meters
-    time_interval = (start_date, end_date)
+# Function to calculate indices from Sentinel-2
+def calculate_optical_indices(latitude, longitude, start_date, end_date):
+    response = raster_cache.get_data(optical_request(optical_bbox(latitude, longitude), (start_date, end_date)))
+    if not response:
+        return None
+    return summarize_optical(response[0])
+
 
-    evalscript = '''
+# Sentinel-3 window around a location and its resolution in meters
+LST_BUFFER = 0.1
+LST_RESOLUTION = 500
+
+LST_EVALSCRIPT = '''
     //VERSION=3  
     function setup() {  
         return {  
@@ -145,8 +187,15 @@ def retrieve_lst_from_sentinel3(latitude, longitude, start_date, end_date):
     }  
     '''
 
-    request = SentinelHubRequest(
-        evalscript=evalscript,
+
+def lst_bbox(latitude, longitude):
+    return BBox(bbox=(longitude-LST_BUFFER, latitude-LST_BUFFER,
+                longitude+LST_BUFFER, latitude+LST_BUFFER), crs=CRS.WGS84)
+
+
+def lst_request(bbox, time_interval):
+    return SentinelHubRequest(
+        evalscript=LST_EVALSCRIPT,
         input_data=[
             SentinelHubRequest.input_data(
                 data_collection=DataCollection.SENTINEL3_SLSTR,
@@ -157,14 +206,12 @@ def retrieve_lst_from_sentinel3(latitude, longitude, start_date, end_date):
             SentinelHubRequest.output_response('default', MimeType.TIFF)
         ],
         bbox=bbox,
-        size=bbox_to_dimensions(bbox, resolution),
+        size=bbox_to_dimensions(bbox, LST_RESOLUTION),
         config=config
     )
 
-    results = request.get_data()
-
-    thermal_data = results[0]
 
+def summarize_lst(thermal_data):
     s8_band = thermal_data[..., 0]
     s9_band = thermal_data[..., 1]
 
@@ -182,132 +229,88 @@ def retrieve_lst_from_sentinel3(latitude, longitude, start_date, end_date):
     }
 
 
-# Function to retrieve O3, NO2 and SO2 from Sentinel-5P
-def retrieve_atmospheric_data(latitude, longitude, start_date, end_date):
-    resolution = 512
-    bbox = BBox((longitude-0.01, latitude-0.01,
-                longitude+0.01, latitude+0.01), CRS.WGS84)
-    time_interval = (start_date, end_date)
-
-    evalscripts = {
-        'NO2': '''  
-        //VERSION=3
-        const band = 'NO2';
-        var minVal = 0.0;
-        var maxVal = 0.0001;
-        
-        function setup() {
-          return {
-            input: [band, 'dataMask'],
-            output: {
-              bands: 4,
-            },
-          };
-        }
-        
-        var viz = ColorRampVisualizer.createBlueRed(minVal, maxVal);
-        
-        function evaluatePixel(samples) {
-          let ret = viz.process(samples[band]);
-          ret.push(samples.dataMask);
-          return ret;
-        }
-        ''',
-        'O3': '''  
-        //VERSION=3
-        const band = 'O3';
-        var minVal = 0.0;
-        var maxVal = 0.36;
-        
-        function setup() {
-          return {
-            input: [band, 'dataMask'],
-            output: {
-              bands: 4,
-            },
-          };
-        }
-        
-        var viz = ColorRampVisualizer.createBlueRed(minVal, maxVal);
-        
-        function evaluatePixel(samples) {
-          let ret = viz.process(samples[band]);
-          ret.push(samples.dataMask);
-          return ret;
-        }
-        ''',
-        'SO2': '''  
-        //VERSION=3
-        const band = 'SO2';
-        var minVal = 0.0;
-        var maxVal = 0.01;
-        
-        function setup() {
-          return {
-            input: [band, 'dataMask'],
-            output: {
-              bands: 4,
-            },
-          };
-        }
-        
-        var viz = ColorRampVisualizer.createBlueRed(minVal, maxVal);
-        
-        function evaluatePixel(samples) {
-          let ret = viz.process(samples[band]);
-          ret.push(samples.dataMask);
-          return ret;
-        }
-        '''
+# Function to retrieve LST from Sentinel-3
+def retrieve_lst_from_sentinel3(latitude, longitude, start_date, end_date):
+    results = raster_cache.get_data(lst_request(lst_bbox(latitude, longitude), (start_date, end_date)))
+    return summarize_lst(results[0])
+
+
+# Sentinel-5P window around a location and its resolution in meters
+POLLUTANT_BUFFER = 0.01
+POLLUTANT_RESOLUTION = 512
+
+POLLUTANTS = ('NO2', 'O3', 'SO2')
+
+# The three Sentinel-5P products fused into one request: raw FLOAT32
+# concentrations of NO2, O3 and SO2, NaN where a product has no data
+ATMOSPHERIC_EVALSCRIPT = '''
+    //VERSION=3
+    function setup() {
+      return {
+        input: [
+          { datasource: 'no2', bands: ['NO2', 'dataMask'] },
+          { datasource: 'o3', bands: ['O3', 'dataMask'] },
+          { datasource: 'so2', bands: ['SO2', 'dataMask'] }
+        ],
+        output: { bands: 3, sampleType: 'FLOAT32' }
+      };
     }
 
-    max_values = {
-        'NO2': 0.0001,
-        'O3': 0.36,
-        'SO2': 0.01
+    function concentration(samples, band) {
+      if (samples.length === 0 || samples[0].dataMask === 0) {
+        return NaN;
+      }
+      return samples[0][band];
     }
 
-    atmospheric_data = {}
-
-    for pollutant, evalscript in evalscripts.items():
-        request = SentinelHubRequest(
-            data_folder='.',
-            evalscript=evalscript,
-            input_data=[
-                SentinelHubRequest.input_data(
-                    data_collection=DataCollection.SENTINEL5P,
-                    time_interval=time_interval,
-                )
-            ],
-            responses=[
-                SentinelHubRequest.output_response('default', MimeType.TIFF)
-            ],
-            bbox=bbox,
-            size=bbox_to_dimensions(bbox, resolution=resolution),
-            config=config
-        )
-
-        response = request.get_data()
-
-        if response:
-            # Extract concentration based on the maximum scaling value
-            data = np.array(response[0])
-            concentration = (data[..., 0] / 255.0) * max_values[pollutant]
-            # Example: Mean of concentration
-            atmospheric_data[pollutant] = concentration.mean()
-        else:
-            atmospheric_data[pollutant] = None
-
-    return {
-        'Atmospheric': {
-            'NO2': atmospheric_data['NO2'],
-            'O3': atmospheric_data['O3'],
-            'SO2': atmospheric_data['SO2']
-        }
+    function evaluatePixel(samples) {
+      return [concentration(samples.no2, 'NO2'), concentration(samples.o3, 'O3'), concentration(samples.so2, 'SO2')];
     }
+    '''
+
+
+def pollutant_bbox(latitude, longitude):
+    return BBox((longitude-POLLUTANT_BUFFER, latitude-POLLUTANT_BUFFER,
+                longitude+POLLUTANT_BUFFER, latitude+POLLUTANT_BUFFER), CRS.WGS84)
+
+
+def atmospheric_request(bbox, time_interval):
+    return SentinelHubRequest(
+        evalscript=ATMOSPHERIC_EVALSCRIPT,
+        input_data=[
+            SentinelHubRequest.input_data(
+                data_collection=DataCollection.SENTINEL5P,
+                identifier=pollutant.lower(),
+                time_interval=time_interval,
+            )
+            for pollutant in POLLUTANTS
+        ],
+        responses=[
+            SentinelHubRequest.output_response('default', MimeType.TIFF)
+        ],
+        bbox=bbox,
+        size=bbox_to_dimensions(bbox, resolution=POLLUTANT_RESOLUTION),
+        config=config
+    )
+
+
+def summarize_atmospheric(data):
+    # Mean concentration of every pollutant over the pixels with data
+    data = np.asarray(data, dtype=np.float64).reshape(*np.shape(data)[:2], len(POLLUTANTS))
+    summary = {}
+    for i, pollutant in enumerate(POLLUTANTS):
+        values = data[..., i][np.isfinite(data[..., i])]
+        summary[pollutant] = float(values.mean()) if values.size else None
+    return summary
+
+
+# Function to retrieve O3, NO2 and SO2 from Sentinel-5P, in one request
+def retrieve_atmospheric_data(latitude, longitude, start_date, end_date):
+    response = raster_cache.get_data(atmospheric_request(pollutant_bbox(latitude, longitude), (start_date, end_date)))
+    summary = summarize_atmospheric(response[0]) if response else {}
+    return {'Atmospheric': {pollutant: summary.get(pollutant) for pollutant in POLLUTANTS}}
 
 
-# Function to calculate additional agronomic indicators
 def calculate_additional_info(optical_indices, lst_data, atmospheric_data):
     # Variables for the additional indicators
     pest_risk = 'Low'
@@ -374,20 +377,155 @@ def calculate_additional_info(optical_indices, lst_data, atmospheric_data):
         }
     }
 
+# How to fetch and summarize each stage: a location's bbox, the request for
+# a bbox and time interval, and the statistics of the pixels of one bbox
+Sensor = namedtuple('Sensor', ['bbox', 'resolution', 'request', 'summarize'])
+
+SENSORS = {
+    'optical': Sensor(optical_bbox, OPTICAL_RESOLUTION, optical_request, summarize_optical),
+    'lst': Sensor(lst_bbox, LST_RESOLUTION, lst_request, summarize_lst),
+    'atmospheric': Sensor(pollutant_bbox, POLLUTANT_RESOLUTION, atmospheric_request, summarize_atmospheric),
+}
+
+# Nearby locations share one download as long as its bbox covers at most this
+# much more ground than their own bboxes add up to (processing units are
+# charged by area), and stays within Sentinel Hub's size limit in pixels
+GROUP_AREA_RATIO = 1.5
+MAX_REQUEST_PIXELS = 2500
+
+
+def bounds_area(bounds):
+    return (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+
+
+def group_locations(locations, sensor):
+    """Split locations into groups fetched with one request of ``sensor``.
+
+    ``locations`` are (latitude, longitude, start_date, end_date) tuples.
+    Returns (bbox, time_interval, members) tuples, where members are
+    (location, bbox) pairs of the group.
+    """
+    groups = []
+    # Sorted, so locations are merged into the groups of their neighbours
+    for location in sorted(locations):
+        latitude, longitude, start_date, end_date = location
+        bbox = sensor.bbox(latitude, longitude)
+        bounds = tuple(bbox)
+        for group in groups:
+            if group['time_interval'] != (start_date, end_date):
+                continue
+            union = (min(group['bounds'][0], bounds[0]), min(group['bounds'][1], bounds[1]),
+                     max(group['bounds'][2], bounds[2]), max(group['bounds'][3], bounds[3]))
+            if bounds_area(union) > GROUP_AREA_RATIO * (group['area'] + bounds_area(bounds)):
+                continue
+            if max(bbox_to_dimensions(BBox(union, CRS.WGS84), sensor.resolution)) > MAX_REQUEST_PIXELS:
+                continue
+            group['bounds'] = union
+            group['area'] += bounds_area(bounds)
+            group['members'].append((location, bbox))
+            break
+        else:
+            groups.append({'bounds': bounds, 'area': bounds_area(bounds), 'time_interval': (start_date, end_date),
+                           'members': [(location, bbox)]})
+    return [(BBox(group['bounds'], CRS.WGS84), group['time_interval'], group['members']) for group in groups]
+
+
+def window(raster, bbox, member_bbox):
+    """The pixels of ``raster``, which covers ``bbox``, that fall inside ``member_bbox``."""
+    height, width = raster.shape[:2]
+    col_scale = width / (bbox.max_x - bbox.min_x)
+    row_scale = height / (bbox.max_y - bbox.min_y)
+    left = int(round((member_bbox.min_x - bbox.min_x) * col_scale))
+    right = max(left + 1, int(round((member_bbox.max_x - bbox.min_x) * col_scale)))
+    top = int(round((bbox.max_y - member_bbox.max_y) * row_scale))
+    bottom = max(top + 1, int(round((bbox.max_y - member_bbox.min_y) * row_scale)))
+    return raster[top:bottom, left:right]
+
+
+def fetch_group(sensor, bbox, time_interval, member_bboxes):
+    """Download one group's bbox and summarize the pixels of every member."""
+    response = raster_cache.get_data(sensor.request(bbox, time_interval))
+    if not response:
+        return [None] * len(member_bboxes)
+    raster = np.asarray(response[0])
+    return [sensor.summarize(window(raster, bbox, member_bbox)) for member_bbox in member_bboxes]
 
-# Function to get all info from sentinel hub
-def get_all_crop_and_pest_info(latitude, longitude, start_date, end_date):
-    optical_indices = calculate_optical_indices(
-        latitude, longitude, start_date, end_date)
-    lst_data = retrieve_lst_from_sentinel3(
-        latitude, longitude, start_date, end_date)
-    atmospheric_data = retrieve_atmospheric_data(
-        latitude, longitude, start_date, end_date)
-
-    if any(x is None for x in [optical_indices, lst_data, atmospheric_data]):
+
+def timed(func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
+
+def combine_stages(data):
+    """Build one location's result from its stage summaries (None where missing)."""
+    optical_indices = data['optical']
+    lst_data = data['lst']
+    atmospheric_data = {'Atmospheric': {pollutant: (data['atmospheric'] or {}).get(pollutant) for pollutant in POLLUTANTS}}
+
+    unavailable = [name for name, value in (('Optical', optical_indices), ('LST', lst_data), *atmospheric_data['Atmospheric'].items()) if value is None]
+    if len(unavailable) == 2 + len(POLLUTANTS):
         return {'error': 'No data available for the specified parameters', 'status': 404}
 
-    additional_info = calculate_additional_info(
-        optical_indices, lst_data, atmospheric_data)
+    result = {**(optical_indices or {}), **(lst_data or {}), **atmospheric_data}
+    if optical_indices is not None and lst_data is not None and atmospheric_data['Atmospheric']['NO2'] is not None:
+        result.update(calculate_additional_info(optical_indices, lst_data, atmospheric_data))
+    if unavailable:
+        result['Unavailable'] = unavailable
+    return result
+
+
+def get_locations_info(locations, deadline=BATCH_FETCH_DEADLINE, timings=None):
+    """Fetch every sensor for many locations at once.
+
+    ``locations`` are (latitude, longitude, start_date, end_date) tuples.
+    Repeated locations are fetched once and nearby ones with the same dates
+    share a download; all downloads run on fetch_executor. Returns one
+    result per location, in order, shaped like get_all_crop_and_pest_info's.
+    The longest download of each stage is written to ``timings``.
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    unique = list(dict.fromkeys(locations))
+
+    downloads = {}
+    for name, sensor in SENSORS.items():
+        for bbox, time_interval, members in group_locations(unique, sensor):
+            future = fetch_executor.submit(timed, fetch_group, sensor, bbox, time_interval,
+                                           [member_bbox for _, member_bbox in members])
+            downloads[future] = (name, [location for location, _ in members])
+    wait(downloads, timeout=deadline)
+
+    data = {location: dict.fromkeys(SENSORS) for location in unique}
+    for future, (name, members) in downloads.items():
+        if not future.done():
+            future.cancel()
+            print(f"Sentinel Hub stage {name} missed the {deadline} s deadline")
+            timings[name] = deadline
+            continue
+        summaries, error, duration = future.result()
+        timings[name] = max(timings.get(name, 0), duration)
+        if error is not None:
+            print(f"Sentinel Hub stage {name} failed: {str(error)}")
+            continue
+        for location, summary in zip(members, summaries):
+            data[location][name] = summary
+    timings['total'] = time.perf_counter() - start
+
+    results = {location: combine_stages(stages) for location, stages in data.items()}
+    return [results[location] for location in locations]
 
-    return {**optical_indices, **lst_data, **atmospheric_data, **additional_info}
+
+# Function to get all info from sentinel hub
+def get_all_crop_and_pest_info(latitude, longitude, start_date, end_date, timings=None):
+    """Fetch every sensor concurrently and combine what came back.
+
+    A stage that fails or misses FETCH_DEADLINE is left out of the result
+    and listed under 'Unavailable'; only when nothing came back is the
+    result a 404 error. Stage durations in seconds are written to
+    ``timings`` when a dict is given.
+    """
+    return get_locations_info([(latitude, longitude, start_date, end_date)], FETCH_DEADLINE, timings)[0]
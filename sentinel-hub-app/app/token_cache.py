@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class TokenCache:
+    """Verified JWT claims, keyed by the raw token.
+
+    An entry lives for at most ``ttl`` seconds and never past the token's own
+    ``exp``, so an expired token always falls through to jwt.decode and gets
+    rejected there. Only tokens that verified are ever stored. Once
+    ``max_entries`` is reached, expired entries are dropped first, then the
+    oldest ones.
+    """
+
+    def __init__(self, ttl=300, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token, claims):
+        expires = time.time() + self.ttl
+        if 'exp' in claims:
+            expires = min(expires, claims['exp'])
+        with self._lock:
+            if token not in self._entries and len(self._entries) >= self.max_entries:
+                self._make_room()
+            self._entries[token] = (claims, expires)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _make_room(self):
+        now = time.time()
+        for token in [token for token, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[token]
+        # Dicts keep insertion order, so the first entries are the oldest
+        while len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
@@ -0,0 +1,136 @@
+import datetime
+import logging
+import threading
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+
+class UsageCounter:
+    """In-process buffer of API usage counts, written to Firestore in batches.
+
+    ``add`` only bumps a counter in memory. A background thread flushes the
+    pending counts every ``interval`` seconds, or as soon as ``threshold``
+    calls are pending, as one batched write of atomic ``firestore.Increment``
+    updates, so no request waits on Firestore and concurrent workers never
+    overwrite each other's counts. Counts of a failed flush go back into the
+    buffer for the next one; counts of users whose document no longer exists
+    are dropped. ``close`` flushes what is left on shutdown.
+    """
+
+    # Firestore rejects batches with more writes than this
+    MAX_BATCH_WRITES = 500
+
+    def __init__(self, db, collection='logins', field='calculate_usage', interval=10, threshold=100):
+        self.db = db
+        self.collection = collection
+        self.field = field
+        self.interval = interval
+        self.threshold = threshold
+        self.buffered = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def add(self, user_id, count=1):
+        """Count ``count`` calls for ``user_id``; never touches Firestore."""
+        with self._lock:
+            pending, _ = self._pending.get(user_id, (0, None))
+            self._pending[user_id] = (pending + count, datetime.datetime.utcnow())
+            self.buffered += count
+            if self._thread is None and not self._closed.is_set():
+                # Started lazily, so importing the app spawns no thread
+                self._thread = threading.Thread(target=self._run, name='usage-flush', daemon=True)
+                self._thread.start()
+            if self.buffered >= self.threshold:
+                self._wake.set()
+
+    def flush(self):
+        """Write every pending count now; returns how many calls were written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                total, self.buffered = self.buffered, 0
+            if not pending:
+                return 0
+
+            users = list(pending.items())
+            for start in range(0, len(users), self.MAX_BATCH_WRITES):
+                chunk = users[start:start + self.MAX_BATCH_WRITES]
+                try:
+                    written = self._write(chunk)
+                except Exception as e:
+                    logger.warning("Error flushing API usage, keeping the counts for the next flush: %s", e)
+                    unwritten = users[start:]
+                    with self._lock:
+                        self.failed_flushes += 1
+                        for user_id, (count, last_used) in unwritten:
+                            buffered, newer = self._pending.get(user_id, (0, last_used))
+                            self._pending[user_id] = (buffered + count, max(last_used, newer))
+                            self.buffered += count
+                    return total - sum(count for _, (count, _) in unwritten)
+                dropped = sum(count for user_id, (count, _) in chunk if user_id not in written)
+                total -= dropped
+                with self._lock:
+                    self.flushed += sum(count for user_id, (count, _) in chunk if user_id in written)
+                    self.dropped += dropped
+            with self._lock:
+                self.flushes += 1
+            return total
+
+    def close(self):
+        """Stop the flush thread and write what is still buffered."""
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+        return self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {'buffered': self.buffered, 'flushed': self.flushed, 'dropped': self.dropped,
+                    'flushes': self.flushes, 'failed_flushes': self.failed_flushes}
+
+    def _write(self, users):
+        """Apply one chunk of counts; returns the ids of the users written.
+
+        ``update`` never creates a document, so a deleted account is not
+        brought back by its last calls. One missing document fails the
+        whole batch, so the chunk is then retried without the missing users.
+        """
+        try:
+            self._commit(users)
+        except NotFound:
+            documents = [self.db.collection(self.collection).document(user_id) for user_id, _ in users]
+            existing = {snapshot.id for snapshot in self.db.get_all(documents) if snapshot.exists}
+            missing = [user_id for user_id, _ in users if user_id not in existing]
+            logger.warning("Dropping API usage of missing users: %s", ', '.join(missing))
+            users = [user for user in users if user[0] in existing]
+            if users:
+                self._commit(users)
+        return {user_id for user_id, _ in users}
+
+    def _commit(self, users):
+        batch = self.db.batch()
+        for user_id, (count, last_used) in users:
+            batch.update(self.db.collection(self.collection).document(user_id), {
+                self.field: firestore.Increment(count),
+                'last_used': last_used
+            })
+        batch.commit()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._closed.is_set():
+                self.flush()
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """Read-through cache of login documents, keyed by their ``id`` field.
+
+    ``get`` answers from memory while an entry is younger than ``ttl``
+    seconds and queries Firestore otherwise. Unknown ids are not cached, so a
+    user added directly in Firestore can sign in straight away. Once
+    ``max_entries`` users are cached, the least recently used ones are
+    dropped. ``warm`` loads the collection in one read, e.g. at boot, and
+    ``keep_warm`` repeats it in the background so warmed users never expire
+    and most sign-ins never reach Firestore.
+    """
+
+    def __init__(self, db, collection='logins', ttl=600, max_entries=4096):
+        self.db = db
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def get(self, user_id):
+        """Return ``(document_id, data)`` of the user, or None if there is none."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+
+        users_ref = self.db.collection(self.collection).where(
+            filter=FieldFilter('id', '==', user_id)).stream()
+        user_doc = next(users_ref, None)
+        if user_doc is None:
+            self.invalidate(user_id)
+            return None
+
+        data = user_doc.to_dict()
+        with self._lock:
+            self._entries[user_id] = (user_doc.id, data, time.time() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return user_doc.id, data
+
+    def invalidate(self, user_id=None):
+        """Forget one user, or every user when no id is given."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def warm(self):
+        """Load every document of the collection; returns how many users are cached from it.
+
+        Cached users are refreshed in place and users no longer in the
+        collection are dropped. New users are only added while there is
+        room, so warming never evicts a user who signed in.
+        """
+        expires = time.time() + self.ttl
+        entries = {}
+        for user_doc in self.db.collection(self.collection).stream():
+            data = user_doc.to_dict()
+            if 'id' in data:
+                # Like the id query, the first document of a duplicated id wins
+                entries.setdefault(data['id'], (user_doc.id, data, expires))
+        with self._lock:
+            for user_id in [user_id for user_id in self._entries if user_id not in entries]:
+                del self._entries[user_id]
+            warmed = 0
+            for user_id, entry in entries.items():
+                if user_id in self._entries or len(self._entries) < self.max_entries:
+                    self._entries[user_id] = entry
+                    warmed += 1
+        return warmed
+
+    def keep_warm(self, interval=None):
+        """Warm the cache every ``interval`` seconds (half the ttl by default) on a background thread."""
+        if interval is None:
+            interval = self.ttl / 2
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='user-cache-warm', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the warming thread."""
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _run(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                self.warm()
+            except Exception as e:
+                logger.warning("Error warming the sign-in cache: %s", e)
@@ -0,0 +1,65 @@
+"""Compare per-request token handling before and after the claims cache.
+
+Before, token_required verified the token and the view decoded it again to
+read ``sub``; now the decorator verifies once and polling clients hit the
+TokenCache. Run from sentinel-hub-app:  python test/bench_token.py
+"""
+import datetime
+import os
+import sys
+import timeit
+
+import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from token_cache import TokenCache  # noqa: E402
+
+SECRET_KEY = 'benchmark-secret-key-of-thirty-two-bytes'
+NUMBER = 20000
+
+
+def make_token(user_id):
+    payload = {
+        'sub': user_id,
+        'iat': datetime.datetime.utcnow(),
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+
+
+def double_decode(token):
+    # What token_required and calculate() did between them
+    jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+    return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])['sub']
+
+
+def cached_verify(cache, token):
+    # app.verify_token, followed by the view reading g.claims['sub']
+    claims = cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        cache.put(token, claims)
+    return claims['sub']
+
+
+def best(statement):
+    return min(timeit.repeat(statement, number=NUMBER, repeat=5)) / NUMBER
+
+
+def main():
+    token = make_token('user-1')
+    cache = TokenCache()
+
+    before = best(lambda: double_decode(token))
+    cold = best(lambda: cached_verify(TokenCache(), token))
+    warm = best(lambda: cached_verify(cache, token))
+
+    print(f"{'path':<28} {'us/request':>10} {'speedup':>8}")
+    print(f"{'decorator + view decode':<28} {before * 1e6:>10.2f} {1:>7.1f}x")
+    print(f"{'single decode (cache miss)':<28} {cold * 1e6:>10.2f} {before / cold:>7.1f}x")
+    print(f"{'cached claims (polling)':<28} {warm * 1e6:>10.2f} {before / warm:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import os
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+import numpy as np
+from sentinelhub import BBox, CRS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+# The module's own cache is replaced below; keep it from creating ./cache
+os.environ.setdefault('RASTER_CACHE_DIR', tempfile.mkdtemp())
+
+import sentinel_hub_func  # noqa: E402
+from sentinel_hub_func import (GROUP_AREA_RATIO, OPTICAL_BUFFER, SENSORS, combine_stages, get_locations_info,  # noqa: E402
+                               group_locations, window)
+
+
+class FakeRasterCache:
+    """Renders every request's bbox from linear fields of longitude and latitude, counting requests per collection.
+
+    Optical rasters are the INT16 codes of NDVI = 100 * (lon - 10), NDWI =
+    100 * (lat - 45) and NDMI = 0.5; Sentinel-3 bands are S8 = 10 * (lon -
+    10) and S9 = 10 * (lat - 45); Sentinel-5P has NO2 = 10 * (lon - 10),
+    O3 = 10 * (lat - 45) and no SO2 data. A window sliced from the wrong
+    place of a shared download thus gives another location's values.
+    """
+
+    def __init__(self):
+        self.requests = Counter()
+
+    def get_data(self, sentinel_request):
+        payload = sentinel_request.payload
+        collection = payload['input']['data'][0]['type']
+        self.requests[collection] += 1
+        min_x, min_y, max_x, max_y = payload['input']['bounds']['bbox']
+        width, height = payload['output']['width'], payload['output']['height']
+        lon = min_x + (np.arange(width) + 0.5) * (max_x - min_x) / width
+        lat = max_y - (np.arange(height) + 0.5) * (max_y - min_y) / height
+        lon, lat = np.meshgrid(lon - 10, lat - 45)
+        if collection == 'sentinel-2-l2a':
+            bands = [100 * lon, 100 * lat, np.full_like(lon, 0.5)]
+            return [np.round(np.stack(bands, axis=-1) * 10000).astype(np.int16)]
+        if collection == 'sentinel-3-slstr':
+            return [np.stack([10 * lon, 10 * lat], axis=-1).astype(np.float32)]
+        return [np.stack([10 * lon, 10 * lat, np.full_like(lon, np.nan)], axis=-1).astype(np.float32)]
+
+
+def flatten(result, prefix=''):
+    """The numeric leaves of a location's result, keyed by their path."""
+    leaves = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            leaves.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, float):
+            leaves[prefix + key] = value
+    return leaves
+
+
+# One pixel of each field's gradient: values may differ by this much when
+# a location is cut from a shared download rather than fetched alone
+TOLERANCE = {'NDVI': 100 * 1.5e-4, 'NDWI': 100 * 1.5e-4, 'NDMI': 1e-4, 'LST': 10 * 5e-3, 'Atmospheric': 10 * 7e-3}
+
+MAY = ('2024-05-01', '2024-05-31')
+JUNE = ('2024-06-01', '2024-06-30')
+
+
+class GroupLocationsTests(unittest.TestCase):
+    side = 2 * OPTICAL_BUFFER
+
+    def groups(self, *offsets, time_intervals=None):
+        locations = [(45 + dy * self.side, 10 + dx * self.side, *(time_intervals or {}).get(i, MAY))
+                     for i, (dx, dy) in enumerate(offsets)]
+        return [[location for location, _ in members] for _, _, members in group_locations(locations, SENSORS['optical'])], locations
+
+    def test_overlapping_neighbours_share_a_download(self):
+        groups, locations = self.groups((0, 0), (0.5, 0.5))
+        self.assertEqual(groups, [locations])
+
+    def test_union_is_limited_to_the_area_ratio(self):
+        # Side by side, the union stays within the ratio until the centres
+        # are (2 * ratio - 1) sides apart, even past touching
+        groups, _ = self.groups((0, 0), (2 * GROUP_AREA_RATIO - 1 - 0.05, 0))
+        self.assertEqual(len(groups), 1)
+        groups, _ = self.groups((0, 0), (2 * GROUP_AREA_RATIO - 1 + 0.05, 0))
+        self.assertEqual(len(groups), 2)
+        # Diagonally, the union grows with the square of the offset
+        groups, _ = self.groups((0, 0), (0.9, 0.9))
+        self.assertEqual(len(groups), 2)
+
+    def test_different_dates_never_share_a_download(self):
+        groups, _ = self.groups((0, 0), (0.1, 0.1), time_intervals={1: JUNE})
+        self.assertEqual(len(groups), 2)
+
+    def test_groups_stay_within_the_request_size_limit(self):
+        # A location alone is 29 pixels tall, the pair 43
+        with mock.patch.object(sentinel_hub_func, 'MAX_REQUEST_PIXELS', 35):
+            groups, _ = self.groups((0, 0), (0.5, 0.5))
+        self.assertEqual(len(groups), 2)
+
+    def test_group_bbox_covers_its_members(self):
+        locations = [(45, 10, *MAY), (45.001, 10.0015, *MAY), (44.9995, 10.002, *MAY)]
+        (bbox, time_interval, members), = group_locations(locations, SENSORS['optical'])
+        self.assertEqual(time_interval, MAY)
+        for _, member_bbox in members:
+            self.assertLessEqual(bbox.min_x, member_bbox.min_x)
+            self.assertLessEqual(bbox.min_y, member_bbox.min_y)
+            self.assertGreaterEqual(bbox.max_x, member_bbox.max_x)
+            self.assertGreaterEqual(bbox.max_y, member_bbox.max_y)
+
+
+class WindowTests(unittest.TestCase):
+    def test_slices_the_pixels_of_a_member(self):
+        raster = np.arange(100).reshape(10, 10)
+        bbox = BBox((0, 0, 10, 10), CRS.WGS84)
+        np.testing.assert_array_equal(window(raster, bbox, BBox((2, 6, 5, 9), CRS.WGS84)), raster[1:4, 2:5])
+        np.testing.assert_array_equal(window(raster, bbox, bbox), raster)
+
+    def test_keeps_at_least_one_pixel(self):
+        raster = np.arange(16).reshape(4, 4)
+        self.assertEqual(window(raster, BBox((0, 0, 4, 4), CRS.WGS84), BBox((1.1, 1.1, 1.2, 1.2), CRS.WGS84)).shape, (1, 1))
+
+
+class LocationsInfoTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = FakeRasterCache()
+        patcher = mock.patch.object(sentinel_hub_func, 'raster_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def alone(self, locations):
+        return [get_locations_info([location])[0] for location in locations]
+
+    def assert_same_results(self, grouped, alone):
+        for grouped_result, alone_result in zip(grouped, alone):
+            self.assertEqual(grouped_result.get('Unavailable'), alone_result.get('Unavailable'))
+            self.assertEqual(grouped_result.get('Insights'), alone_result.get('Insights'))
+            grouped_values, alone_values = flatten(grouped_result), flatten(alone_result)
+            self.assertEqual(grouped_values.keys(), alone_values.keys())
+            for key, value in grouped_values.items():
+                self.assertAlmostEqual(value, alone_values[key], delta=TOLERANCE[key.split('.')[0]], msg=key)
+
+    def test_grouped_results_match_each_location_fetched_alone(self):
+        near = [(45.0, 10.0, *MAY), (45.0, 10.002, *MAY), (45.001, 10.001, *MAY)]
+        locations = near + [(45.05, 10.05, *MAY), (45.0, 10.0, *JUNE), near[1]]
+        grouped = get_locations_info(locations)
+        self.assertEqual(self.cache.requests, {'sentinel-2-l2a': 3, 'sentinel-3-slstr': 2, 'sentinel-5p-l2': 3})
+
+        self.assert_same_results(grouped, self.alone(locations))
+        self.assertEqual(grouped[-1], grouped[1])
+        # Neighbours differ by more than the tolerance, so a swapped window would show
+        ndvi = [result['NDVI']['mean'] for result in grouped[:3]]
+        self.assertGreater(abs(ndvi[1] - ndvi[0]), 10 * TOLERANCE['NDVI'])
+        self.assertAlmostEqual(grouped[3]['LST']['mean'], 10 * (0.05 + 0.05) / 2, delta=TOLERANCE['LST'])
+
+    def test_repeated_locations_are_fetched_once(self):
+        location = (45.0, 10.0, *MAY)
+        results = get_locations_info([location] * 4)
+        self.assertEqual(self.cache.requests, {'sentinel-2-l2a': 1, 'sentinel-3-slstr': 1, 'sentinel-5p-l2': 1})
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    def test_atmospheric_means_skip_pixels_without_data(self):
+        result, = get_locations_info([(45.0, 10.0, *MAY)])
+        self.assertIsNone(result['Atmospheric']['SO2'])
+        self.assertAlmostEqual(result['Atmospheric']['NO2'], 0, delta=TOLERANCE['Atmospheric'])
+        self.assertEqual(result['Unavailable'], ['SO2'])
+
+
+class CombineStagesTests(unittest.TestCase):
+    optical = {'NDVI': {'mean': 0.4}, 'NDWI': {'mean': 0.1}, 'NDMI': {'mean': 0.2}}
+    lst = {'LST': {'mean': 290.0}}
+
+    def test_nothing_available_is_a_404(self):
+        self.assertEqual(combine_stages({'optical': None, 'lst': None, 'atmospheric': None}),
+                         {'error': 'No data available for the specified parameters', 'status': 404})
+
+    def test_missing_stages_are_listed(self):
+        result = combine_stages({'optical': self.optical, 'lst': None, 'atmospheric': {'NO2': 10.0, 'O3': None, 'SO2': 1.0}})
+        self.assertEqual(result['Unavailable'], ['LST', 'O3'])
+        self.assertEqual(result['NDVI'], {'mean': 0.4})
+        self.assertNotIn('Insights', result)
+
+    def test_insights_need_optical_lst_and_no2(self):
+        result = combine_stages({'optical': self.optical, 'lst': self.lst, 'atmospheric': {'NO2': 10.0, 'O3': 1.0, 'SO2': 1.0}})
+        self.assertNotIn('Unavailable', result)
+        self.assertEqual(result['Insights']['Crop Health'], 'Very Good')
+        self.assertEqual(result['Insights']['Pest Risk'], 'Medium')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from token_cache import TokenCache  # noqa: E402
+
+
+class TokenCacheTests(unittest.TestCase):
+    def test_returns_stored_claims(self):
+        cache = TokenCache()
+        self.assertIsNone(cache.get('token'))
+        cache.put('token', {'user_id': 'alice'})
+        self.assertEqual(cache.get('token'), {'user_id': 'alice'})
+        self.assertEqual(cache.stats(), {'entries': 1, 'hits': 1, 'misses': 1})
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = TokenCache(ttl=300)
+        with mock.patch('token_cache.time.time', return_value=1000):
+            cache.put('token', {'user_id': 'alice'})
+        with mock.patch('token_cache.time.time', return_value=1299):
+            self.assertIsNotNone(cache.get('token'))
+        with mock.patch('token_cache.time.time', return_value=1300):
+            self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_entries_never_outlive_the_token(self):
+        cache = TokenCache(ttl=300)
+        with mock.patch('token_cache.time.time', return_value=1000):
+            cache.put('token', {'user_id': 'alice', 'exp': 1060})
+        with mock.patch('token_cache.time.time', return_value=1060):
+            self.assertIsNone(cache.get('token'))
+
+    def test_full_cache_drops_expired_then_oldest(self):
+        cache = TokenCache(ttl=300, max_entries=3)
+        with mock.patch('token_cache.time.time', return_value=1000):
+            cache.put('a', {'exp': 2000})
+            cache.put('b', {'exp': 1010})
+            cache.put('c', {'exp': 2000})
+        with mock.patch('token_cache.time.time', return_value=1020):
+            cache.put('d', {'exp': 2000})
+            self.assertEqual([cache.get(token) is not None for token in 'abcd'], [True, False, True, True])
+            cache.put('e', {'exp': 2000})
+            self.assertEqual([cache.get(token) is not None for token in 'acde'], [False, True, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import unittest
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from usage import UsageCounter  # noqa: E402
+
+
+class FakeDocument:
+    def __init__(self, collection, id):
+        self.collection = collection
+        self.id = id
+
+    @property
+    def exists(self):
+        return self.id in self.collection.documents
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def document(self, id):
+        return FakeDocument(self, id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.updates = []
+
+    def update(self, reference, data):
+        self.updates.append((reference, data))
+
+    def commit(self):
+        """Applies every update, or none of them, like a Firestore batch."""
+        self.db.commits.append(self.updates)
+        if self.db.fail_commits:
+            self.db.fail_commits -= 1
+            raise RuntimeError('Firestore unavailable')
+        if any(not reference.exists for reference, _ in self.updates):
+            raise NotFound('No document to update')
+        for reference, data in self.updates:
+            document = reference.collection.documents[reference.id]
+            for field, value in data.items():
+                if isinstance(value, firestore.Increment):
+                    document[field] = document.get(field, 0) + value.value
+                else:
+                    document[field] = value
+
+
+class FakeFirestore:
+    """The part of a Firestore client UsageCounter uses, over dicts of documents."""
+
+    def __init__(self, documents):
+        self.logins = FakeCollection(documents)
+        self.commits = []
+        self.fail_commits = 0
+
+    def collection(self, name):
+        assert name == 'logins'
+        return self.logins
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references):
+        return list(references)
+
+
+class UsageCounterTests(unittest.TestCase):
+    def setUp(self):
+        self.documents = {'alice': {'calculate_usage': 5}, 'bob': {}}
+        self.db = FakeFirestore(self.documents)
+        self.counter = UsageCounter(self.db, interval=60, threshold=1000)
+        self.addCleanup(self.counter.close)
+
+    def test_add_only_buffers(self):
+        self.counter.add('alice')
+        self.counter.add('alice', 2)
+        self.counter.add('bob')
+        self.assertEqual(self.db.commits, [])
+        self.assertEqual(self.counter.buffered, 4)
+
+    def test_flush_merges_calls_into_one_increment(self):
+        self.counter.add('alice')
+        self.counter.add('alice', 2)
+        self.counter.add('bob')
+        self.assertEqual(self.counter.flush(), 4)
+
+        self.assertEqual(len(self.db.commits), 1)
+        increments = {reference.id: data['calculate_usage'] for reference, data in self.db.commits[0]}
+        self.assertIsInstance(increments['alice'], firestore.Increment)
+        self.assertEqual({id: increment.value for id, increment in increments.items()}, {'alice': 3, 'bob': 1})
+        self.assertEqual(self.documents['alice']['calculate_usage'], 8)
+        self.assertEqual(self.documents['bob']['calculate_usage'], 1)
+        self.assertIn('last_used', self.documents['alice'])
+        self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(len(self.db.commits), 1)
+
+    def test_batches_are_split_at_the_write_limit(self):
+        self.counter.MAX_BATCH_WRITES = 2
+        for i in range(5):
+            self.documents[f'user{i}'] = {}
+            self.counter.add(f'user{i}')
+        self.assertEqual(self.counter.flush(), 5)
+        self.assertEqual([len(commit) for commit in self.db.commits], [2, 2, 1])
+
+    def test_missing_users_are_dropped(self):
+        self.counter.add('alice', 2)
+        self.counter.add('deleted', 3)
+        with self.assertLogs('usage', 'WARNING') as logs:
+            self.assertEqual(self.counter.flush(), 2)
+        self.assertIn('missing users: deleted', logs.output[0])
+
+        # The batch fails as a whole, then the existing users are written alone
+        self.assertEqual(len(self.db.commits), 2)
+        self.assertEqual([reference.id for reference, _ in self.db.commits[1]], ['alice'])
+        self.assertNotIn('deleted', self.documents)
+        self.assertEqual(self.documents['alice']['calculate_usage'], 7)
+        self.assertEqual((self.counter.flushed, self.counter.dropped), (2, 3))
+
+    def test_failed_flush_keeps_the_counts(self):
+        self.counter.add('alice', 2)
+        self.db.fail_commits = 1
+        with self.assertLogs('usage', 'WARNING'):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.counter.buffered, 2)
+
+        self.counter.add('alice')
+        self.assertEqual(self.counter.flush(), 3)
+        self.assertEqual(self.documents['alice']['calculate_usage'], 8)
+        self.assertEqual(self.counter.failed_flushes, 1)
+
+    def test_threshold_wakes_the_flush_thread(self):
+        counter = UsageCounter(self.db, interval=60, threshold=3)
+        self.addCleanup(counter.close)
+        for _ in range(3):
+            counter.add('bob')
+        deadline = time.time() + 5
+        while not self.db.commits and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.db.commits), 1)
+        self.assertEqual(self.documents['bob']['calculate_usage'], 3)
+
+    def test_close_writes_what_is_left(self):
+        self.counter.add('bob', 4)
+        self.assertEqual(self.counter.close(), 4)
+        self.assertEqual(self.documents['bob']['calculate_usage'], 4)
+        self.assertFalse(self.counter._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from user_cache import UserCache  # noqa: E402
+
+
+class FakeSnapshot:
+    def __init__(self, id, data):
+        self.id = id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeQuery:
+    def __init__(self, collection, user_id):
+        self.collection = collection
+        self.user_id = user_id
+
+    def stream(self):
+        self.collection.queries += 1
+        return (FakeSnapshot(id, data) for id, data in self.collection.documents.items() if data.get('id') == self.user_id)
+
+
+class FakeLogins:
+    """A Firestore collection of login documents, counting the reads UserCache makes."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = 0
+        self.streams = 0
+
+    def where(self, filter):
+        assert (filter.field_path, filter.op_string) == ('id', '==')
+        return FakeQuery(self, filter.value)
+
+    def stream(self):
+        self.streams += 1
+        return (FakeSnapshot(id, data) for id, data in list(self.documents.items()))
+
+
+class FakeFirestore:
+    def __init__(self, documents):
+        self.logins = FakeLogins(documents)
+
+    def collection(self, name):
+        assert name == 'logins'
+        return self.logins
+
+
+class UserCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.documents = {f'doc{i}': {'id': f'user{i}', 'password': f'secret{i}'} for i in range(4)}
+        self.db = FakeFirestore(self.documents)
+        self.logins = self.db.logins
+
+    def cache(self, **kwargs):
+        cache = UserCache(self.db, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_reads_through_once(self):
+        cache = self.cache()
+        self.assertEqual(cache.get('user1'), ('doc1', {'id': 'user1', 'password': 'secret1'}))
+        self.assertEqual(cache.get('user1')[0], 'doc1')
+        self.assertEqual(self.logins.queries, 1)
+        self.assertEqual(cache.stats(), {'entries': 1, 'hits': 1, 'misses': 1})
+
+    def test_unknown_ids_are_not_cached(self):
+        cache = self.cache()
+        self.assertIsNone(cache.get('nobody'))
+        self.documents['doc9'] = {'id': 'nobody', 'password': 'x'}
+        self.assertEqual(cache.get('nobody')[0], 'doc9')
+        self.assertEqual(self.logins.queries, 2)
+
+    def test_entries_expire(self):
+        cache = self.cache(ttl=600)
+        with mock.patch('user_cache.time.time', return_value=1000):
+            cache.get('user1')
+        with mock.patch('user_cache.time.time', return_value=1599):
+            cache.get('user1')
+        self.assertEqual(self.logins.queries, 1)
+        with mock.patch('user_cache.time.time', return_value=1600):
+            cache.get('user1')
+        self.assertEqual(self.logins.queries, 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = self.cache(max_entries=2)
+        cache.get('user0')
+        cache.get('user1')
+        cache.get('user0')
+        cache.get('user2')
+        self.assertEqual(cache.stats()['entries'], 2)
+        queries = self.logins.queries
+        cache.get('user0')
+        cache.get('user2')
+        self.assertEqual(self.logins.queries, queries)
+        cache.get('user1')
+        self.assertEqual(self.logins.queries, queries + 1)
+
+    def test_warm_loads_the_collection(self):
+        self.documents['dup'] = {'id': 'user1', 'password': 'other'}
+        self.documents['no-id'] = {'password': 'x'}
+        cache = self.cache()
+        self.assertEqual(cache.warm(), 4)
+        for i in range(4):
+            self.assertEqual(cache.get(f'user{i}')[0], f'doc{i}')
+        self.assertEqual(self.logins.queries, 0)
+
+    def test_warm_refreshes_and_drops_deleted_users(self):
+        cache = self.cache(ttl=600)
+        with mock.patch('user_cache.time.time', return_value=1000):
+            cache.warm()
+        self.documents['doc1']['password'] = 'changed'
+        del self.documents['doc2']
+        with mock.patch('user_cache.time.time', return_value=1500):
+            cache.warm()
+        with mock.patch('user_cache.time.time', return_value=1700):
+            self.assertEqual(cache.get('user1')[1]['password'], 'changed')
+            self.assertEqual(self.logins.queries, 0)
+            self.assertIsNone(cache.get('user2'))
+
+    def test_warm_never_evicts_users_who_signed_in(self):
+        cache = self.cache(max_entries=2)
+        cache.get('user3')
+        self.assertEqual(cache.warm(), 2)
+        self.assertEqual(cache.stats()['entries'], 2)
+        cache.get('user3')
+        self.assertEqual(self.logins.queries, 1)
+
+    def test_keep_warm_refreshes_in_the_background(self):
+        cache = self.cache(ttl=1)
+        cache.warm()
+        cache.keep_warm(0.05)
+        deadline = time.time() + 5
+        while self.logins.streams < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(self.logins.streams, 3)
+        self.assertEqual(cache.get('user0')[0], 'doc0')
+        self.assertEqual(self.logins.queries, 0)
+
+        cache.close()
+        streams = self.logins.streams
+        time.sleep(0.3)
+        self.assertEqual(self.logins.streams, streams)
+
+    def test_keep_warm_logs_failures_and_carries_on(self):
+        cache = self.cache()
+        stream = self.logins.stream
+        failures = [RuntimeError('Firestore unavailable')]
+
+        def flaky_stream():
+            if failures:
+                raise failures.pop()
+            return stream()
+        self.logins.stream = flaky_stream
+        with self.assertLogs('user_cache', 'WARNING') as logs:
+            cache.keep_warm(0.05)
+            deadline = time.time() + 5
+            while self.logins.streams < 1 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertIn('Firestore unavailable', logs.output[0])
+        self.assertGreaterEqual(self.logins.streams, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()